@@ -120,6 +120,7 @@ def default_config():
 
         # Connection
         connection_reuse=True,
+        http_version=None,
 
         # Response processing
         nobody=False,
@@ -180,6 +181,35 @@ def default_config():
     )
 
 
+DEFAULT_CONFIG = default_config()
+# Config keys which default values are mutable
+MUTABLE_DEFAULT_KEYS = tuple(key for key, value in DEFAULT_CONFIG.items()
+                             if isinstance(value, (dict, list)))
+
+
+def compact_config(config):
+    """
+    Return the items of grab config which values differ from defaults.
+    """
+
+    return {key: value for key, value in config.items()
+            if key not in DEFAULT_CONFIG or DEFAULT_CONFIG[key] != value}
+
+
+def expand_config(config):
+    """
+    Build full grab config from the result of `compact_config` function.
+    """
+
+    full_config = DEFAULT_CONFIG.copy()
+    full_config.update(config)
+    # Default values must not be shared between configs
+    for key in MUTABLE_DEFAULT_KEYS:
+        if key not in config:
+            full_config[key] = copy(DEFAULT_CONFIG[key])
+    return full_config
+
+
 class Grab(DeprecatedThings):
 
     __slots__ = (
@@ -1,8 +1,10 @@
 import re
 import itertools
 import logging
-from random import randint
+from random import randint, sample
 from collections import namedtuple
+from threading import Lock
+import time
 from six.moves.urllib.request import urlopen
 from six.moves.urllib.error import URLError
 
@@ -14,6 +16,18 @@ RE_SIMPLE_PROXY = re.compile(r'^([^:]+):([^:]+)$')
 RE_AUTH_PROXY = re.compile(r'^([^:]+):([^:]+):([^:]+):([^:]+)$')
 PROXY_FIELDS = ('host', 'port', 'username', 'password', 'proxy_type')
 logger = logging.getLogger('grab.proxylist') # pylint: disable=invalid-name
+# Number of consecutive failures after which the proxy is quarantined
+PROXY_FAILURE_LIMIT = 3
+# Duration of first quarantine of the proxy, each next
+# quarantine is twice longer
+PROXY_QUARANTINE_TIME = 30
+PROXY_MAX_QUARANTINE_TIME = 3600
+# Weight of the latest latency in the moving average
+LATENCY_EWMA_WEIGHT = 0.3
+# Latency of the proxy which has no successful requests
+UNKNOWN_LATENCY = 1.0
+# Number of random draws to find two proxies which are not quarantined
+SELECTION_ATTEMPTS = 10
 
 
 class Proxy(namedtuple('Proxy', PROXY_FIELDS)):
@@ -25,6 +39,68 @@ class Proxy(namedtuple('Proxy', PROXY_FIELDS)):
             return '%s:%s' % (self.username, self.password or '')
 
 
+class ProxyStat(object):
+    """
+    Health of the proxy built from results of requests sent through it.
+    """
+
+    __slots__ = ('request_number', 'failure_number', 'consecutive_failures',
+                 'latency', 'quarantine_number', 'quarantine_until',
+                 'active_number', 'reserved_number', 'last_request_time')
+
+    def __init__(self):
+        self.request_number = 0
+        self.failure_number = 0
+        self.consecutive_failures = 0
+        # Moving average of response time
+        self.latency = None
+        self.quarantine_number = 0
+        self.quarantine_until = None
+        # Number of requests which are sent through the proxy right now
+        self.active_number = 0
+        # Number of acquired requests which do not count in
+        # the request rate yet, see `ProxyList.acquire_proxy`
+        self.reserved_number = 0
+        self.last_request_time = None
+
+    def get_success_rate(self):
+        # New proxy gets the benefit of the doubt
+        return ((self.request_number - self.failure_number + 1.0)
+                / (self.request_number + 2.0))
+
+    def get_score(self):
+        """
+        Return the expected time of successful request, lower is better.
+
+        Proxy without completed requests has zero score so it is tried soon.
+        """
+
+        if self.latency is not None:
+            latency = self.latency
+        elif self.request_number:
+            # All requests have failed
+            latency = UNKNOWN_LATENCY
+        else:
+            latency = 0
+        return latency / self.get_success_rate()
+
+    def is_quarantined(self, now):
+        return (self.quarantine_until is not None
+                and self.quarantine_until > now)
+
+    def export(self, now):
+        return {
+            'requests': self.request_number,
+            'failures': self.failure_number,
+            'consecutive_failures': self.consecutive_failures,
+            'success_rate': round(self.get_success_rate(), 3),
+            'latency': (round(self.latency, 3)
+                        if self.latency is not None else None),
+            'quarantined': self.is_quarantined(now),
+            'active': self.active_number,
+        }
+
+
 class InvalidProxyLine(GrabError):
     pass
 
@@ -135,6 +211,11 @@ class ProxyList(object):
         self._source = source
         self._list = []
         self._list_iter = None
+        # Proxy address -> ProxyStat
+        self._stat = {}
+        self._stat_lock = Lock()
+        self.max_connections = None
+        self.request_delay = None
 
     def set_source(self, source):
         """Set the proxy source and use it to load proxy list"""
@@ -155,18 +236,268 @@ class ProxyList(object):
 
     def load(self):
         """Load proxy list from configured proxy source"""
-        self._list = self._source.load()
-        self._list_iter = itertools.cycle(self._list)
+        self.set_list(self._source.load())
+
+    def reload(self):
+        """
+        Load proxy list from configured proxy source again.
+
+        The current list is kept if the source returns no proxies.
+        Returns the number of loaded proxies.
+        """
+
+        items = self._source.load()
+        if items:
+            self.set_list(items)
+        return len(items)
+
+    def set_list(self, items):
+        """
+        Replace the proxy list.
+
+        Health details of proxies which remain in the list are kept.
+        """
+
+        with self._stat_lock:
+            addresses = set(x.get_address() for x in items)
+            for address, stat in list(self._stat.items()):
+                # Proxy with active requests is released later
+                if address not in addresses and not stat.active_number:
+                    del self._stat[address]
+            self._list_iter = itertools.cycle(items)
+            self._list = items
 
     def get_random_proxy(self):
         """Return random proxy"""
-        idx = randint(0, len(self._list) - 1)
-        return self._list[idx]
+        # The list could be replaced by other thread
+        items = self._list
+        return items[randint(0, len(items) - 1)]
 
     def get_next_proxy(self):
         """Return next proxy"""
         return next(self._list_iter)
 
+    def get_proxy_stat(self, address):
+        if address not in self._stat:
+            self._stat[address] = ProxyStat()
+        return self._stat[address]
+
+    def process_result(self, address, is_ok, latency=None, now=None):
+        """
+        Update the health of the proxy with the result of the request.
+
+        Args:
+            :param address: address of the proxy, "host:port"
+            :param is_ok: if False then the request has failed
+                because of the proxy
+            :param latency: response time of the request
+        Returns:
+            True if the proxy has been quarantined
+        """
+
+        if now is None:
+            now = time.time()
+        with self._stat_lock:
+            stat = self.get_proxy_stat(address)
+            stat.request_number += 1
+            if latency is not None:
+                if stat.latency is None:
+                    stat.latency = latency
+                else:
+                    stat.latency += LATENCY_EWMA_WEIGHT * (
+                        latency - stat.latency)
+            if is_ok:
+                stat.consecutive_failures = 0
+                stat.quarantine_number = 0
+                return False
+            stat.failure_number += 1
+            stat.consecutive_failures += 1
+            if stat.consecutive_failures >= PROXY_FAILURE_LIMIT:
+                # Quarantined proxy gets one try after the quarantine,
+                # the next failure quarantines it again for longer time
+                stat.consecutive_failures = PROXY_FAILURE_LIMIT - 1
+                stat.quarantine_until = now + min(
+                    PROXY_MAX_QUARANTINE_TIME,
+                    PROXY_QUARANTINE_TIME * 2 ** stat.quarantine_number)
+                stat.quarantine_number += 1
+                return True
+            return False
+
+    def setup_limits(self, max_connections=None, request_rate=None):
+        """
+        Setup limits of each proxy.
+
+        Args:
+            :param max_connections: max. number of concurrent requests
+                through one proxy
+            :param request_rate: max. number of requests per second
+                through one proxy
+        """
+
+        self.max_connections = max_connections
+        self.request_delay = 1.0 / request_rate if request_rate else None
+
+    def has_limits(self):
+        return bool(self.max_connections or self.request_delay)
+
+    def has_capacity(self, stat, now):
+        if (self.max_connections
+                and stat.active_number >= self.max_connections):
+            return False
+        if self.request_delay:
+            # Reserved request charges the request rate later
+            if stat.reserved_number:
+                return False
+            if (stat.last_request_time is not None
+                    and now - stat.last_request_time < self.request_delay):
+                return False
+        return True
+
+    def select_proxy(self, now, need_capacity=False):
+        """
+        Select proxy with power of two choices, should be called
+        with acquired lock.
+        """
+
+        def is_available(proxy):
+            stat = self.get_proxy_stat(proxy.get_address())
+            return (not stat.is_quarantined(now)
+                    and (not need_capacity or self.has_capacity(stat, now)))
+
+        candidates = []
+        if len(self._list) > 1:
+            for _ in range(SELECTION_ATTEMPTS):
+                candidates = [x for x in sample(self._list, 2)
+                              if is_available(x)]
+                if len(candidates) == 2:
+                    break
+        if len(candidates) < 2:
+            candidates = [x for x in self._list if is_available(x)]
+        if not candidates:
+            if need_capacity:
+                items = [x for x in self._list if self.has_capacity(
+                    self.get_proxy_stat(x.get_address()), now)]
+            else:
+                items = self._list
+            if not items:
+                return None
+            return min(items, key=lambda x: self.get_proxy_stat(
+                x.get_address()).quarantine_until)
+        if len(candidates) > 2:
+            candidates = sample(candidates, 2)
+        return min(candidates, key=lambda x: self.get_proxy_stat(
+            x.get_address()).get_score())
+
+    def get_best_proxy(self, now=None):
+        """
+        Return healthy proxy.
+
+        Two random proxies which are not quarantined are compared and the
+        one with the lower expected time of successful request is returned.
+        If all proxies are quarantined then the proxy which quarantine ends
+        first is returned.
+        """
+
+        if now is None:
+            now = time.time()
+        with self._stat_lock:
+            return self.select_proxy(now)
+
+    def acquire_proxy(self, now=None, charge=True):
+        """
+        Return healthy proxy which has not reached its limits
+        and count new request through it.
+
+        Returns None if all proxies have reached their limits. The proxy
+        should be released with `release_proxy` when the request
+        is completed.
+
+        Args:
+            :param charge: if False then the request is reserved and it
+                counts in the request rate of the proxy only when
+                `charge_proxy` is called, reserved request should be
+                cancelled with `release_proxy` if it is not sent
+        """
+
+        if now is None:
+            now = time.time()
+        with self._stat_lock:
+            proxy = self.select_proxy(now, need_capacity=True)
+            if proxy is not None:
+                stat = self.get_proxy_stat(proxy.get_address())
+                stat.active_number += 1
+                if charge:
+                    stat.last_request_time = now
+                else:
+                    stat.reserved_number += 1
+            return proxy
+
+    def charge_proxy(self, address, now=None):
+        """
+        Count request reserved with `acquire_proxy` in the request
+        rate of the proxy.
+        """
+
+        if now is None:
+            now = time.time()
+        with self._stat_lock:
+            stat = self.get_proxy_stat(address)
+            stat.reserved_number -= 1
+            stat.last_request_time = now
+
+    def release_proxy(self, address, cancel=False):
+        """
+        Release proxy taken with `acquire_proxy`.
+
+        Args:
+            :param cancel: if True then the request reserved with
+                `acquire_proxy` has not been sent and it does not
+                count in the request rate of the proxy
+        """
+
+        with self._stat_lock:
+            stat = self.get_proxy_stat(address)
+            stat.active_number -= 1
+            if cancel:
+                stat.reserved_number -= 1
+
+    def get_capacity_timeout(self, now=None):
+        """
+        Return number of seconds until some proxy gets free capacity
+        because of its request rate.
+
+        Returns None if the time is unknown i.e. proxies wait for
+        completion of active requests.
+        """
+
+        if now is None:
+            now = time.time()
+        if not self.request_delay:
+            return None
+        with self._stat_lock:
+            times = []
+            for proxy in self._list:
+                stat = self.get_proxy_stat(proxy.get_address())
+                if (not self.max_connections
+                        or stat.active_number < self.max_connections):
+                    times.append(0 if stat.last_request_time is None else
+                                 stat.last_request_time + self.request_delay)
+            if times:
+                return max(0, min(times) - now)
+            return None
+
+    def get_stats(self, now=None):
+        """
+        Return dict of health details of proxies.
+        """
+
+        if now is None:
+            now = time.time()
+        with self._stat_lock:
+            return dict((x.get_address(),
+                         self.get_proxy_stat(x.get_address()).export(now))
+                        for x in self._list)
+
     def size(self):
         """Return number of proxies in the list"""
         return len(self._list)
@@ -0,0 +1,55 @@
+import logging
+import os
+from argparse import ArgumentParser
+
+from grab.spider.coordinator import (
+    CoordinatorServer, DEFAULT_HOST, DEFAULT_PORT,
+)
+from grab.util.log import default_logging
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.script.coordinator')
+# pylint: enable=invalid-name
+
+# Environment variable with default authentication key
+AUTHKEY_ENV_NAME = 'GRAB_COORDINATOR_AUTHKEY'
+
+
+def setup_arg_parser(parser):
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--authkey', default=os.environ.get(AUTHKEY_ENV_NAME),
+                        help='Secret key shared with spiders, by default '
+                             'it is taken from %s environment variable'
+                             % AUTHKEY_ENV_NAME)
+    parser.add_argument('--max-connections-per-host', type=int, default=None,
+                        help='Max. number of tasks of one host which are '
+                             'processed at the same time')
+    parser.add_argument('--host-request-delay', type=float, default=None,
+                        help='Min. number of seconds between two tasks '
+                             'of one host')
+
+
+def main(host=DEFAULT_HOST, port=DEFAULT_PORT, authkey=None,
+         max_connections_per_host=None, host_request_delay=None,
+         **kwargs): # pylint: disable=unused-argument
+    default_logging()
+    server = CoordinatorServer(
+        (host, port), authkey=authkey,
+        max_connections_per_host=max_connections_per_host,
+        host_request_delay=host_request_delay,
+    )
+    logger.debug('Coordinator is listening on %s:%d', host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    PARSER = ArgumentParser()
+    setup_arg_parser(PARSER)
+    main(**vars(PARSER.parse_args()))
@@ -4,6 +4,7 @@ import json
 from argparse import ArgumentParser
 import six
 
+from grab.spider.shard import ShardSupervisor
 from grab.util.config import build_spider_config, build_root_config
 from grab.util.module import load_spider_class
 from grab.util.log import default_logging
@@ -33,8 +34,13 @@ def setup_arg_parser(parser):
     parser.add_argument('--settings-module', type=str, default='settings')
     parser.add_argument('--api-port', type=int, default=None)
     parser.add_argument('--parser-pool-size', type=int, default=2)
+    parser.add_argument('--parser-backend', default='thread',
+                        help='Run task handlers in threads or processes')
     parser.add_argument('--grab-transport', default='pycurl')
     parser.add_argument('--network-service', default='multicurl')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of spider processes, each process '
+                             'handles its own part of hosts')
 
 
 def get_lock_key(spider_name, lock_key=None, # pylint: disable=unused-argument
@@ -68,16 +74,52 @@ def save_list(lst, path):
         out.write(b'\n'.join(lines) + b'\n')
 
 
+def setup_spider(bot, spider_config, disable_proxy=False, shard=None):
+    """
+    Configure task queue, cache and proxy list of the spider.
+
+    If `shard` is given then the task queue of that shard
+    of multi-process spider is configured.
+    """
+
+    opt_queue = spider_config.get('queue')
+    if opt_queue:
+        opt_queue = dict(opt_queue)
+        if shard is not None:
+            queue_name = (opt_queue.get('queue_name')
+                          or 'task_queue_%s' % bot.get_spider_name())
+            opt_queue['queue_name'] = '%s_shard%d' % (queue_name, shard)
+        bot.setup_queue(**opt_queue)
+
+    opt_cache = spider_config.get('cache')
+    if opt_cache:
+        bot.setup_cache(**opt_cache)
+
+    opt_proxy_list = spider_config.get('proxy_list')
+    if opt_proxy_list:
+        if disable_proxy:
+            logger.debug('Proxy servers disabled via command line')
+        else:
+            bot.load_proxylist(**opt_proxy_list)
+
+    opt_ifaces = spider_config.get('command_interfaces')
+    if opt_ifaces:
+        for iface_config in opt_ifaces:
+            bot.controller.add_interface(**iface_config)
+
+
 def main(spider_name, thread_number=None,
          settings_module='settings', network_logs=False,
          disable_proxy=False, ignore_lock=False,
          disable_report=False,
          api_port=None,
          parser_pool_size=2,
+         parser_backend='thread',
          grab_log_file=None,
          network_log_file=None,
          network_service=None,
          grab_transport=None,
+         workers=None,
          **kwargs): # pylint: disable=unused-argument
     default_logging(
         grab_log=grab_log_file,
@@ -104,32 +146,24 @@ def main(spider_name, thread_number=None,
         args=spider_args,
         http_api_port=api_port,
         parser_pool_size=parser_pool_size,
+        parser_backend=parser_backend,
         network_service=network_service,
         grab_transport=grab_transport,
 
     )
-    opt_queue = spider_config.get('queue')
-    if opt_queue:
-        bot.setup_queue(**opt_queue)
-
-    opt_cache = spider_config.get('cache')
-    if opt_cache:
-        bot.setup_cache(**opt_cache)
-
-    opt_proxy_list = spider_config.get('proxy_list')
-    if opt_proxy_list:
-        if disable_proxy:
-            logger.debug('Proxy servers disabled via command line')
-        else:
-            bot.load_proxylist(**opt_proxy_list)
-
-    opt_ifaces = spider_config.get('command_interfaces')
-    if opt_ifaces:
-        for iface_config in opt_ifaces:
-            bot.controller.add_interface(**iface_config)
-
     try:
-        bot.run()
+        if workers and workers > 1:
+            # Database connections must not be shared between
+            # processes so each worker configures the spider itself
+            supervisor = ShardSupervisor(
+                bot, workers,
+                setup_worker=lambda spider, shard: setup_spider(
+                    spider, spider_config, disable_proxy, shard),
+            )
+            supervisor.run()
+        else:
+            setup_spider(bot, spider_config, disable_proxy)
+            bot.run()
     except KeyboardInterrupt:
         pass
 
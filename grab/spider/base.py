@@ -2,11 +2,13 @@
 # pylint: disable=too-many-lines
 # TODO: cache_service input task queue should be powered by task queue backend
 import logging
+import os
 import time
 from random import randint
 from copy import deepcopy
 from traceback import format_exception, format_stack
 from datetime import datetime
+from threading import Lock
 
 from six.moves.queue import Queue, Empty
 import six
@@ -29,6 +31,15 @@ from grab.spider.cache_service import CacheReaderService, CacheWriterService
 from grab.spider.task_generator_service import TaskGeneratorService
 from grab.spider.task_dispatcher_service import TaskDispatcherService
 from grab.spider.http_api_service import HttpApiService
+from grab.spider.proxy_refresh_service import ProxyRefreshService
+from grab.spider.base_service import (
+    WAKEUP_TIMEOUT, DELAYED_TASK_CHECK_INTERVAL,
+)
+from grab.spider.scheduler import HostScheduler, get_task_host
+from grab.spider.concurrency import ConcurrencyController
+from grab.spider.dupe_filter.base import build_task_fingerprint
+from grab.spider.task_codec import encode_task, decode_task
+from grab.spider.checkpoint import save_checkpoint, load_checkpoint
 
 DEFAULT_TASK_PRIORITY = 100
 DEFAULT_NETWORK_STREAM_NUMBER = 3
@@ -36,6 +47,16 @@ DEFAULT_TASK_TRY_LIMIT = 5
 DEFAULT_NETWORK_TRY_LIMIT = 5
 RANDOM_TASK_PRIORITY_RANGE = (50, 100)
 NULL = object()
+# Abbreviations of network errors which are caused by the proxy:
+# failed connection to the proxy or failed proxy handshake.
+# Other errors e.g. timeout of the response could be caused
+# by the target server.
+PROXY_ERROR_ABBRS = frozenset([
+    # Multicurl network service, see pycurl E_* codes
+    'couldnt-connect', 'couldnt-resolve-proxy', 'proxy',
+    # Threaded network service, see names of exception classes
+    'grab-connection-error', 'connect-timeout-error', 'proxy-error',
+])
 
 # pylint: disable=invalid-name
 logger = logging.getLogger('grab.spider.base')
@@ -129,9 +150,20 @@ class Spider(object):
             args=None,
             parser_requests_per_process=10000,
             parser_pool_size=1,
+            parser_backend='thread',
             http_api_port=None,
             network_service='multicurl',
             grab_transport='pycurl',
+            max_connections_per_host=None,
+            host_request_delay=None,
+            adaptive_concurrency=False,
+            checkpoint_path=None,
+            checkpoint_interval=None,
+            curl_max_connects=None,
+            curl_max_host_connections=None,
+            http2_multiplex=False,
+            max_connections_per_proxy=None,
+            proxy_request_rate=None,
             # Deprecated
             transport=None):
         """
@@ -151,9 +183,47 @@ class Spider(object):
         * retry_rebuild_user_agent - generate new random user-agent for each
             network request which is performed again due to network error
         * args - command line arguments parsed with `setup_arg_parser` method
+        * parser_backend - could be "thread" or "process", in "process" mode
+            task handlers are executed in forked processes
+        * network_service - could be "multicurl", "threaded" or "asyncio",
+            "asyncio" service drives pycurl sockets with asyncio event loop
+        * max_connections_per_host - max. number of concurrent network
+            requests to one host
+        * host_request_delay - min. number of seconds between two network
+            requests to the same host
+        * adaptive_concurrency - if True then the number of concurrent
+            network requests is changed on the fly: it grows while requests
+            complete successfully and it is cut on network errors, 429 and
+            5xx responses; `thread_number` and `max_connections_per_host`
+            are used as upper limits
+        * checkpoint_path - path to file where the state of the spider
+            is saved when the spider stops, see `checkpoint` method
+        * checkpoint_interval - if it is set then the state of the spider
+            is saved each `checkpoint_interval` seconds
+        * curl_max_connects - max. number of idle connections which
+            "multicurl" and "asyncio" network services keep open to reuse
+            them (CURLMOPT_MAXCONNECTS)
+        * curl_max_host_connections - max. number of connections to one
+            host opened by "multicurl" and "asyncio" network services
+            (CURLMOPT_MAX_HOST_CONNECTIONS)
+        * http2_multiplex - if True then "multicurl" and "asyncio" network
+            services request HTTP/2 and send concurrent requests to one host
+            as streams of one connection (CURLPIPE_MULTIPLEX)
+        * max_connections_per_proxy - max. number of concurrent network
+            requests through one proxy of proxy list
+        * proxy_request_rate - max. number of network requests per second
+            through one proxy of proxy list
         """
 
         self.fatal_error_queue = Queue()
+        # Number of tasks taken from the task queue (or generated by
+        # task generator) which processing is not completed yet
+        self.active_task_number = 0
+        # id(task) -> task, active tasks which are saved in checkpoint
+        self.active_tasks = {}
+        self.active_task_lock = Lock()
+        # Services of the running spider
+        self.running_services = []
         self.task_queue_parameters = None
         self.http_api_port = http_api_port
         self._started = None
@@ -185,6 +255,33 @@ class Spider(object):
             network_try_limit or
             int(self.config.get('network_try_limit',
                                 DEFAULT_NETWORK_TRY_LIMIT)))
+        self.max_connections_per_host = (
+            max_connections_per_host or
+            self.config.get('max_connections_per_host'))
+        self.host_request_delay = (
+            host_request_delay or
+            self.config.get('host_request_delay'))
+        self.task_scheduler = None
+        self.dupe_filter = None
+        # Routes tasks between processes of multi-process spider
+        self.shard_router = None
+        self.checkpoint_path = (
+            checkpoint_path or
+            self.config.get('checkpoint_path'))
+        self.checkpoint_interval = (
+            checkpoint_interval or
+            self.config.get('checkpoint_interval'))
+        if self.checkpoint_interval and not self.checkpoint_path:
+            raise SpiderMisuseError('Option checkpoint_interval requires '
+                                    'checkpoint_path option')
+        if (adaptive_concurrency
+                or self.config.get('adaptive_concurrency')):
+            self.concurrency_controller = ConcurrencyController(
+                max_limit=self.thread_number,
+                max_host_limit=self.max_connections_per_host,
+            )
+        else:
+            self.concurrency_controller = None
         self._grab_config = {}
         if priority_mode not in ['random', 'const']:
             raise SpiderMisuseError('Value of priority_mode option should be '
@@ -200,25 +297,54 @@ class Spider(object):
         self.proxylist = None
         self.proxy = None
         self.proxy_auto_change = False
+        self.max_connections_per_proxy = (
+            max_connections_per_proxy or
+            self.config.get('max_connections_per_proxy'))
+        self.proxy_request_rate = (
+            proxy_request_rate or
+            self.config.get('proxy_request_rate'))
+        # id(task) -> proxy acquired for the task
+        self.task_proxies = {}
+        # Time when tasks started to wait for proxy with free capacity
+        self.proxy_wait_started = None
+        self.proxy_wait_lock = Lock()
+        self.proxy_refresh_service = None
         self.interrupted = False
         self.cache_reader_service = None
         self.cache_writer_service = None
         self.parser_pool_size = parser_pool_size
+        if parser_backend not in ('thread', 'process'):
+            raise SpiderMisuseError('Value of parser_backend option should be '
+                                    '"thread" or "process"')
+        if parser_backend == 'process' and not hasattr(os, 'fork'):
+            raise SpiderMisuseError('Parser backend "process" is not '
+                                    'supported on this platform')
+        self.parser_backend = parser_backend
         self.parser_service = ParserService(
             spider=self,
             pool_size=self.parser_pool_size,
+            backend=self.parser_backend,
         )
         if transport is not None:
             warn('The "transport" argument of Spider constructor is'
                  ' deprecated. Use "network_service" argument.')
             network_service = transport
-        assert network_service in ('multicurl', 'threaded')
+        assert network_service in ('multicurl', 'threaded', 'asyncio')
+        curl_options = {
+            'max_connects': (curl_max_connects or
+                             self.config.get('curl_max_connects')),
+            'max_host_connections': (
+                curl_max_host_connections or
+                self.config.get('curl_max_host_connections')),
+            'multiplex': (http2_multiplex or
+                          self.config.get('http2_multiplex', False)),
+        }
         if network_service == 'multicurl':
             from grab.spider.network_service.multicurl import (
                 NetworkServiceMulticurl
             )
             self.network_service = NetworkServiceMulticurl(
-                self, self.thread_number
+                self, self.thread_number, **curl_options
             )
         elif network_service == 'threaded':
             # pylint: disable=no-name-in-module, import-error
@@ -228,6 +354,14 @@ class Spider(object):
             self.network_service = NetworkServiceThreaded(
                 self, self.thread_number
             )
+        elif network_service == 'asyncio':
+            # pylint: disable=no-name-in-module, import-error
+            from grab.spider.network_service.asyncio import (
+                NetworkServiceAsyncio
+            )
+            self.network_service = NetworkServiceAsyncio(
+                self, self.thread_number, **curl_options
+            )
         self.task_dispatcher = TaskDispatcherService(self)
         if self.http_api_port:
             self.http_api_service = HttpApiService(self)
@@ -270,7 +404,8 @@ class Spider(object):
         Setup queue.
 
         :param backend: Backend name
-            Should be one of the following: 'memory', 'redis' or 'mongo'.
+            Should be one of the following: 'memory', 'sqlite', 'redis'
+            or 'mongo'.
         :param kwargs: Additional credentials for backend.
         """
         if backend == 'mongo':
@@ -281,12 +416,79 @@ class Spider(object):
                          globals(), locals(), ['foo'])
         self.task_queue = mod.QueueBackend(spider_name=self.get_spider_name(),
                                            **kwargs)
+        self.task_queue.add_put_hook(self.network_service.notify_new_task)
+        if self.max_connections_per_host or self.host_request_delay:
+            self.task_scheduler = HostScheduler(
+                self.task_queue,
+                max_connections_per_host=self.max_connections_per_host,
+                host_request_delay=self.host_request_delay,
+                concurrency_controller=self.concurrency_controller,
+            )
+        else:
+            self.task_scheduler = None
+
+    def setup_dupe_filter(self, backend='memory', **kwargs):
+        """
+        Setup filter which drops new tasks with already seen requests.
+
+        :param backend: Backend name
+            Should be one of the following: 'memory', 'bloom' or 'sqlite'.
+        :param kwargs: Additional options for backend.
+        """
+        logger.debug('Using %s backend for dupe filter', backend)
+        mod = __import__('grab.spider.dupe_filter.%s' % backend,
+                         globals(), locals(), ['foo'])
+        self.dupe_filter = mod.DupeFilterBackend(
+            spider_name=self.get_spider_name(), **kwargs
+        )
 
     def add_task(self, task, queue=None, raise_error=False):
         """
         Add task to the task queue.
         """
 
+        # Tasks put into the given queue (e.g. tasks forwarded
+        # by cache reader) have been filtered already
+        check_dupe = queue is None
+        if (check_dupe and self.shard_router
+                and not self.shard_router.is_local_task(task)):
+            self.shard_router.route_task(task)
+            return True
+        queue = self.get_queue_for_new_task(queue)
+        if self.prepare_new_task(task, raise_error, check_dupe):
+            # TODO: keep original task priority if it was set explicitly
+            # WTF the previous comment means?
+            queue.put(
+                task, priority=task.priority, schedule_time=task.schedule_time
+            )
+            return True
+        else:
+            return False
+
+    def add_tasks(self, tasks, queue=None, raise_error=False):
+        """
+        Add multiple tasks to the task queue with one call of queue backend.
+
+        Returns number of added tasks.
+        """
+
+        check_dupe = queue is None
+        if check_dupe and self.shard_router:
+            local_tasks = []
+            for task in tasks:
+                if self.shard_router.is_local_task(task):
+                    local_tasks.append(task)
+                else:
+                    self.shard_router.route_task(task)
+            tasks = local_tasks
+        queue = self.get_queue_for_new_task(queue)
+        items = [(x, x.priority, x.schedule_time) for x in tasks
+                 if self.prepare_new_task(x, raise_error, check_dupe)]
+        if items:
+            queue.put_many(items)
+        return len(items)
+
+    def get_queue_for_new_task(self, queue):
         if queue is None:
             if self.cache_reader_service:
                 queue = self.cache_reader_service.input_queue
@@ -295,6 +497,16 @@ class Spider(object):
         if queue is None:
             raise SpiderMisuseError('You should configure task queue before '
                                     'adding tasks. Use `setup_queue` method.')
+        return queue
+
+    def prepare_new_task(self, task, raise_error, check_dupe=False):
+        """
+        Set priority of new task, check its URL and check
+        if it is a duplicate of some previous task.
+
+        Returns False if the task could not be added to the task queue.
+        """
+
         if task.priority is None or not task.priority_set_explicitly:
             task.priority = self.generate_task_priority()
             task.priority_set_explicitly = False
@@ -312,23 +524,199 @@ class Spider(object):
                     '%s\nTraceback:\n%s', msg, ''.join(format_stack()),
                 )
                 return False
+        elif check_dupe and self.is_duplicate_task(task):
+            self.stat.inc('spider:task-duplicate')
+            self.stat.inc('spider:task-%s-duplicate' % task.name)
+            return False
         else:
-            # TODO: keep original task priority if it was set explicitly
-            # WTF the previous comment means?
-            queue.put(
-                task, priority=task.priority, schedule_time=task.schedule_time
-            )
             return True
 
+    def is_duplicate_task(self, task):
+        """
+        Check if the request of the task has been seen before.
+
+        Retries of tasks, tasks with `refresh_cache` or `dont_filter`
+        option are never treated as duplicates.
+        """
+
+        if (self.dupe_filter is None
+                or task.refresh_cache
+                or task.get('dont_filter')
+                or task.network_try_count > 0
+                or task.task_try_count > 1):
+            return False
+        return not self.dupe_filter.add(build_task_fingerprint(task))
+
+    def checkpoint(self, path=None):
+        """
+        Save the state of the spider into the file.
+
+        The checkpoint contains tasks which are not processed yet
+        (tasks of memory task queue, tasks which processing is
+        in progress and new tasks which are not put into the task queue
+        yet), stat counters and the state of duplicate task filter.
+        If spider is running then its services are paused while
+        the state is collected. Do not call this method from
+        task handlers.
+
+        :param path: path to checkpoint file, by default
+            `checkpoint_path` option is used
+        """
+
+        if path is None:
+            path = self.checkpoint_path
+        if path is None:
+            raise SpiderMisuseError('Checkpoint path is not configured')
+        services = self.running_services
+        for srv in services:
+            srv.pause()
+        try:
+            state = self.build_checkpoint_state()
+        finally:
+            for srv in services:
+                srv.resume()
+        save_checkpoint(path, state)
+        logger.debug('Saved checkpoint: %s (%d tasks)', path,
+                     len(state['tasks']) + len(state['new_tasks']))
+
+    def build_checkpoint_state(self):
+        # Items of (task, priority, schedule_time)
+        tasks = []
+        # Tasks which have not been added to the task queue yet
+        new_tasks = []
+        if self.task_queue:
+            items = self.task_queue.dump()
+            if items is not None:
+                tasks.extend(items)
+        if self.task_scheduler:
+            tasks.extend((x, x.priority, None)
+                         for x in self.task_scheduler.dump())
+        if self.cache_reader_service:
+            tasks.extend(self.cache_reader_service.input_queue.dump())
+        queue = self.task_dispatcher.input_queue
+        with queue.mutex:
+            results = list(queue.queue)
+        found_tasks = set()
+        for result, _, meta in results:
+            if isinstance(result, Task):
+                found_tasks.add(id(result))
+                if meta and meta.get('source') == 'cache_reader':
+                    tasks.append((result, result.priority, None))
+                else:
+                    new_tasks.append(result)
+        with self.active_task_lock:
+            active_tasks = list(self.active_tasks.values())
+        # Processing of active tasks is started again after resume
+        for task in active_tasks:
+            if id(task) not in found_tasks:
+                tasks.append((task, task.priority, None))
+        return {
+            'tasks': [(encode_task(task), priority, schedule_time)
+                      for task, priority, schedule_time in tasks],
+            'new_tasks': [encode_task(x) for x in new_tasks],
+            'stat': {
+                'counters': dict(self.stat.counters),
+                'collections': dict(self.stat.collections),
+            },
+            'dupe_filter': (self.dupe_filter.get_state()
+                            if self.dupe_filter else None),
+            'generated_task_number': (
+                self.task_generator_service.generated_number),
+            'task_generator_completed': (
+                self.task_generator_service.is_completed),
+        }
+
+    def resume(self, path=None):
+        """
+        Restore the state of the spider saved with `checkpoint` method.
+
+        Call it before `run` method after task queue and duplicate
+        task filter are configured. Tasks which have been generated
+        by `task_generator` before the checkpoint are skipped.
+
+        :param path: path to checkpoint file, by default
+            `checkpoint_path` option is used
+        """
+
+        if path is None:
+            path = self.checkpoint_path
+        if path is None:
+            raise SpiderMisuseError('Checkpoint path is not configured')
+        state = load_checkpoint(path)
+        if self.task_queue is None:
+            self.setup_queue()
+        self.stat.counters.update(state['stat']['counters'])
+        self.stat.collections.update(state['stat']['collections'])
+        if self.dupe_filter and state['dupe_filter'] is not None:
+            self.dupe_filter.set_state(state['dupe_filter'])
+        self.task_queue.put_many([
+            (decode_task(data), priority, schedule_time)
+            for data, priority, schedule_time in state['tasks']
+        ])
+        self.add_tasks([decode_task(x) for x in state['new_tasks']])
+        generator_service = self.task_generator_service
+        if state['task_generator_completed']:
+            generator_service.real_generator = iter(())
+        else:
+            generator_service.skip_number = state['generated_task_number']
+        generator_service.generated_number = 0
+        logger.debug('Restored checkpoint: %s', path)
+
     def stop(self):
         """
         This method set internal flag which signal spider
         to stop processing new task and shuts down.
         """
         self.work_allowed = False
+        self.wakeup_main_loop()
+
+    def wakeup_main_loop(self):
+        """
+        Wake up the main loop of `run` method to check if
+        the spider should stop.
+        """
+        self.fatal_error_queue.put(None)
+
+    def inc_active_task_number(self, number=1):
+        with self.active_task_lock:
+            self.active_task_number += number
+
+    def track_active_tasks(self, tasks):
+        """
+        Remember tasks which processing has been started
+        to save them in checkpoint.
+        """
+
+        with self.active_task_lock:
+            for task in tasks:
+                self.active_tasks[id(task)] = task
+
+    def dec_active_task_number(self, number=1):
+        with self.active_task_lock:
+            self.active_task_number -= number
+            is_idle = not self.active_task_number
+        if is_idle:
+            self.wakeup_main_loop()
+
+    def complete_task(self, task):
+        """
+        Called when the processing of the task is completed.
+
+        It happens when task handler is completed, task is rejected or
+        it is moved from the one queue to another.
+        """
+
+        if task is not None:
+            with self.active_task_lock:
+                self.active_tasks.pop(id(task), None)
+            if self.task_queue:
+                # Queue backend could keep the task until it is completed
+                self.task_queue.complete_task(task)
+        self.dec_active_task_number()
 
     def load_proxylist(self, source, source_type=None, proxy_type='http',
-                       auto_init=True, auto_change=True):
+                       auto_init=True, auto_change=True,
+                       refresh_interval=None):
         """
         Load proxy list.
 
@@ -341,6 +729,9 @@ class Spider(object):
         :param auto_change:
             If set to `True` then automatical random proxy rotation
             will be used.
+        :param refresh_interval:
+            If set then the proxy list is reloaded from the source
+            each `refresh_interval` seconds while the spider works.
 
 
         Proxy source format should be one of the following (for each line):
@@ -349,6 +740,10 @@ class Spider(object):
 
         """
         self.proxylist = ProxyList()
+        self.proxylist.setup_limits(
+            max_connections=self.max_connections_per_proxy,
+            request_rate=self.proxy_request_rate,
+        )
         if isinstance(source, BaseProxySource):
             self.proxylist.set_source(source)
         elif isinstance(source, six.string_types):
@@ -370,6 +765,11 @@ class Spider(object):
         if not auto_change and auto_init:
             self.proxy = self.proxylist.get_random_proxy()
         self.proxy_auto_change = auto_change
+        if refresh_interval:
+            self.proxy_refresh_service = ProxyRefreshService(
+                self, refresh_interval)
+        else:
+            self.proxy_refresh_service = None
 
     def process_next_page(self, grab, task, xpath,
                           resolve_base=False, **kwargs):
@@ -427,6 +827,18 @@ class Spider(object):
             out.append('Network download: %s' %
                        metric.format_traffic_value(
                            self.stat.counters['download-size']))
+        if self.proxylist_enabled:
+            out.append('Proxies:')
+            items = sorted(self.proxylist.get_stats().items(),
+                           key=lambda x: x[1]['success_rate'], reverse=True)
+            for address, info in items:
+                out.append(
+                    '  %s: requests=%d failures=%d latency=%s%s' % (
+                        address, info['requests'], info['failures'],
+                        ('%.3f' % info['latency']
+                         if info['latency'] is not None else 'NA'),
+                        ' QUARANTINED' if info['quarantined'] else ''))
+            out.append('')
         out.append('Queue size: %d' % self.task_queue.size()
                    if self.task_queue else 'NA')
         out.append('Network streams: %d' % self.thread_number)
@@ -531,16 +943,99 @@ class Spider(object):
                 self.add_task(Task('initial', url=url))
 
     def get_task_from_queue(self):
-        try:
-            return self.task_queue.get()
-        except Empty:
-            size = self.task_queue.size()
-            if size:
-                return True
-            else:
-                return None
+        tasks = self.get_tasks_from_queue(1)
+        if tasks is None or tasks is True:
+            return tasks
+        else:
+            return tasks[0]
+
+    def get_tasks_from_queue(self, number):
+        """
+        Return list of at most `number` tasks.
+
+        Returns None if the task queue is empty and True if the
+        task queue contains only tasks which could not be processed
+        right now i.e. delayed tasks.
+        """
+
+        # Tasks are counted before they are taken from the queue
+        # otherwise the spider could be treated as idle while
+        # the task is neither in the queue nor in the counter
+        proxies = None
+        if self.has_proxy_limits():
+            proxies = self.acquire_proxies(number)
+            if not proxies:
+                if self.get_task_queue_size():
+                    self.start_proxy_wait()
+                    return True
+                else:
+                    return None
+            self.stop_proxy_wait()
+            number = len(proxies)
+        self.inc_active_task_number(number)
+        if self.task_scheduler:
+            tasks = self.task_scheduler.get_many(number)
+        else:
+            tasks = self.task_queue.get_many(number)
+        if len(tasks) < number:
+            self.dec_active_task_number(number - len(tasks))
+        if proxies is not None:
+            for task in tasks:
+                if task.use_proxylist and proxies:
+                    proxy = proxies.pop()
+                    self.proxylist.charge_proxy(proxy.get_address())
+                    self.task_proxies[id(task)] = proxy
+            # Proxies which are not used do not count in request rate
+            for proxy in proxies:
+                self.proxylist.release_proxy(proxy.get_address(),
+                                             cancel=True)
+        if tasks:
+            self.track_active_tasks(tasks)
+            return tasks
+        elif self.get_task_queue_size():
+            return True
+        else:
+            return None
+
+    def has_proxy_limits(self):
+        return bool(self.proxylist_enabled and self.proxy_auto_change
+                    and self.proxylist.has_limits())
+
+    def acquire_proxies(self, number):
+        """
+        Return list of at most `number` proxies which have free capacity.
+        """
+
+        proxies = []
+        for _ in range(number):
+            proxy = self.proxylist.acquire_proxy(charge=False)
+            if proxy is None:
+                break
+            proxies.append(proxy)
+        return proxies
+
+    def start_proxy_wait(self):
+        with self.proxy_wait_lock:
+            if self.proxy_wait_started is None:
+                self.proxy_wait_started = time.time()
+                self.stat.inc('spider:proxy-wait')
+
+    def stop_proxy_wait(self):
+        with self.proxy_wait_lock:
+            if self.proxy_wait_started is not None:
+                self.stat.inc('spider:proxy-wait-time',
+                              time.time() - self.proxy_wait_started)
+                self.proxy_wait_started = None
+
+    def setup_grab_for_task(self, task, transport=None):
+        """
+        Create Grab instance to send the request of the task.
+
+        Args:
+            :param transport: callable which returns transport instance,
+                by default new transport of `grab_transport` type is created
+        """
 
-    def setup_grab_for_task(self, task):
         grab = self.create_grab_instance()
         if task.grab_config:
             grab.load_config(task.grab_config)
@@ -550,7 +1045,7 @@ class Spider(object):
         # Generate new common headers
         grab.config['common_headers'] = grab.common_headers()
         self.update_grab_instance(grab)
-        grab.setup_transport(self.grab_transport_name)
+        grab.setup_transport(transport or self.grab_transport_name)
         return grab
 
     def is_valid_network_response_code(self, code, task):
@@ -562,14 +1057,15 @@ class Spider(object):
         return (code < 400 or code == 404 or
                 code in task.valid_status)
 
-    def process_parser_error(self, func_name, task, exc_info):
+    def process_parser_error(self, func_name, task, exc_info,
+                             traceback=None):
         _, ex, _ = exc_info
         self.stat.inc('spider:error-%s' % ex.__class__.__name__.lower())
 
         logger.error(
             'Task handler [%s] error\n%s',
             func_name,
-            ''.join(format_exception(*exc_info)),
+            traceback or ''.join(format_exception(*exc_info)),
         )
 
         # Looks strange but I really have some problems with
@@ -626,26 +1122,31 @@ class Spider(object):
 
         if task.use_proxylist:
             if self.proxylist_enabled:
-                # Need this to work around
-                # pycurl feature/bug:
-                # pycurl instance uses previously connected proxy server
-                # even if `proxy` options is set with another proxy server
-                grab.setup(connection_reuse=False)
-                if self.proxy_auto_change:
-                    self.change_active_proxy(task, grab)
-                if self.proxy:
-                    grab.setup(proxy=self.proxy.get_address(),
-                               proxy_userpwd=self.proxy.get_userpwd(),
-                               proxy_type=self.proxy.proxy_type)
+                # Connections are not disabled to reuse: network service
+                # sends the request with curl handle which has been used
+                # with the same proxy
+                # Proxy with free capacity has been acquired
+                # when the task was taken from the queue
+                proxy = self.task_proxies.get(id(task))
+                if proxy is None:
+                    if self.proxy_auto_change:
+                        self.change_active_proxy(task, grab)
+                    proxy = self.proxy
+                if proxy:
+                    grab.setup(proxy=proxy.get_address(),
+                               proxy_userpwd=proxy.get_userpwd(),
+                               proxy_type=proxy.proxy_type)
 
     # pylint: disable=unused-argument
     def change_active_proxy(self, task, grab):
-        self.proxy = self.proxylist.get_random_proxy()
+        self.proxy = self.proxylist.get_best_proxy()
     # pylint: enable=unused-argument
 
     def submit_task_to_transport(self, task, grab):
         if self.only_cache:
             self.stat.inc('spider:request-network-disabled-only-cache')
+            self.release_task_host(task)
+            self.complete_task(task)
         else:
             grab_config_backup = grab.dump_config()
             self.process_grab_proxy(task, grab)
@@ -660,54 +1161,70 @@ class Spider(object):
                 logger.debug('Task %s has invalid URL: %s',
                              task.name, task.url)
                 self.stat.collect('invalid-url', task.url)
+                self.release_task_host(task)
+                self.complete_task(task)
 
     def run(self):
         self._started = time.time()
+        self.active_task_number = 0
+        self.active_tasks = {}
         services = []
         try:
             self.prepare()
             if self.task_queue is None:
                 self.setup_queue()
+            # Parser service goes first because in "process" mode
+            # it forks parser processes and it is better to do
+            # it before other threads are started
             services = [
+                self.parser_service,
                 self.task_dispatcher,
                 self.task_generator_service,
-                self.parser_service,
                 self.network_service,
             ]
-            if self.http_api_service:
-                self.http_api_service.start()
             if self.cache_reader_service:
-                services.insert(0, self.cache_reader_service)
+                services.insert(1, self.cache_reader_service)
             if self.cache_writer_service:
-                services.insert(0, self.cache_writer_service)
+                services.insert(1, self.cache_writer_service)
+            if self.proxy_refresh_service:
+                services.append(self.proxy_refresh_service)
             for srv in services:
                 srv.start()
+            self.running_services = services
+            if self.http_api_service:
+                self.http_api_service.start()
+            checkpoint_time = time.time()
             while self.work_allowed:
+                # Services wake up the main loop when the number
+                # of active tasks drops to zero
                 try:
-                    exc_info = self.fatal_error_queue.get(True, 0.5)
+                    exc_info = self.fatal_error_queue.get(True,
+                                                          WAKEUP_TIMEOUT)
                 except Empty:
                     pass
                 else:
-                    # The trackeback of fatal error MUST BE
-                    # rendered by the sender
-                    raise exc_info[1]
-                if self.is_idle():
-                    for srv in services:
-                        srv.pause()
-                    if self.is_idle():
-                        break
-                    for srv in services:
-                        srv.resume()
+                    if exc_info is not None:
+                        # The trackeback of fatal error MUST BE
+                        # rendered by the sender
+                        raise exc_info[1]
+                if self.shard_router:
+                    # Spider works until the supervisor stops it
+                    # because other workers could send new tasks
+                    self.shard_router.check_idle()
+                elif self.is_idle():
+                    break
+                if (self.checkpoint_interval and time.time()
+                        - checkpoint_time >= self.checkpoint_interval):
+                    self.checkpoint()
+                    checkpoint_time = time.time()
         except KeyboardInterrupt:
             self.interrupted = True
             raise
         except Exception:
             raise
         finally:
-            # TODO:
-            if self.task_queue:
-                self.task_queue.close()
             #print('Start stopping services')
+            self.running_services = []
             for srv in services:
                 # Resume service if it has been paused
                 # to allow service to process stop signal
@@ -724,26 +1241,128 @@ class Spider(object):
                     print('The %s has not stopped :(' % srv)
             self.stat.print_progress_line()
             self.shutdown()
+            if self.checkpoint_path:
+                # Unfinished tasks are saved to continue the work later
+                try:
+                    self.checkpoint()
+                except Exception: # pylint: disable=broad-except
+                    logger.error('Could not save spider checkpoint',
+                                 exc_info=True)
             if self.task_queue:
-                self.task_queue.clear()
+                if not self.checkpoint_path:
+                    self.task_queue.clear()
+                # Services could use the task queue until they are stopped
+                self.task_queue.close()
+            if self.task_scheduler:
+                self.task_scheduler.clear()
+            if self.dupe_filter:
+                self.dupe_filter.close()
             logger.debug('Work done')
 
     def is_idle(self):
-        result = (
-            not self.task_generator_service.is_alive()
-            and not self.task_queue.size()
-            and not self.task_dispatcher.input_queue.qsize()
-            and not self.parser_service.input_queue.qsize()
-            and not self.parser_service.is_busy()
-            and not self.network_service.get_active_threads_number()
-            and not self.network_service.is_busy()
-        )
-        if result and self.cache_reader_service:
-            result = result and (
-                not self.cache_reader_service.input_queue.size()
-                and not self.cache_writer_service.input_queue.qsize()
-            )
-        return result
+        # Queue sizes are checked only if there are no active tasks
+        # Tasks could be in the queue before spider has been started
+        # so they can't be counted in `active_task_number`
+        if (self.active_task_number
+                or self.task_generator_service.is_alive()):
+            return False
+        if self.cache_reader_service and (
+                self.cache_reader_service.input_queue.size()
+                or self.cache_writer_service.input_queue.qsize()
+                or self.cache_writer_service.is_busy()):
+            return False
+        return not self.get_task_queue_size()
+
+    def get_delayed_task_timeout(self):
+        """
+        Return number of seconds the idle network service could wait
+        until some delayed task becomes available.
+        """
+
+        if self.task_scheduler and self.task_scheduler.size():
+            # Tasks are delayed by host limits
+            return DELAYED_TASK_CHECK_INTERVAL
+        if self.proxy_wait_started is not None:
+            # Tasks wait for proxy with free capacity
+            timeout = self.proxylist.get_capacity_timeout()
+            if timeout is None:
+                return DELAYED_TASK_CHECK_INTERVAL
+            return min(timeout, DELAYED_TASK_CHECK_INTERVAL)
+        schedule_time = self.task_queue.get_next_schedule_time()
+        if schedule_time is None:
+            return DELAYED_TASK_CHECK_INTERVAL
+        delay = (schedule_time - datetime.utcnow()).total_seconds()
+        return max(0, min(delay, WAKEUP_TIMEOUT))
+
+    def get_task_queue_size(self):
+        size = self.task_queue.size()
+        if self.task_scheduler:
+            size += self.task_scheduler.size()
+        return size
+
+    def release_task_host(self, task):
+        """
+        Called when network service has completed the processing of the task
+        to allow scheduler to give out new task of the same host.
+        """
+
+        if self.task_scheduler:
+            self.task_scheduler.release(task)
+            if self.task_scheduler.size():
+                self.network_service.notify_new_task()
+        proxy = self.task_proxies.pop(id(task), None)
+        if proxy is not None:
+            self.proxylist.release_proxy(proxy.get_address())
+            if self.proxy_wait_started is not None:
+                self.network_service.notify_new_task()
+
+    def get_network_stream_limit(self):
+        """
+        Return max. number of concurrent network requests.
+        """
+
+        if self.concurrency_controller:
+            return self.concurrency_controller.get_limit()
+        else:
+            return self.thread_number
+
+    def update_concurrency_limits(self, res, task):
+        """
+        Pass the result of network request to the concurrency controller.
+        """
+
+        if self.concurrency_controller:
+            if res['ok']:
+                code = res['grab'].doc.code
+                is_ok = code < 500 and code != 429
+                latency = res['grab'].doc.total_time
+            else:
+                is_ok = False
+                latency = None
+            if self.concurrency_controller.process_result(
+                    get_task_host(task), is_ok, latency):
+                self.network_service.notify_new_task()
+
+    def update_proxy_stat(self, res, task):
+        """
+        Pass the result of network request to the proxy list.
+        """
+
+        if self.proxylist_enabled and task.use_proxylist:
+            proxy = res['grab'].config['proxy']
+            if proxy:
+                if res['ok']:
+                    # Proxy authentication is required
+                    is_ok = res['grab'].doc.code != 407
+                    latency = res['grab'].doc.total_time
+                elif res['error_abbr'] in PROXY_ERROR_ABBRS:
+                    is_ok = False
+                    latency = None
+                else:
+                    # Error does not show the health of the proxy
+                    return
+                if self.proxylist.process_result(proxy, is_ok, latency):
+                    self.stat.inc('spider:proxy-quarantined')
 
     def log_failed_network_result(self, res):
         if res['ok']:
@@ -1,11 +1,82 @@
-from threading import Thread, Event
+from threading import Thread, Event, Condition
 import logging
 import sys
 
+from six.moves.queue import Queue, Empty
+
 # pylint: disable=invalid-name
 logger = logging.getLogger('grab.spider.base_service')
 # pylint: enable=invalid-name
 
+# Max. time the idle worker waits for the wakeup. Wakeups do not cover
+# everything e.g. tasks put into shared queue backend by other processes
+WAKEUP_TIMEOUT = 1
+# How often delayed tasks are checked if the task queue backend
+# could not tell when the next delayed task becomes available
+DELAYED_TASK_CHECK_INTERVAL = 0.1
+
+
+class ServiceQueue(Queue):
+    """
+    Queue which waiting consumers could be woken up without
+    putting anything into the queue.
+    """
+
+    def wakeup(self):
+        with self.not_empty:
+            self.not_empty.notify_all()
+
+    def get_or_wakeup(self, worker):
+        """
+        Remove and return an item from the queue.
+
+        Blocks until an item is available or `wakeup` method is called
+        after the worker has received stop or pause signal.
+
+        :raises: `Queue.Empty` if worker has been woken up
+        """
+
+        with self.not_empty:
+            while not self._qsize():
+                if worker.has_pending_signal():
+                    raise Empty
+                self.not_empty.wait()
+            item = self._get()
+            self.not_full.notify()
+            return item
+
+
+class WakeupSignal(object):
+    """
+    Allows idle workers to wait for notification from other threads.
+
+    The notification sent between `get_state` and `wait` calls
+    is not lost: `wait` returns immediately in such case.
+    """
+
+    def __init__(self):
+        self.cond = Condition()
+        self.counter = 0
+
+    def get_state(self):
+        return self.counter
+
+    def wait(self, state, timeout=None):
+        with self.cond:
+            if self.counter == state:
+                self.cond.wait(timeout)
+
+    def notify(self):
+        """Wake up one waiting worker"""
+        with self.cond:
+            self.counter += 1
+            self.cond.notify()
+
+    def notify_all(self):
+        with self.cond:
+            self.counter += 1
+            self.cond.notify_all()
+
 
 class ServiceWorker(object):
     def __init__(self, spider, worker_callback):
@@ -25,6 +96,7 @@ class ServiceWorker(object):
         self.resume_event = Event()
         self.activity_paused = Event()
         self.is_busy_event = Event()
+        self.wakeup_signal = WakeupSignal()
 
     def worker_callback_wrapper(self, callback):
         def wrapper(*args, **kwargs):
@@ -40,15 +112,36 @@ class ServiceWorker(object):
 
     def stop(self):
         self.stop_event.set()
+        self.wakeup_signal.notify_all()
 
     def process_pause_signal(self):
         if self.pause_event.is_set():
             self.activity_paused.set()
             self.resume_event.wait()
 
-    def pause(self):
+    def has_pending_signal(self):
+        return self.stop_event.is_set() or self.pause_event.is_set()
+
+    def sleep(self, timeout):
+        """
+        Sleep until timeout is expired or worker is woken up
+        with stop or pause signal.
+        """
+
+        state = self.wakeup_signal.get_state()
+        if not self.has_pending_signal():
+            self.wakeup_signal.wait(state, timeout)
+
+    def send_pause_signal(self):
         self.resume_event.clear()
         self.pause_event.set()
+        self.wakeup_signal.notify_all()
+
+    def pause(self):
+        self.send_pause_signal()
+        self.wait_paused()
+
+    def wait_paused(self):
         while True:
             if self.activity_paused.wait(0.1):
                 break
@@ -85,10 +178,15 @@ class BaseService(object):
     def stop(self):
         for worker in self.iterate_workers(self.worker_registry):
             worker.stop()
+        self.wakeup()
 
     def pause(self):
-        for worker in self.iterate_workers(self.worker_registry):
-            worker.pause()
+        workers = list(self.iterate_workers(self.worker_registry))
+        for worker in workers:
+            worker.send_pause_signal()
+        self.wakeup()
+        for worker in workers:
+            worker.wait_paused()
         #logging.debug('Service %s paused' % self.__class__.__name__)
 
     def resume(self):
@@ -96,6 +194,13 @@ class BaseService(object):
             worker.resume()
         #logging.debug('Service %s resumed' % self.__class__.__name__)
 
+    def wakeup(self):
+        """
+        Wake up workers of the service which wait for new data.
+
+        Called when workers should notice stop or pause signal.
+        """
+
     def register_workers(self, *args):
         # pylint: disable=attribute-defined-outside-init
         self.worker_registry = args
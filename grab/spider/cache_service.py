@@ -1,8 +1,8 @@
-import time
+from six.moves.queue import Empty
 
-from six.moves.queue import Queue, Empty
-
-from grab.spider.base_service import BaseService
+from grab.spider.base_service import (
+    BaseService, ServiceQueue, WAKEUP_TIMEOUT,
+)
 from grab.spider.queue_backend import memory
 
 
@@ -23,19 +23,32 @@ class CacheServiceBase(BaseService):
 
 
 class CacheReaderService(CacheServiceBase):
+    def __init__(self, spider, backend):
+        super(CacheReaderService, self).__init__(spider, backend)
+        self.input_queue.add_put_hook(self.worker.wakeup_signal.notify)
+
     def create_input_queue(self):
         return memory.QueueBackend(spider_name=None)
 
     def worker_callback(self, worker):
         while not worker.stop_event.is_set():
             worker.process_pause_signal()
+            wakeup_state = worker.wakeup_signal.get_state()
+            # See comment in `Spider.get_task_from_queue`
+            self.spider.inc_active_task_number()
             try:
                 # Can't use (block=True, timeout=0.1) because
                 # the backend could be mongodb, mysql, etc
                 task = self.input_queue.get()
             except Empty:
-                time.sleep(0.1)
+                self.spider.complete_task(None)
+                if not worker.has_pending_signal():
+                    # Delayed tasks are checked more often
+                    timeout = (0.1 if self.input_queue.size()
+                               else WAKEUP_TIMEOUT)
+                    worker.wakeup_signal.wait(wakeup_state, timeout)
             else:
+                self.spider.track_active_tasks([task])
                 grab = self.spider.setup_grab_for_task(task)
                 item = None
                 if self.is_read_allowed(task, grab):
@@ -78,18 +91,28 @@ class CacheReaderService(CacheServiceBase):
 
 class CacheWriterService(CacheServiceBase):
     def create_input_queue(self):
-        return Queue()
+        return ServiceQueue()
+
+    def wakeup(self):
+        self.input_queue.wakeup()
 
     def worker_callback(self, worker):
         while not worker.stop_event.is_set():
             worker.process_pause_signal()
             try:
-                task, grab = self.input_queue.get(True, 0.1)
+                task, grab = self.input_queue.get_or_wakeup(worker)
             except Empty:
                 pass
             else:
-                if self.is_write_allowed(task, grab):
-                    self.backend.save_response(task.url, grab)
+                worker.is_busy_event.set()
+                try:
+                    if self.is_write_allowed(task, grab):
+                        self.backend.save_response(task.url, grab)
+                finally:
+                    worker.is_busy_event.clear()
+                if not self.input_queue.qsize():
+                    # Spider waits for cache writes before it stops
+                    self.spider.wakeup_main_loop()
 
     def is_write_allowed(self, task, grab):
         return (
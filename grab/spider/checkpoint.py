@@ -0,0 +1,43 @@
+"""
+Spider checkpoint file
+
+Checkpoint keeps the state of the spider: tasks which are not processed
+yet, stat counters and the state of duplicate task filter.
+"""
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import os
+
+from grab.spider.error import SpiderError
+
+CHECKPOINT_VERSION = 1
+# os.replace overwrites existing file on Windows too but it is py3 only
+replace_file = getattr(os, 'replace', os.rename) # pylint: disable=invalid-name
+
+
+def save_checkpoint(path, state):
+    """
+    Write the checkpoint into the file.
+
+    The data is written into temporary file which then replaces
+    the previous checkpoint so the checkpoint file is never corrupted.
+    """
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        pickle.dump({'version': CHECKPOINT_VERSION, 'state': state}, out,
+                    pickle.HIGHEST_PROTOCOL)
+        out.flush()
+        os.fsync(out.fileno())
+    replace_file(tmp_path, path)
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as inp:
+        data = pickle.load(inp)
+    if data.get('version') != CHECKPOINT_VERSION:
+        raise SpiderError('Unsupported version of checkpoint file: %s'
+                          % data.get('version'))
+    return data['state']
@@ -0,0 +1,140 @@
+"""
+Adaptive concurrency controller.
+
+The number of concurrent network requests is controlled with AIMD
+algorithm (additive increase, multiplicative decrease): the limit grows
+while network requests complete successfully and fast, the limit is cut
+when requests fail with network errors (i.e. timeouts) or with 429 and
+5xx HTTP status codes.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+DEFAULT_DECREASE_FACTOR = 0.5
+# Latency is considered unhealthy if its moving average is
+# that times greater than min. latency
+DEFAULT_LATENCY_FACTOR = 3
+LATENCY_SMOOTHING = 0.1
+# Latency below that number of seconds is always healthy
+MIN_LATENCY_THRESHOLD = 0.1
+INITIAL_LIMIT = 4
+# Max. number of hosts which limits are kept, limits
+# of least recently used hosts are dropped
+DEFAULT_MAX_HOSTS = 10000
+
+
+class AimdLimit(object):
+    """
+    Concurrency limit of the spider or one host.
+    """
+
+    def __init__(self, max_limit, min_limit=1,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR,
+                 latency_factor=DEFAULT_LATENCY_FACTOR):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.limit = float(max(min_limit, min(max_limit, INITIAL_LIMIT)))
+        # Limit grows exponentially until the first failure
+        self.slow_start = True
+        self.results_since_decrease = 0
+        self.latency = None
+        self.min_latency = None
+
+    def get_limit(self):
+        return int(self.limit)
+
+    def is_latency_healthy(self, latency):
+        if not latency:
+            return True
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += (latency - self.latency) * LATENCY_SMOOTHING
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        return self.latency <= max(MIN_LATENCY_THRESHOLD,
+                                   self.min_latency * self.latency_factor)
+
+    def process_success(self, latency=None):
+        self.results_since_decrease += 1
+        if self.is_latency_healthy(latency):
+            if self.slow_start:
+                self.limit += 1
+            else:
+                # Grows by one after `limit` successful requests
+                self.limit += 1.0 / self.limit
+            self.limit = min(self.limit, self.max_limit)
+
+    def process_failure(self):
+        # Requests which have been started before the limit was cut
+        # fail too, do not decrease the limit for them once again
+        if (self.slow_start
+                or self.results_since_decrease >= self.get_limit()):
+            self.slow_start = False
+            self.results_since_decrease = 0
+            self.limit = max(self.min_limit,
+                             self.limit * self.decrease_factor)
+        else:
+            self.results_since_decrease += 1
+
+
+class ConcurrencyController(object):
+    def __init__(self, max_limit, max_host_limit=None,
+                 max_hosts=DEFAULT_MAX_HOSTS):
+        """
+        Args:
+            :param max_limit: max. number of concurrent network requests
+            :param max_host_limit: max. number of concurrent network
+                requests to one host, if it is None then the number of
+                requests to one host is not controlled
+            :param max_hosts: max. number of hosts which limits are kept
+        """
+
+        self.global_limit = AimdLimit(max_limit)
+        self.max_host_limit = max_host_limit
+        self.max_hosts = max_hosts
+        # host -> limit, least recently used goes first
+        self.host_limits = OrderedDict()
+        self.lock = Lock()
+
+    def get_limit(self):
+        return self.global_limit.get_limit()
+
+    def get_host_limit(self, host):
+        if self.max_host_limit is None:
+            return None
+        host_limit = self.host_limits.get(host)
+        if host_limit is None:
+            return min(INITIAL_LIMIT, self.max_host_limit)
+        else:
+            return host_limit.get_limit()
+
+    def process_result(self, host, is_ok, latency=None):
+        """
+        Update limits with the result of network request.
+
+        Returns True if any limit has been increased.
+        """
+
+        with self.lock:
+            limits = [self.global_limit]
+            if self.max_host_limit is not None:
+                host_limit = self.host_limits.pop(host, None)
+                if host_limit is None:
+                    if len(self.host_limits) >= self.max_hosts:
+                        self.host_limits.popitem(last=False)
+                    host_limit = AimdLimit(self.max_host_limit)
+                self.host_limits[host] = host_limit
+                limits.append(host_limit)
+            increased = False
+            for limit in limits:
+                old_value = limit.get_limit()
+                if is_ok:
+                    limit.process_success(latency)
+                else:
+                    limit.process_failure()
+                if limit.get_limit() > old_value:
+                    increased = True
+            return increased
@@ -0,0 +1,499 @@
+"""
+Crawl coordinator server shares task queues and duplicate filters
+between spider processes running on multiple hosts.
+
+The coordinator keeps the tasks in memory, it hands out the tasks in the order
+of their priorities with per-host limits: the number of tasks of one host
+which are processed at the same time and the delay between the tasks of
+one host. Tasks taken from the queue are leased to the spider until it
+acknowledges their completion. If the lease expires then the task is
+available again.
+
+Spiders talk to the coordinator with length-prefixed messages serialized
+with JSON, see `to_json_value` function. When the spider connects the
+coordinator sends the version of the protocol and random challenge. The
+spider must use the same version of the protocol and answer with HMAC of the
+challenge built with the shared secret key. Tasks are stored as encoded
+bytes, the coordinator does not decode them.
+"""
+import hashlib
+import heapq
+import hmac
+from itertools import count
+import json
+import logging
+import os
+import socket
+import struct
+from threading import Lock, Thread
+import time
+
+import six
+from six.moves import socketserver
+
+from grab.spider.error import SpiderError, SpiderMisuseError
+from grab.spider.task_codec import to_json_value, from_json_value
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.spider.coordinator')
+# pylint: enable=invalid-name
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8790
+HEADER = struct.Struct('>I')
+# Version of the format of messages, it is changed when
+# the coordinator and old spiders could not talk to each other
+PROTOCOL_VERSION = 1
+CHALLENGE_SIZE = 32
+
+
+class CoordinatorError(SpiderError):
+    """Raised when coordinator could not process the request"""
+
+
+def parse_address(address):
+    """
+    Convert "host:port" string into (host, port) tuple.
+    """
+
+    if isinstance(address, (list, tuple)):
+        return tuple(address)
+    host, _, port = address.rpartition(':')
+    return (host or DEFAULT_HOST, int(port))
+
+
+def normalize_authkey(authkey):
+    if not authkey:
+        raise SpiderMisuseError('Authentication key of coordinator '
+                                'is not configured')
+    if isinstance(authkey, six.text_type):
+        authkey = authkey.encode('utf-8')
+    return authkey
+
+
+def build_digest(authkey, challenge):
+    return hmac.new(authkey, challenge, hashlib.sha256).digest()
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError('Connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, msg):
+    data = json.dumps(to_json_value(msg),
+                      separators=(',', ':')).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    size = HEADER.unpack(recv_exactly(sock, HEADER.size))[0]
+    return from_json_value(json.loads(
+        recv_exactly(sock, size).decode('utf-8')))
+
+
+class CoordinatorQueue(object):
+    """
+    Task queue with per-host limits and leases.
+
+    Not thread-safe, the coordinator serializes the access.
+    """
+
+    def __init__(self, max_connections_per_host=None,
+                 host_request_delay=None):
+        self.max_connections_per_host = max_connections_per_host
+        self.host_request_delay = host_request_delay
+        self.counter = count()
+        self.clear()
+
+    def clear(self):
+        # host -> heap of (priority, number, data) items
+        self.host_queues = {}
+        self.ready_number = 0
+        # Heap of (priority, number, host) items, head items of hosts
+        # which could be available. Item is outdated if the host
+        # has other head item or if the host is waiting.
+        self.ready_hosts = []
+        # host -> time when the host becomes available or None if
+        # the host waits for the release of its connection
+        self.waiting_hosts = {}
+        # Heap of (time, host) items of waiting hosts
+        self.delayed_hosts = []
+        # Heap of (schedule_time, number, priority, host, data) items
+        self.delayed = []
+        # lease ID -> (priority, host, data, expire_time)
+        self.leases = {}
+        # Heap of (expire_time, lease ID) items, item is outdated
+        # if the lease is acknowledged or renewed
+        self.lease_expire_times = []
+        self.host_connections = {}
+        self.host_request_time = {}
+
+    def push_ready(self, priority, host, data):
+        item = (priority, next(self.counter), data)
+        host_queue = self.host_queues.get(host)
+        if host_queue is None:
+            host_queue = self.host_queues[host] = []
+        heapq.heappush(host_queue, item)
+        self.ready_number += 1
+        if host_queue[0] is item and host not in self.waiting_hosts:
+            heapq.heappush(self.ready_hosts, (item[0], item[1], host))
+
+    def put(self, items, now):
+        for data, priority, schedule_time, host in items:
+            if schedule_time is not None and schedule_time > now:
+                heapq.heappush(self.delayed, (schedule_time,
+                                              next(self.counter),
+                                              priority, host, data))
+            else:
+                self.push_ready(priority, host, data)
+
+    def release_host(self, host, now):
+        self.host_connections[host] -= 1
+        if not self.host_connections[host]:
+            del self.host_connections[host]
+        if host in self.waiting_hosts and self.waiting_hosts[host] is None:
+            self.schedule_host(host, now)
+
+    def process_timers(self, now):
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, priority, host, data = heapq.heappop(self.delayed)
+            self.push_ready(priority, host, data)
+        while (self.lease_expire_times
+               and self.lease_expire_times[0][0] <= now):
+            expire_time, lease_id = heapq.heappop(self.lease_expire_times)
+            if self.is_current_lease(lease_id, expire_time):
+                priority, host, data, _ = self.leases.pop(lease_id)
+                self.release_host(host, now)
+                self.push_ready(priority, host, data)
+        while self.delayed_hosts and self.delayed_hosts[0][0] <= now:
+            available_time, host = heapq.heappop(self.delayed_hosts)
+            # Skip outdated item
+            if self.waiting_hosts.get(host) == available_time:
+                self.schedule_host(host, now)
+
+    def is_host_connection_available(self, host):
+        return (not self.max_connections_per_host
+                or (self.host_connections.get(host, 0)
+                    < self.max_connections_per_host))
+
+    def is_host_available(self, host, now):
+        if not self.is_host_connection_available(host):
+            return False
+        if (self.host_request_delay
+                and host in self.host_request_time
+                and (now - self.host_request_time[host]
+                     < self.host_request_delay)):
+            return False
+        return True
+
+    def schedule_host(self, host, now):
+        """
+        Make the head item of the host available to `take_item` or
+        move the host into waiting state until it becomes available.
+        """
+
+        self.waiting_hosts.pop(host, None)
+        host_queue = self.host_queues.get(host)
+        if not host_queue:
+            return
+        if not self.is_host_connection_available(host):
+            self.waiting_hosts[host] = None
+            return
+        if self.host_request_delay and host in self.host_request_time:
+            available_time = (self.host_request_time[host]
+                              + self.host_request_delay)
+            if now < available_time:
+                self.waiting_hosts[host] = available_time
+                heapq.heappush(self.delayed_hosts, (available_time, host))
+                return
+        item = host_queue[0]
+        heapq.heappush(self.ready_hosts, (item[0], item[1], host))
+
+    def take_item(self, now):
+        while self.ready_hosts:
+            _, number, host = heapq.heappop(self.ready_hosts)
+            host_queue = self.host_queues.get(host)
+            if (host in self.waiting_hosts or not host_queue
+                    or host_queue[0][1] != number):
+                # Outdated item
+                continue
+            if not self.is_host_available(host, now):
+                self.schedule_host(host, now)
+                continue
+            item = heapq.heappop(host_queue)
+            self.ready_number -= 1
+            self.host_connections[host] = (
+                self.host_connections.get(host, 0) + 1)
+            if self.host_request_delay:
+                self.host_request_time[host] = now
+            if host_queue:
+                self.schedule_host(host, now)
+            else:
+                del self.host_queues[host]
+            return host, item
+        return None
+
+    def get(self, number, lease_timeout, now):
+        self.process_timers(now)
+        result = []
+        while len(result) < number:
+            item = self.take_item(now)
+            if item is None:
+                break
+            host, (priority, _, data) = item
+            lease_id = next(self.counter)
+            self.leases[lease_id] = (priority, host, data,
+                                     now + lease_timeout)
+            heapq.heappush(self.lease_expire_times,
+                           (now + lease_timeout, lease_id))
+            result.append((lease_id, data))
+        return result
+
+    def ack(self, lease_ids, now):
+        for lease_id in lease_ids:
+            item = self.leases.pop(lease_id, None)
+            if item is not None:
+                self.release_host(item[1], now)
+
+    def is_current_lease(self, lease_id, expire_time):
+        item = self.leases.get(lease_id)
+        return item is not None and item[3] == expire_time
+
+    def renew(self, lease_ids, lease_timeout, now):
+        """
+        Prolong the leases of tasks which are not completed yet.
+        """
+
+        for lease_id in lease_ids:
+            # Expired lease could not be renewed, its task is
+            # available to other consumers already
+            item = self.leases.get(lease_id)
+            if item is not None and item[3] > now:
+                expire_time = now + lease_timeout
+                self.leases[lease_id] = item[:3] + (expire_time,)
+                heapq.heappush(self.lease_expire_times,
+                               (expire_time, lease_id))
+
+    def size(self):
+        return self.ready_number + len(self.delayed) + len(self.leases)
+
+    def get_next_schedule_time(self, now):
+        self.process_timers(now)
+        if self.ready_number:
+            # Tasks wait for free host, the time is unknown
+            return None
+        times = []
+        if self.delayed:
+            times.append(self.delayed[0][0])
+        # Skip acknowledged and renewed leases
+        while (self.lease_expire_times
+               and not self.is_current_lease(
+                   self.lease_expire_times[0][1],
+                   self.lease_expire_times[0][0])):
+            heapq.heappop(self.lease_expire_times)
+        if self.lease_expire_times:
+            times.append(self.lease_expire_times[0][0])
+        return min(times) if times else None
+
+
+class CoordinatorState(object):
+    def __init__(self, max_connections_per_host=None,
+                 host_request_delay=None):
+        self.max_connections_per_host = max_connections_per_host
+        self.host_request_delay = host_request_delay
+        self.queues = {}
+        # name -> set of fingerprints
+        self.seen_sets = {}
+        self.lock = Lock()
+
+    def get_queue(self, name):
+        if name not in self.queues:
+            self.queues[name] = CoordinatorQueue(
+                max_connections_per_host=self.max_connections_per_host,
+                host_request_delay=self.host_request_delay,
+            )
+        return self.queues[name]
+
+    def process_request(self, msg):
+        cmd, name, args = msg[0], msg[1], msg[2:]
+        now = time.time()
+        with self.lock:
+            if cmd == 'put':
+                self.get_queue(name).put(args[0], now)
+                return None
+            elif cmd == 'get':
+                queue = self.get_queue(name)
+                number, lease_timeout, lease_ids, renew_ids = args
+                queue.ack(lease_ids, now)
+                queue.renew(renew_ids, lease_timeout, now)
+                return queue.get(number, lease_timeout, now)
+            elif cmd == 'ack':
+                self.get_queue(name).ack(args[0], now)
+                return None
+            elif cmd == 'renew':
+                self.get_queue(name).renew(args[0], args[1], now)
+                return None
+            elif cmd == 'size':
+                return self.get_queue(name).size()
+            elif cmd == 'next_schedule_time':
+                return self.get_queue(name).get_next_schedule_time(now)
+            elif cmd == 'clear':
+                self.get_queue(name).clear()
+                return None
+            elif cmd == 'seen_add':
+                seen = self.seen_sets.setdefault(name, set())
+                result = []
+                for fingerprint in args[0]:
+                    result.append(fingerprint not in seen)
+                    seen.add(fingerprint)
+                return result
+            elif cmd == 'seen_size':
+                return len(self.seen_sets.get(name, ()))
+            elif cmd == 'seen_clear':
+                self.seen_sets.pop(name, None)
+                return None
+            else:
+                raise CoordinatorError('Unknown command: %s' % cmd)
+
+
+class CoordinatorRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections.add(sock)
+        try:
+            if self.handshake(sock):
+                self.process_requests(sock)
+        except (EOFError, ValueError, socket.error):
+            # Connection is closed or the message is malformed
+            pass
+        finally:
+            with self.server.lock:
+                self.server.connections.discard(sock)
+            sock.close()
+
+    def handshake(self, sock):
+        challenge = os.urandom(CHALLENGE_SIZE)
+        send_message(sock, ('hello', PROTOCOL_VERSION, challenge))
+        msg = recv_message(sock)
+        if msg[:2] != ('hello', PROTOCOL_VERSION) or len(msg) != 3:
+            send_message(sock, ('error', 'Unsupported protocol version'))
+            return False
+        expected = build_digest(self.server.authkey, challenge)
+        if (not isinstance(msg[2], six.binary_type)
+                or not hmac.compare_digest(expected, msg[2])):
+            logger.error('Authentication of %s:%d failed',
+                         *self.client_address[:2])
+            send_message(sock, ('error', 'Authentication failed'))
+            return False
+        send_message(sock, ('ok', None))
+        return True
+
+    def process_requests(self, sock):
+        while True:
+            msg = recv_message(sock)
+            try:
+                result = ('ok', self.server.state.process_request(msg))
+            except Exception as ex: # pylint: disable=broad-except
+                logger.error('Could not process request', exc_info=ex)
+                result = ('error', str(ex))
+            send_message(sock, result)
+
+
+class CoordinatorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=(DEFAULT_HOST, DEFAULT_PORT), authkey=None,
+                 max_connections_per_host=None, host_request_delay=None):
+        """
+        Args:
+            :param authkey: secret key shared by the coordinator and
+                the spiders, connections of clients which do not know
+                the key are refused
+        """
+
+        self.authkey = normalize_authkey(authkey)
+        socketserver.TCPServer.__init__(self, address,
+                                        CoordinatorRequestHandler)
+        self.state = CoordinatorState(
+            max_connections_per_host=max_connections_per_host,
+            host_request_delay=host_request_delay,
+        )
+        self.thread = None
+        self.connections = set()
+        self.lock = Lock()
+
+    def start(self):
+        """
+        Start serving requests in background thread.
+        """
+
+        self.thread = Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        # Release threads which serve the connections of clients
+        with self.lock:
+            for sock in self.connections:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+
+class CoordinatorClient(object):
+    def __init__(self, address, authkey=None):
+        self.address = parse_address(address)
+        self.authkey = normalize_authkey(authkey)
+        self.sock = None
+        self.lock = Lock()
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        msg = recv_message(self.sock)
+        if msg[:2] != ('hello', PROTOCOL_VERSION):
+            self.close_socket()
+            raise CoordinatorError('Coordinator uses unsupported protocol: %s'
+                                   % (msg[:2],))
+        send_message(self.sock, ('hello', PROTOCOL_VERSION,
+                                 build_digest(self.authkey, msg[2])))
+        status, result = recv_message(self.sock)
+        if status == 'error':
+            self.close_socket()
+            raise CoordinatorError(result)
+
+    def request(self, *msg):
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self.connect()
+                send_message(self.sock, msg)
+                status, result = recv_message(self.sock)
+            except (EOFError, socket.error):
+                self.close_socket()
+                raise
+        if status == 'error':
+            raise CoordinatorError(result)
+        return result
+
+    def close_socket(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def close(self):
+        with self.lock:
+            self.close_socket()
@@ -0,0 +1,69 @@
+"""
+DupeFilterInterface defines interface of duplicate task filter backend.
+"""
+from hashlib import sha1
+
+from six.moves.urllib.parse import urldefrag
+from weblib.encoding import make_str
+
+
+def build_task_fingerprint(task):
+    """
+    Build 20-bytes fingerprint of the network request of the task.
+
+    Fingerprint depends on request method, URL without fragment
+    and POST data.
+    """
+
+    config = task.peek_grab_config() or {}
+    method = config.get('method') or 'GET'
+    post = config.get('post') or config.get('multipart_post')
+    parts = [make_str(method.upper()), make_str(urldefrag(task.url)[0])]
+    if post:
+        if isinstance(post, dict):
+            post = sorted(post.items())
+        parts.append(make_str(repr(post)))
+    return sha1(b' '.join(parts)).digest()
+
+
+class DupeFilterInterface(object):
+    def __init__(self, spider_name, **kwargs):
+        pass
+
+    def add(self, fingerprint):
+        """
+        Remember the fingerprint.
+
+        Return False if the fingerprint has been added before.
+        """
+        raise NotImplementedError
+
+    def size(self):
+        """
+        Return number of remembered fingerprints.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Forget all fingerprints.
+        """
+        raise NotImplementedError
+
+    def get_state(self):
+        """
+        Return the state of the filter to be saved in spider checkpoint.
+
+        Returns None if the backend keeps fingerprints
+        in persistent storage.
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        Restore the state returned by `get_state` method.
+        """
+        pass
+
+    def close(self):
+        pass
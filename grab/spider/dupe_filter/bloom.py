@@ -0,0 +1,139 @@
+"""
+Duplicate task filter backend powered by scalable Bloom filter
+
+Bloom filter needs few bytes per fingerprint but it could treat new task
+as duplicate with probability of `error_rate`. When current filter
+is full the new filter of bigger capacity and lower error rate is added
+so the total error rate does not exceed `error_rate`.
+
+If `path` option is given then the filter is loaded from that file
+and saved into it when spider is closed.
+"""
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from math import ceil, log
+import os
+import struct
+from threading import Lock
+
+from grab.spider.checkpoint import replace_file
+from grab.spider.dupe_filter.base import DupeFilterInterface
+
+DEFAULT_CAPACITY = 100000
+DEFAULT_ERROR_RATE = 0.001
+# Capacity of each next filter is multiplied by this number
+GROWTH_FACTOR = 2
+# Error rate of each next filter is multiplied by this number
+TIGHTENING_RATIO = 0.9
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(ceil(capacity * abs(log(error_rate))
+                                 / (log(2) ** 2)))
+        self.num_hashes = int(ceil(log(1.0 / error_rate, 2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def get_indexes(self, fingerprint):
+        # Enhanced double hashing: k hash functions are built
+        # from two numbers taken from the fingerprint
+        hash1, hash2 = struct.unpack('>QQ', fingerprint[:16])
+        num_bits = self.num_bits
+        hash1 %= num_bits
+        hash2 %= num_bits
+        indexes = []
+        for idx in range(self.num_hashes):
+            indexes.append(hash1)
+            hash1 = (hash1 + hash2) % num_bits
+            hash2 = (hash2 + idx) % num_bits
+        return indexes
+
+    def contains(self, indexes):
+        bits = self.bits
+        return all(bits[x >> 3] & (1 << (x & 7)) for x in indexes)
+
+    def add(self, indexes):
+        bits = self.bits
+        for idx in indexes:
+            bits[idx >> 3] |= 1 << (idx & 7)
+        self.count += 1
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class DupeFilterBackend(DupeFilterInterface):
+    def __init__(self, spider_name, capacity=DEFAULT_CAPACITY,
+                 error_rate=DEFAULT_ERROR_RATE, path=None, **kwargs):
+        """
+        Args:
+            :param capacity: number of fingerprints which the first
+                filter could hold with given error rate
+            :param error_rate: max. probability to treat new task
+                as duplicate
+            :param path: path to file to keep the filter between
+                spider runs
+        """
+
+        super(DupeFilterBackend, self).__init__(spider_name, **kwargs)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.path = path
+        self.lock = Lock()
+        self.filters = []
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def add_filter(self):
+        number = len(self.filters)
+        self.filters.append(BloomFilter(
+            self.capacity * (GROWTH_FACTOR ** number),
+            self.error_rate * (1 - TIGHTENING_RATIO)
+            * (TIGHTENING_RATIO ** number),
+        ))
+
+    def add(self, fingerprint):
+        with self.lock:
+            for bloom in self.filters:
+                if bloom.contains(bloom.get_indexes(fingerprint)):
+                    return False
+            if not self.filters or self.filters[-1].is_full():
+                self.add_filter()
+            bloom = self.filters[-1]
+            bloom.add(bloom.get_indexes(fingerprint))
+            return True
+
+    def size(self):
+        return sum(x.count for x in self.filters)
+
+    def clear(self):
+        with self.lock:
+            self.filters = []
+
+    def get_state(self):
+        with self.lock:
+            return pickle.dumps(self.filters, pickle.HIGHEST_PROTOCOL)
+
+    def set_state(self, state):
+        with self.lock:
+            self.filters = pickle.loads(state)
+
+    def load(self):
+        with open(self.path, 'rb') as inp:
+            self.filters = pickle.load(inp)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with self.lock:
+            with open(tmp_path, 'wb') as out:
+                pickle.dump(self.filters, out, pickle.HIGHEST_PROTOCOL)
+        replace_file(tmp_path, self.path)
+
+    def close(self):
+        if self.path is not None:
+            self.save()
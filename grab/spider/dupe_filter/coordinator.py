@@ -0,0 +1,53 @@
+"""
+Duplicate task filter backend which keeps fingerprints in crawl
+coordinator server so the filter is shared by spiders running
+on multiple hosts.
+"""
+from threading import Lock
+
+from grab.spider.coordinator import (
+    CoordinatorClient, DEFAULT_HOST, DEFAULT_PORT,
+)
+from grab.spider.dupe_filter.base import DupeFilterInterface
+
+
+class DupeFilterBackend(DupeFilterInterface):
+    def __init__(self, spider_name, address=(DEFAULT_HOST, DEFAULT_PORT),
+                 authkey=None, set_name=None, **kwargs):
+        """
+        Args:
+            :param address: address of coordinator server, (host, port)
+                tuple or "host:port" string
+            :param authkey: secret key shared with coordinator server
+            :param set_name: name of the set of fingerprints in coordinator
+        """
+
+        super(DupeFilterBackend, self).__init__(spider_name, **kwargs)
+        if set_name is None:
+            set_name = 'dupe_filter_%s' % spider_name
+        self.set_name = set_name
+        self.client = CoordinatorClient(address, authkey)
+        # Fingerprints known to be seen, they are not sent again
+        self.seen = set()
+        self.lock = Lock()
+
+    def add(self, fingerprint):
+        with self.lock:
+            if fingerprint in self.seen:
+                return False
+        is_new = self.client.request('seen_add', self.set_name,
+                                     [fingerprint])[0]
+        with self.lock:
+            self.seen.add(fingerprint)
+        return is_new
+
+    def size(self):
+        return self.client.request('seen_size', self.set_name)
+
+    def clear(self):
+        with self.lock:
+            self.seen = set()
+        self.client.request('seen_clear', self.set_name)
+
+    def close(self):
+        self.client.close()
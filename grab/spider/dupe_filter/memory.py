@@ -0,0 +1,32 @@
+from threading import Lock
+
+from grab.spider.dupe_filter.base import DupeFilterInterface
+
+
+class DupeFilterBackend(DupeFilterInterface):
+    def __init__(self, spider_name, **kwargs):
+        super(DupeFilterBackend, self).__init__(spider_name, **kwargs)
+        self.fingerprints = set()
+        self.lock = Lock()
+
+    def add(self, fingerprint):
+        with self.lock:
+            if fingerprint in self.fingerprints:
+                return False
+            self.fingerprints.add(fingerprint)
+            return True
+
+    def size(self):
+        return len(self.fingerprints)
+
+    def get_state(self):
+        with self.lock:
+            return set(self.fingerprints)
+
+    def set_state(self, state):
+        with self.lock:
+            self.fingerprints = set(state)
+
+    def clear(self):
+        with self.lock:
+            self.fingerprints.clear()
@@ -0,0 +1,112 @@
+"""
+Duplicate task filter backend powered by sqlite
+
+Fingerprints are stored in local database file. By default it is the file
+of sqlite task queue backend so the filter and the queue could be restored
+together after the crash of the spider process.
+"""
+import logging
+import sqlite3
+from threading import Lock
+
+from grab.spider.dupe_filter.base import DupeFilterInterface
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.spider.dupe_filter.sqlite')
+# pylint: enable=invalid-name
+
+# Number of new fingerprints which are inserted into database
+# in one transaction
+DEFAULT_BATCH_SIZE = 1000
+
+
+class DupeFilterBackend(DupeFilterInterface):
+    def __init__(self, spider_name, path=None, table_name=None,
+                 batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+        """
+        Args:
+            :param path: path to database file, by default the file
+                of sqlite task queue is used
+            :param table_name: name of the database table
+            :param batch_size: max. number of new fingerprints kept
+                in memory before they are written to the database
+        """
+
+        super(DupeFilterBackend, self).__init__(spider_name, **kwargs)
+        if table_name is None:
+            table_name = 'dupe_filter_%s' % spider_name
+        if path is None:
+            path = 'task_queue_%s.sqlite' % spider_name
+        self.path = path
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.lock = Lock()
+        # Fingerprints waiting to be inserted
+        self.write_buffer = set()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS "%s" ('
+                'fingerprint BLOB PRIMARY KEY) WITHOUT ROWID'
+                % self.table_name
+            )
+        self.stored_size = self.connection.execute(
+            'SELECT COUNT(*) FROM "%s"' % self.table_name
+        ).fetchone()[0]
+        logger.debug('Using sqlite dupe filter: %s (%s)', self.path,
+                     self.table_name)
+
+    def flush(self):
+        """
+        Write buffered fingerprints into the database.
+
+        Must be called with acquired lock.
+        """
+
+        if self.write_buffer:
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO "%s" (fingerprint) VALUES (?)'
+                    % self.table_name,
+                    [(sqlite3.Binary(x),) for x in self.write_buffer],
+                )
+            self.stored_size += len(self.write_buffer)
+            self.write_buffer = set()
+
+    def add(self, fingerprint):
+        with self.lock:
+            if fingerprint in self.write_buffer:
+                return False
+            row = self.connection.execute(
+                'SELECT 1 FROM "%s" WHERE fingerprint = ?' % self.table_name,
+                (sqlite3.Binary(fingerprint),),
+            ).fetchone()
+            if row is not None:
+                return False
+            self.write_buffer.add(fingerprint)
+            if len(self.write_buffer) >= self.batch_size:
+                self.flush()
+            return True
+
+    def size(self):
+        return self.stored_size + len(self.write_buffer)
+
+    def get_state(self):
+        # Fingerprints are kept in the database file
+        with self.lock:
+            self.flush()
+        return None
+
+    def clear(self):
+        with self.lock:
+            self.write_buffer = set()
+            with self.connection:
+                self.connection.execute('DELETE FROM "%s"' % self.table_name)
+            self.stored_size = 0
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.connection.close()
@@ -64,6 +64,10 @@ class ApiHandler(SimpleHTTPRequestHandler):
                 self.spider.cache_writer_service.input_queue.qsize()
                 if self.spider.cache_writer_service else '--'
             ),
+            'proxies': (
+                self.spider.proxylist.get_stats()
+                if self.spider.proxylist_enabled else {}
+            ),
         }
         content = make_str(json.dumps(info))
         self.response(content=content)
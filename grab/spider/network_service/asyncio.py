@@ -0,0 +1,132 @@
+"""
+Network service which drives pycurl multi interface with asyncio event loop.
+
+All network activity happens in one thread: curl sockets are watched
+by the event loop and curl timers are scheduled as event loop callbacks.
+"""
+from __future__ import absolute_import
+import asyncio
+import logging
+
+import pycurl
+
+from grab.spider.base_service import WAKEUP_TIMEOUT
+from grab.spider.network_service.multicurl import NetworkServiceMulticurl
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.spider.network_service.asyncio')
+# pylint: enable=invalid-name
+
+
+class NetworkServiceAsyncio(NetworkServiceMulticurl):
+    def __init__(self, spider, socket_number, **kwargs):
+        super(NetworkServiceAsyncio, self).__init__(spider, socket_number,
+                                                    **kwargs)
+        self.loop = None
+        self.timer_handle = None
+        self.spawn_handle = None
+        self.state_check_handle = None
+        self.watched_sockets = set()
+
+    def reactor_callback(self, worker):
+        loop = asyncio.new_event_loop()
+        loop.set_exception_handler(self.handle_loop_error)
+        self.loop = loop
+        try:
+            self.schedule_state_check()
+            self.schedule_spawn(worker)
+            loop.run_forever()
+        finally:
+            self.loop = None
+            for sock in self.watched_sockets:
+                loop.remove_reader(sock)
+                loop.remove_writer(sock)
+            self.watched_sockets.clear()
+            loop.close()
+
+    def call_soon_threadsafe(self, callback, *args):
+        loop = self.loop
+        if loop:
+            try:
+                loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                # Event loop is closed
+                pass
+
+    def wakeup(self):
+        self.call_soon_threadsafe(self.schedule_state_check)
+
+    def notify_new_task(self):
+        self.call_soon_threadsafe(self.schedule_spawn, self.reactor)
+
+    def handle_loop_error(self, loop, context):
+        ex = context.get('exception')
+        if ex is None:
+            loop.default_exception_handler(context)
+        else:
+            # Same as `ServiceWorker` does with errors of worker callback
+            logger.error('Spider Service Fatal Error', exc_info=ex)
+            self.spider.fatal_error_queue.put(
+                (ex.__class__, ex, ex.__traceback__)
+            )
+
+    def schedule_state_check(self, delay=0):
+        if self.state_check_handle:
+            self.state_check_handle.cancel()
+        self.state_check_handle = self.loop.call_later(
+            delay, self.check_worker_state, self.reactor,
+        )
+
+    def check_worker_state(self, worker):
+        self.state_check_handle = None
+        if worker.stop_event.is_set():
+            self.loop.stop()
+        else:
+            worker.process_pause_signal()
+            self.schedule_state_check(WAKEUP_TIMEOUT)
+
+    def schedule_spawn(self, worker, delay=0):
+        if self.spawn_handle:
+            self.spawn_handle.cancel()
+        self.spawn_handle = self.loop.call_later(delay, self.spawn_loop_tasks,
+                                                 worker)
+
+    def spawn_loop_tasks(self, worker):
+        self.spawn_handle = None
+        self.spawn_tasks(worker)
+        if self.spawn_handle is None:
+            # The spawning is scheduled again as soon as some network
+            # result is ready or new task is put into the task queue
+            self.schedule_spawn(worker, self.get_idle_timeout())
+
+    def handle_socket(self, event, sock, multi, data):
+        # pylint: disable=unused-argument
+        if sock in self.watched_sockets:
+            self.loop.remove_reader(sock)
+            self.loop.remove_writer(sock)
+            self.watched_sockets.discard(sock)
+        if event in (pycurl.POLL_IN, pycurl.POLL_INOUT):
+            self.loop.add_reader(sock, self.process_socket_event, sock,
+                                 pycurl.CSELECT_IN)
+            self.watched_sockets.add(sock)
+        if event in (pycurl.POLL_OUT, pycurl.POLL_INOUT):
+            self.loop.add_writer(sock, self.process_socket_event, sock,
+                                 pycurl.CSELECT_OUT)
+            self.watched_sockets.add(sock)
+
+    def handle_timer(self, timeout_ms):
+        if self.timer_handle:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        if timeout_ms >= 0:
+            self.timer_handle = self.loop.call_later(
+                timeout_ms / 1000.0, self.process_socket_event,
+                pycurl.SOCKET_TIMEOUT, 0,
+            )
+
+    def process_socket_event(self, sock, event):
+        if sock == pycurl.SOCKET_TIMEOUT:
+            self.timer_handle = None
+        self.socket_action(sock, event)
+        if self.process_results():
+            self.schedule_spawn(self.reactor)
@@ -1,4 +1,4 @@
-# TODO: is Lock still required?
+import os
 import select
 from threading import Lock
 import time
@@ -6,10 +6,9 @@ import time
 import pycurl
 import six
 
-from grab.util.log import PycurlSigintHandler
 from grab.error import GrabTooManyRedirectsError
 from grab.transport.curl import build_grab_exception
-from grab.spider.base_service import BaseService
+from grab.spider.base_service import BaseService, WAKEUP_TIMEOUT
 
 ERROR_TOO_MANY_REFRESH_REDIRECTS = -2
 #ERROR_INTERNAL_GRAB_ERROR = -3
@@ -18,98 +17,424 @@ ERROR_ABBR = {
     #ERROR_INTERNAL_GRAB_ERROR: 'internal-grab-error',
 }
 for key in dir(pycurl):
-    if key.startswith('E_'):
+    # E_MULTI_* codes are results of multi interface calls,
+    # their values overlap the codes of request errors
+    if key.startswith('E_') and not key.startswith('E_MULTI_'):
         abbr = key[2:].lower().replace('_', '-')
         ERROR_ABBR[getattr(pycurl, key)] = abbr
+# How often the reactor checks the task queue
+# if the poller could not be woken up from other thread.
+IDLE_CHECK_INTERVAL = 0.1
+# Number of requests after which curl handle is replaced with new one
+HANDLE_USE_LIMIT = 100
+# Data shared between curl handles
+SHARE_LOCK_DATA = ('LOCK_DATA_DNS', 'LOCK_DATA_SSL_SESSION',
+                   'LOCK_DATA_CONNECT')
+
+
+class PollPoller(object):
+    """
+    Watches curl sockets with `select.poll`.
+
+    The `poll` method returns list of (socket, curl event) pairs.
+    Other threads could interrupt the `poll` call with `wakeup` method.
+    """
+
+    supports_wakeup = True
+
+    def __init__(self):
+        self.poll_object = self.create_poll_object()
+        self.sockets = set()
+        self.wakeup_pending = False
+        self.wakeup_lock = Lock()
+        self.closed = False
+        self.wakeup_reader, self.wakeup_writer = os.pipe()
+        self.poll_object.register(self.wakeup_reader, self.flag_in)
+
+    def create_poll_object(self):
+        # pylint: disable=no-member
+        self.flag_in = select.POLLIN
+        self.flag_out = select.POLLOUT
+        self.flag_hup = select.POLLHUP
+        self.flag_err = select.POLLERR
+        return select.poll()
+
+    def register(self, sock, event):
+        mask = 0
+        if event in (pycurl.POLL_IN, pycurl.POLL_INOUT):
+            mask |= self.flag_in
+        if event in (pycurl.POLL_OUT, pycurl.POLL_INOUT):
+            mask |= self.flag_out
+        if sock in self.sockets:
+            self.poll_object.modify(sock, mask)
+        else:
+            self.poll_object.register(sock, mask)
+            self.sockets.add(sock)
+
+    def unregister(self, sock):
+        if sock in self.sockets:
+            self.sockets.discard(sock)
+            try:
+                self.poll_object.unregister(sock)
+            except (IOError, OSError, KeyError):
+                # Socket could be already closed by curl
+                pass
+
+    def wakeup(self):
+        if not self.wakeup_pending:
+            with self.wakeup_lock:
+                # Do not write into closed descriptor, its number
+                # could be already reused by some curl socket
+                if not self.closed:
+                    self.wakeup_pending = True
+                    os.write(self.wakeup_writer, b'.')
+
+    def poll(self, timeout):
+        result = []
+        for sock, mask in self.poll_native(timeout):
+            if sock == self.wakeup_reader:
+                self.wakeup_pending = False
+                os.read(self.wakeup_reader, 1024)
+                continue
+            event = 0
+            if mask & (self.flag_in | self.flag_hup):
+                event |= pycurl.CSELECT_IN
+            if mask & self.flag_out:
+                event |= pycurl.CSELECT_OUT
+            if mask & self.flag_err:
+                event |= pycurl.CSELECT_ERR
+            result.append((sock, event))
+        return result
+
+    def poll_native(self, timeout):
+        return self.poll_object.poll(int(timeout * 1000))
+
+    def close(self):
+        with self.wakeup_lock:
+            self.closed = True
+            os.close(self.wakeup_reader)
+            os.close(self.wakeup_writer)
+
+
+class EpollPoller(PollPoller):
+    """
+    Watches curl sockets with `select.epoll`.
+    """
+
+    def create_poll_object(self):
+        # pylint: disable=no-member
+        self.flag_in = select.EPOLLIN
+        self.flag_out = select.EPOLLOUT
+        self.flag_hup = select.EPOLLHUP
+        self.flag_err = select.EPOLLERR
+        return select.epoll()
+
+    def poll_native(self, timeout):
+        return self.poll_object.poll(timeout)
+
+    def close(self):
+        super(EpollPoller, self).close()
+        self.poll_object.close()
+
+
+class SelectPoller(object):
+    """
+    Watches curl sockets with `select.select`.
+
+    Used only on platforms without `poll` i.e. on windows.
+    It could not be woken up from other thread.
+    """
+
+    supports_wakeup = False
+
+    def __init__(self):
+        self.rlist = set()
+        self.wlist = set()
+
+    def register(self, sock, event):
+        self.unregister(sock)
+        if event in (pycurl.POLL_IN, pycurl.POLL_INOUT):
+            self.rlist.add(sock)
+        if event in (pycurl.POLL_OUT, pycurl.POLL_INOUT):
+            self.wlist.add(sock)
+
+    def unregister(self, sock):
+        self.rlist.discard(sock)
+        self.wlist.discard(sock)
+
+    def wakeup(self):
+        pass
+
+    def poll(self, timeout):
+        if not self.rlist and not self.wlist:
+            # select fails on windows if all lists are empty
+            time.sleep(timeout)
+            return []
+        xlist = self.rlist | self.wlist
+        rlist, wlist, xlist = select.select(self.rlist, self.wlist,
+                                            xlist, timeout)
+        events = {}
+        for sock in rlist:
+            events[sock] = events.get(sock, 0) | pycurl.CSELECT_IN
+        for sock in wlist:
+            events[sock] = events.get(sock, 0) | pycurl.CSELECT_OUT
+        for sock in xlist:
+            events[sock] = events.get(sock, 0) | pycurl.CSELECT_ERR
+        return list(events.items())
+
+    def close(self):
+        pass
+
+
+def create_curl_share():
+    """
+    Create `pycurl.CurlShare` which shares DNS cache, TLS sessions and
+    connection cache between curl handles.
+
+    Data which is not supported by pycurl or libcurl is not shared.
+    """
+
+    share = pycurl.CurlShare()
+    for name in SHARE_LOCK_DATA:
+        if hasattr(pycurl, name):
+            try:
+                share.setopt(pycurl.SH_SHARE, getattr(pycurl, name))
+            except pycurl.error:
+                pass
+    return share
+
+
+def get_proxy_key(grab):
+    """
+    Return the key which identifies the proxy of the request.
+    """
+
+    if grab.config['proxy']:
+        return (grab.config['proxy'], grab.config['proxy_type'],
+                grab.config['proxy_userpwd'])
+    else:
+        return None
+
+
+def create_poller():
+    if hasattr(select, 'epoll'):
+        return EpollPoller()
+    elif hasattr(select, 'poll'):
+        return PollPoller()
+    else:
+        return SelectPoller()
 
 
 class NetworkServiceMulticurl(BaseService):
-    def __init__(self, spider, socket_number):
+    def __init__(self, spider, socket_number, max_connects=None,
+                 max_host_connections=None, multiplex=False):
         """
         Args:
             spider: argument is not used in multicurl transport
+            max_connects: max. number of idle connections which
+                curl keeps open to reuse them, CURLMOPT_MAXCONNECTS
+            max_host_connections: max. number of connections to one host,
+                CURLMOPT_MAX_HOST_CONNECTIONS
+            multiplex: if True then concurrent requests to one host
+                are sent as streams of one HTTP/2 connection
         """
 
         self.spider = spider
         self.socket_number = socket_number
         self.multi = pycurl.CurlMulti()
         self.multi.handles = []
+        self.multi.setopt(pycurl.M_SOCKETFUNCTION, self.handle_socket)
+        self.multi.setopt(pycurl.M_TIMERFUNCTION, self.handle_timer)
+        if max_connects:
+            self.multi.setopt(pycurl.M_MAXCONNECTS, max_connects)
+        if max_host_connections:
+            self.multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS,
+                              max_host_connections)
+        self.multiplex = multiplex
+        if multiplex:
+            self.multi.setopt(pycurl.M_PIPELINING, pycurl.PIPE_MULTIPLEX)
+        # (ip, port, local port) -> number of HTTP/2 streams
+        self.connection_stream_count = {}
+        # Handles live shorter than the share so they could be
+        # replaced without losing DNS cache, TLS sessions and connections
+        self.share = create_curl_share()
+        self.handle_use_limit = HANDLE_USE_LIMIT
         self.freelist = []
         self.registry = {}
         self.connection_count = {}
-        self.sigint_handler = PycurlSigintHandler()
-        self.network_op_lock = Lock()
+        # id(curl) -> key of the proxy used by the last request of the handle
+        self.handle_proxy = {}
+        self.poller = None
+        # Time when curl asked to call `socket_action` with SOCKET_TIMEOUT
+        self.timer_deadline = None
+        self.has_delayed_tasks = False
 
         # Create curl instances
         for _ in six.moves.range(self.socket_number):
-            curl = pycurl.Curl()
+            curl = self.create_curl()
             self.connection_count[id(curl)] = 0
             self.freelist.append(curl)
             # self.multi.handles.append(curl)
 
-        self.spawner = self.create_worker(self.spawner_callback)
-        self.async_loop = self.create_worker(self.async_loop_callback)
-        self.register_workers(self.spawner, self.async_loop)
-
-    def async_loop_callback(self, worker):
-        while not worker.stop_event.is_set():
-            worker.process_pause_signal()
-            self.process_handlers()
-            time.sleep(0.01)
-
-    def spawner_callback(self, worker):
-        while not worker.stop_event.is_set():
-            worker.process_pause_signal()
-            if self.get_free_threads_number():
-                task = self.spider.get_task_from_queue()
-                if task is None or task is True:
-                    time.sleep(0.1)
-                else:
-                    worker.is_busy_event.set()
-                    try:
-                        task.network_try_count += 1 # pylint: disable=no-member
-                        is_valid, reason = self.spider.check_task_limits(task)
-                        if is_valid:
-                            grab = self.spider.setup_grab_for_task(task)
-                            self.spider.submit_task_to_transport(task, grab)
-                        else:
-                            self.spider.log_rejected_task(task, reason)
-                            # pylint: disable=no-member
-                            handler = task.get_fallback_handler(self.spider)
-                            # pylint: enable=no-member
-                            if handler:
-                                handler(task)
-                    finally:
-                        worker.is_busy_event.clear()
-
-            for result, task in self.iterate_results():
-                self.spider.task_dispatcher.input_queue.put(
-                    (result, task, None),
-                )
+        self.reactor = self.create_worker(self.reactor_callback)
+        self.register_workers(self.reactor)
+
+    def reactor_callback(self, worker):
+        """
+        Submit new network requests, wait for socket events and
+        read network results in one thread.
+        """
+
+        poller = create_poller()
+        self.poller = poller
+        try:
+            while not worker.stop_event.is_set():
+                worker.process_pause_signal()
+                self.spawn_tasks(worker)
+                timeout = self.get_poll_timeout()
+                if worker.has_pending_signal():
+                    timeout = 0
+                for sock, event in poller.poll(timeout):
+                    self.socket_action(sock, event)
+                if (self.timer_deadline is not None
+                        and time.time() >= self.timer_deadline):
+                    self.timer_deadline = None
+                    self.socket_action(pycurl.SOCKET_TIMEOUT, 0)
+                self.process_results()
+        finally:
+            self.poller = None
+            poller.close()
+
+    def get_idle_timeout(self):
+        if self.has_delayed_tasks:
+            return self.spider.get_delayed_task_timeout()
+        else:
+            return WAKEUP_TIMEOUT
+
+    def get_poll_timeout(self):
+        timeout = self.get_idle_timeout()
+        if not self.poller.supports_wakeup:
+            timeout = min(timeout, IDLE_CHECK_INTERVAL)
+        if self.timer_deadline is not None:
+            timeout = max(0, min(timeout, self.timer_deadline - time.time()))
+        return timeout
+
+    def wakeup(self):
+        poller = self.poller
+        if poller:
+            poller.wakeup()
+
+    def notify_new_task(self):
+        self.wakeup()
+
+    def handle_socket(self, event, sock, multi, data):
+        # pylint: disable=unused-argument
+        if event == pycurl.POLL_REMOVE:
+            self.poller.unregister(sock)
+        else:
+            self.poller.register(sock, event)
+
+    def handle_timer(self, timeout_ms):
+        if timeout_ms < 0:
+            self.timer_deadline = None
+        else:
+            self.timer_deadline = time.time() + timeout_ms / 1000.0
+
+    def socket_action(self, sock, event):
+        while True:
+            status, _ = self.multi.socket_action(sock, event)
+            if status != pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+    def spawn_tasks(self, worker):
+        self.has_delayed_tasks = False
+        while True:
+            free_number = self.get_free_threads_number()
+            if not free_number:
+                break
+            tasks = self.spider.get_tasks_from_queue(free_number)
+            if tasks is None or tasks is True:
+                self.has_delayed_tasks = tasks is True
+                break
+            worker.is_busy_event.set()
+            try:
+                for task in tasks:
+                    self.process_task(task)
+            finally:
+                worker.is_busy_event.clear()
+
+    def process_results(self):
+        count = 0
+        for result, task in self.iterate_results():
+            self.spider.task_dispatcher.input_queue.put(
+                (result, task, None),
+            )
+            count += 1
+        return count
+
+    def process_task(self, task):
+        task.network_try_count += 1
+        is_valid, reason = self.spider.check_task_limits(task)
+        if is_valid:
+            grab = self.spider.setup_grab_for_task(task)
+            self.spider.submit_task_to_transport(task, grab)
+        else:
+            self.spider.log_rejected_task(task, reason)
+            handler = task.get_fallback_handler(self.spider)
+            if handler:
+                handler(task)
+            self.spider.release_task_host(task)
+            self.spider.complete_task(task)
 
     def ready_for_task(self):
         return len(self.freelist)
 
     def get_free_threads_number(self):
-        return len(self.freelist)
+        # Concurrency controller could allow less streams
+        # than the number of curl handles
+        limit = self.spider.get_network_stream_limit()
+        return max(0, min(len(self.freelist),
+                          limit - self.get_active_threads_number()))
 
     def get_active_threads_number(self):
         return self.socket_number - len(self.freelist)
 
+    def create_curl(self):
+        curl = pycurl.Curl()
+        curl.setopt(pycurl.SHARE, self.share)
+        return curl
+
     def process_connection_count(self, curl):
         curl_id = id(curl)
         self.connection_count[curl_id] += 1
-        if self.connection_count[curl_id] > 100:
+        if self.connection_count[curl_id] > self.handle_use_limit:
             del self.connection_count[curl_id]
-            del curl
-            new_curl = pycurl.Curl()
+            self.handle_proxy.pop(curl_id, None)
+            curl.close()
+            new_curl = self.create_curl()
             self.connection_count[id(new_curl)] = 1
             return new_curl
         else:
             return curl
 
+    def take_free_curl(self, proxy_key):
+        """
+        Take free curl handle, the handle which has been used with
+        the same proxy is preferred.
+        """
+
+        for index in six.moves.range(len(self.freelist) - 1, -1, -1):
+            if self.handle_proxy.get(id(self.freelist[index])) == proxy_key:
+                return self.freelist.pop(index)
+        return self.freelist.pop()
+
     def start_task_processing(self, task, grab, grab_config_backup):
-        curl = self.process_connection_count(self.freelist.pop())
+        proxy_key = get_proxy_key(grab)
+        curl = self.process_connection_count(self.take_free_curl(proxy_key))
+        # Libcurl matches cached connections by proxy so the handle
+        # which switches to other proxy reuses warm connection of
+        # that proxy from the shared connection cache
+        self.handle_proxy[id(curl)] = proxy_key
 
         self.registry[id(curl)] = {
             'grab': grab,
@@ -131,6 +456,13 @@ class NetworkServiceMulticurl(BaseService):
                 pycurl.FOLLOWLOCATION,
                 1 if grab.config['follow_location'] else 0
             )
+            if self.multiplex:
+                if grab.config['http_version'] is None:
+                    curl.setopt(pycurl.HTTP_VERSION,
+                                pycurl.CURL_HTTP_VERSION_2TLS)
+                # Wait for the connection which could be multiplexed
+                # instead of opening new one
+                curl.setopt(pycurl.PIPEWAIT, 1)
             grab.log_request()
         except Exception:
             # If some error occurred while processing the request arguments
@@ -140,43 +472,27 @@ class NetworkServiceMulticurl(BaseService):
             raise
         else:
             # Add configured curl instance to multi-curl processor
-            try:
-                self.network_op_lock.acquire()
-                with self.sigint_handler.handle_sigint():
-                    self.multi.add_handle(curl)
-            finally:
-                self.network_op_lock.release()
+            self.multi.add_handle(curl)
 
-    def process_handlers(self):
-        try:
-            self.network_op_lock.acquire()
-            with self.sigint_handler.handle_sigint():
-                rlist, wlist, xlist = self.multi.fdset()
-            if rlist or wlist or xlist:
-                with self.sigint_handler.handle_sigint():
-                    timeout = self.multi.timeout()
-                if timeout and timeout > 0:
-                    select.select(rlist, wlist, xlist, timeout / 1000.0)
-            else:
-                pass
-            while True:
-                with self.sigint_handler.handle_sigint():
-                    status, _ = self.multi.perform()
-                if status != pycurl.E_CALL_MULTI_PERFORM:
-                    break
-        finally:
-            self.network_op_lock.release()
+    def process_connection_stat(self, curl):
+        """
+        Count streams of HTTP/2 connections.
+        """
+
+        if (curl.getinfo(pycurl.INFO_HTTP_VERSION)
+                == pycurl.CURL_HTTP_VERSION_2_0):
+            key = (curl.getinfo(pycurl.PRIMARY_IP),
+                   curl.getinfo(pycurl.PRIMARY_PORT),
+                   curl.getinfo(pycurl.LOCAL_PORT))
+            if key not in self.connection_stream_count:
+                self.connection_stream_count[key] = 0
+                self.spider.stat.inc('spider:http2-connection')
+            self.connection_stream_count[key] += 1
+            self.spider.stat.inc('spider:http2-stream')
 
     def iterate_results(self):
         while True:
-            try:
-                self.network_op_lock.acquire()
-                with self.sigint_handler.handle_sigint():
-                    queued_messages, ok_list, fail_list = (
-                        self.multi.info_read()
-                    )
-            finally:
-                self.network_op_lock.release()
+            queued_messages, ok_list, fail_list = self.multi.info_read()
             #except Exception as ex:
             #    # Usually that should not happen
             #    logging.error('', exc_info=ex)
@@ -210,14 +526,11 @@ class NetworkServiceMulticurl(BaseService):
                     self.registry[curl_id]['grab_config_backup']
 
                 try:
-                    self.network_op_lock.acquire()
                     grab.process_request_result()
                 except GrabTooManyRedirectsError:
                     ecode = ERROR_TOO_MANY_REFRESH_REDIRECTS
                     emsg = 'Too many meta refresh redirects'
                     is_ok = False
-                finally:
-                    self.network_op_lock.release()
                 #except Exception as ex:
                 #    logging.error('', exc_info=ex)
                 #    ecode = ERROR_INTERNAL_GRAB_ERROR
@@ -227,6 +540,8 @@ class NetworkServiceMulticurl(BaseService):
                 grab.doc.error_code = ecode
                 grab.doc.error_msg = emsg
                 grab.exception = grab_exc
+                if is_ok:
+                    self.process_connection_stat(curl)
 
                 # Free resources
                 del self.registry[curl_id]
@@ -246,13 +561,9 @@ class NetworkServiceMulticurl(BaseService):
                     'grab_config_backup': grab_config_backup,
                 }, task
 
-                try:
-                    self.network_op_lock.acquire()
-                    with self.sigint_handler.handle_sigint():
-                        self.multi.remove_handle(curl)
-                finally:
-                    self.network_op_lock.release()
+                self.multi.remove_handle(curl)
 
+                # Pycurl keeps the share of the handle on reset
                 curl.reset()
                 self.freelist.append(curl)
 
@@ -1,11 +1,15 @@
-import time
+from collections import OrderedDict
 
 from six.moves.queue import Empty
 
 from grab.error import GrabNetworkError
 from grab.util.misc import camel_case_to_underscore
-from grab.spider.base_service import BaseService
+from grab.spider.base_service import (
+    BaseService, WakeupSignal, WAKEUP_TIMEOUT,
+)
 
+# Max. number of curl handles kept by one worker thread
+CURL_HANDLE_LIMIT = 10
 ERROR_TOO_MANY_REFRESH_REDIRECTS = -2
 ERROR_ABBR = {
     ERROR_TOO_MANY_REFRESH_REDIRECTS: 'too-many-refresh-redirects',
@@ -17,37 +21,160 @@ def make_class_abbr(name):
     return val.replace('_', '-')
 
 
+class Urllib3TransportPool(object):
+    """
+    Connection pools shared by the requests of one worker thread.
+    """
+
+    def __init__(self):
+        # Optional dependencies are imported only if they are used
+        from urllib3 import PoolManager
+
+        self.pool = PoolManager(10)
+        self.proxy_pools = {}
+
+    def create_transport(self):
+        from grab.transport.urllib3 import Urllib3Transport
+
+        return Urllib3Transport(pool=self.pool, proxy_pools=self.proxy_pools)
+
+    def borrow(self, grab):
+        # Pool managers are thread-safe, the transport could keep them
+        pass
+
+    def release(self, grab):
+        pass
+
+    def close(self):
+        self.pool.clear()
+        for pool in self.proxy_pools.values():
+            pool.clear()
+        self.proxy_pools.clear()
+
+
+class CurlTransportPool(object):
+    """
+    Curl handles of one worker thread.
+
+    The request borrows the handle which was used last time with
+    the proxy of the request to reuse its connections. The handle
+    is detached from the transport when the request is completed.
+    """
+
+    def __init__(self, size=CURL_HANDLE_LIMIT):
+        self.size = size
+        # Proxy key -> curl handle, least recently used goes first
+        self.handles = OrderedDict()
+        # Proxy key of the request which uses borrowed handle
+        self.proxy_key = None
+
+    def create_transport(self):
+        from grab.transport.curl import CurlTransport
+
+        return CurlTransport()
+
+    def borrow(self, grab):
+        import pycurl
+        from grab.spider.network_service.multicurl import get_proxy_key
+
+        self.proxy_key = get_proxy_key(grab)
+        curl = self.handles.pop(self.proxy_key, None)
+        if curl is None and len(self.handles) >= self.size:
+            _, curl = self.handles.popitem(last=False)
+        if curl is None:
+            curl = pycurl.Curl()
+        else:
+            # Options of previous request are dropped,
+            # connection cache of the handle is kept
+            curl.reset()
+        grab.transport.curl = curl
+
+    def release(self, grab):
+        self.handles[self.proxy_key] = grab.transport.curl
+        grab.transport.curl = None
+
+    def close(self):
+        for curl in self.handles.values():
+            curl.close()
+        self.handles.clear()
+
+
 class NetworkServiceThreaded(BaseService):
     def __init__(self, spider, thread_number):
         self.spider = spider
         self.thread_number = thread_number
         self.worker_pool = []
+        self.task_signal = WakeupSignal()
         for _ in range(self.thread_number):
             self.worker_pool.append(self.create_worker(self.worker_callback))
         self.register_workers(self.worker_pool)
 
+    def wakeup(self):
+        self.task_signal.notify_all()
+
+    def notify_new_task(self):
+        self.task_signal.notify()
+
+    def wait_new_task(self, worker, wakeup_state, has_delayed_tasks):
+        if not worker.has_pending_signal():
+            if has_delayed_tasks:
+                timeout = self.spider.get_delayed_task_timeout()
+            else:
+                timeout = WAKEUP_TIMEOUT
+            self.task_signal.wait(wakeup_state, timeout)
+
     def get_active_threads_number(self):
         return sum(1 for x in self.iterate_workers(self.worker_registry)
                    if x.is_busy_event.is_set())
 
+    def is_stream_available(self):
+        # Concurrency controller could allow less streams than the
+        # number of worker threads. The check is not atomic so
+        # the limit could be exceeded slightly for a short time.
+        return (self.get_active_threads_number()
+                < self.spider.get_network_stream_limit())
+
+    def create_transport_pool(self):
+        """
+        Return the pool of connections of one worker thread.
+        """
+
+        if self.spider.grab_transport_name == 'urllib3':
+            return Urllib3TransportPool()
+        else:
+            return CurlTransportPool()
+
     # TODO: supervisor worker to restore failed worker threads
     def worker_callback(self, worker):
+        transport_pool = self.create_transport_pool()
+        try:
+            self.process_tasks(worker, transport_pool)
+        finally:
+            transport_pool.close()
+
+    def process_tasks(self, worker, transport_pool):
         while not worker.stop_event.is_set():
             worker.process_pause_signal()
+            wakeup_state = self.task_signal.get_state()
+            if not self.is_stream_available():
+                self.wait_new_task(worker, wakeup_state, False)
+                continue
             try:
                 task = self.spider.get_task_from_queue()
             except Empty:
-                time.sleep(0.1)
+                self.wait_new_task(worker, wakeup_state, False)
             else:
                 if task is None or task is True:
-                    time.sleep(0.1)
+                    self.wait_new_task(worker, wakeup_state, task is True)
                 else:
                     worker.is_busy_event.set()
                     try:
                         task.network_try_count += 1 # pylint: disable=no-member
                         is_valid, reason = self.spider.check_task_limits(task)
                         if is_valid:
-                            grab = self.spider.setup_grab_for_task(task)
+                            grab = self.spider.setup_grab_for_task(
+                                task,
+                                transport=transport_pool.create_transport)
                             # TODO: almost duplicate of
                             # Spider.submit_task_to_transport
                             if self.spider.only_cache:
@@ -55,6 +182,8 @@ class NetworkServiceThreaded(BaseService):
                                     'spider:'
                                     'request-network-disabled-only-cache'
                                 )
+                                self.spider.release_task_host(task)
+                                self.spider.complete_task(task)
                             else:
                                 grab_config_backup = grab.dump_config()
                                 self.spider.process_grab_proxy(task, grab)
@@ -63,40 +192,39 @@ class NetworkServiceThreaded(BaseService):
                                     'spider:task-%s-network' % task.name
                                 )
 
-                                #self.freelist.pop()
+                                result = {
+                                    'ok': True,
+                                    'ecode': None,
+                                    'emsg': None,
+                                    'error_abbr': None,
+                                    'grab': grab,
+                                    'grab_config_backup': grab_config_backup,
+                                    'task': task,
+                                    'exc': None
+                                }
+                                transport_pool.borrow(grab)
                                 try:
-                                    result = {
-                                        'ok': True,
-                                        'ecode': None,
-                                        'emsg': None,
-                                        'error_abbr': None,
-                                        'grab': grab,
-                                        'grab_config_backup': (
-                                            grab_config_backup
+                                    grab.request()
+                                except GrabNetworkError as ex:
+                                    if (ex.original_exc.__class__.__name__
+                                            == 'error'):
+                                        ex_cls = ex
+                                    else:
+                                        ex_cls = ex.original_exc
+                                    result.update({
+                                        'ok': False,
+                                        'exc': ex,
+                                        'error_abbr': make_class_abbr(
+                                            ex_cls.__class__.__name__
                                         ),
-                                        'task': task,
-                                        'exc': None
-                                    }
-                                    try:
-                                        grab.request()
-                                    except GrabNetworkError as ex:
-                                        if (ex.original_exc.__class__.__name__
-                                                == 'error'):
-                                            ex_cls = ex
-                                        else:
-                                            ex_cls = ex.original_exc
-                                        result.update({
-                                            'ok': False,
-                                            'exc': ex,
-                                            'error_abbr': make_class_abbr(
-                                                ex_cls.__class__.__name__
-                                            ),
-                                        })
-                                    (self.spider.task_dispatcher
-                                     .input_queue.put((result, task, None)))
+                                    })
                                 finally:
-                                    pass
-                                    #self.freelist.append(1)
+                                    # Grab goes to the parser thread which
+                                    # must not share the connections with
+                                    # next request of this worker
+                                    transport_pool.release(grab)
+                                (self.spider.task_dispatcher
+                                 .input_queue.put((result, task, None)))
                         else:
                             self.spider.log_rejected_task(task, reason)
                             # pylint: disable=no-member
@@ -104,5 +232,10 @@ class NetworkServiceThreaded(BaseService):
                             # pylint: enable=no-member
                             if handler:
                                 handler(task)
+                            self.spider.release_task_host(task)
+                            self.spider.complete_task(task)
                     finally:
                         worker.is_busy_event.clear()
+                        if self.spider.concurrency_controller:
+                            # Other workers could wait for free stream
+                            self.task_signal.notify()
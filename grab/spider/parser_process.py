@@ -0,0 +1,323 @@
+"""
+Parser process is used by `ParserService` in "process" mode.
+
+Parser processes are forked from the parser process server which is
+forked from the spider process before other threads of the spider are
+started. Processes which replace the dead or recycled ones are forked
+from that single-threaded process so they do not inherit locks held by
+other threads of the spider process.
+
+Each parser process handles network responses with task handlers of its
+own copy of the spider. Response body is written into the shared memory
+buffer, all other things required to restore `Grab` and `Document`
+objects go through the connection.
+"""
+import mmap
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+import os
+import signal
+import tempfile
+from threading import Lock
+from traceback import format_exc
+
+from grab.document import Document
+from grab.spider.error import NoTaskHandler, SpiderError
+
+DEFAULT_SHARED_BUFFER_SIZE = 2 ** 23
+# How often the parser process server collects exited parser processes
+REAP_INTERVAL = 1
+# Shared memory buffer is a file of memory filesystem if it is available
+SHARED_BUFFER_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+GRAB_STATE_KEYS = ('request_head', 'request_body', 'request_method',
+                   'request_counter', 'meta', 'exception')
+# Document attributes which are not passed to the parser process
+# Body goes through the shared memory, other things could not
+# be pickled or are rebuilt in the parser process
+DOCUMENT_SKIP_KEYS = ('grab', '_bytes_body', '_unicode_body',
+                      '_lxml_tree', '_strict_lxml_tree', '_pyquery',
+                      '_lxml_form')
+
+
+def get_process_context():
+    # There is no `get_context` in py2, multiprocessing
+    # uses fork on all posix platforms there
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    else:
+        return multiprocessing
+
+
+class ParserProcessServer(object):
+    """
+    Process which forks parser processes on request of the spider process.
+    """
+
+    def __init__(self, spider):
+        self.spider = spider
+        context = get_process_context()
+        self.conn, self.child_conn = context.Pipe()
+        self.process = context.Process(target=self.server_callback)
+        self.process.daemon = True
+        # Parser workers start their processes in different threads
+        self.lock = Lock()
+        self.stopped = False
+
+    def start(self):
+        self.process.start()
+        self.child_conn.close()
+
+    def stop(self, timeout=1):
+        with self.lock:
+            self.stopped = True
+            try:
+                self.conn.send(None)
+            except (IOError, OSError):
+                pass
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.conn.close()
+
+    def fork(self, proc):
+        """
+        Fork parser process which connects to the given `ParserProcess`.
+
+        Returns PID of the forked process.
+        """
+
+        with self.lock:
+            if self.stopped:
+                raise SpiderError('Parser process server is stopped')
+            self.conn.send((proc.address, proc.authkey, proc.buffer_path,
+                            proc.buffer_size))
+            result = self.conn.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def server_callback(self):
+        self.conn.close()
+        while True:
+            try:
+                if self.child_conn.poll(REAP_INTERVAL):
+                    msg = self.child_conn.recv()
+                    if msg is None:
+                        break
+                    self.child_conn.send(self.fork_parser_process(*msg))
+            except (EOFError, IOError):
+                # Spider process has exited
+                break
+            self.reap_parser_processes()
+
+    def fork_parser_process(self, address, authkey, buffer_path,
+                            buffer_size):
+        try:
+            pid = os.fork()
+        except OSError as ex:
+            return SpiderError('Could not fork parser process: %s' % ex)
+        if pid:
+            return pid
+        exit_code = 1
+        try:
+            self.child_conn.close()
+            proc = ParserProcess(self.spider, buffer_size)
+            proc.connect(address, authkey, buffer_path)
+            proc.child_callback()
+            exit_code = 0
+        finally:
+            os._exit(exit_code) # pylint: disable=protected-access
+
+    def reap_parser_processes(self):
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except OSError:
+            # No child processes
+            pass
+
+
+class ParserProcess(object):
+    def __init__(self, spider, buffer_size=DEFAULT_SHARED_BUFFER_SIZE):
+        self.spider = spider
+        self.buffer_size = buffer_size
+        self.buffer_path = None
+        self.shared_buffer = None
+        self.address = None
+        self.authkey = None
+        self.conn = None
+        self.child_conn = None
+        self.pid = None
+
+    def start(self, server):
+        """
+        Start parser process with the given `ParserProcessServer`.
+        """
+
+        # The file is mapped into memory of both processes, it is
+        # removed when the parser process has mapped it
+        fd, self.buffer_path = tempfile.mkstemp(prefix='grab-parser-',
+                                                dir=SHARED_BUFFER_DIR)
+        try:
+            os.ftruncate(fd, self.buffer_size)
+            self.shared_buffer = mmap.mmap(fd, self.buffer_size)
+        finally:
+            os.close(fd)
+        self.authkey = os.urandom(32)
+        listener = Listener(family='AF_UNIX', authkey=self.authkey)
+        self.address = listener.address
+        try:
+            self.pid = server.fork(self)
+            # The connection is closed when parser process dies
+            # so the spider process gets EOFError
+            self.conn = listener.accept()
+        finally:
+            listener.close()
+            os.unlink(self.buffer_path)
+
+    def stop(self, timeout=1):
+        try:
+            self.conn.send(None)
+            # Parser process closes the connection on exit
+            stopped = self.conn.poll(timeout)
+        except (EOFError, IOError, OSError):
+            stopped = True
+        if not stopped:
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self.conn.close()
+        self.shared_buffer.close()
+
+    def is_alive(self):
+        try:
+            os.kill(self.pid, 0)
+        except OSError:
+            return False
+        else:
+            return True
+
+    # ******************
+    # Spider process API
+    # ******************
+
+    def submit(self, result, task):
+        """
+        Pass network result to the parser process.
+
+        Yields messages sent back by parser process until the task
+        handler is completed.
+        """
+
+        grab = result['grab']
+        doc = grab.doc
+        grab_state = dict((x, getattr(grab, x)) for x in GRAB_STATE_KEYS)
+        # Some attributes are not set by all transports
+        doc_state = dict((x, getattr(doc, x)) for x in Document.__slots__
+                         if x not in DOCUMENT_SKIP_KEYS and hasattr(doc, x))
+        body = None if doc.body_path else doc.body
+        if body is None or len(body) > self.buffer_size:
+            inline_body, body_size = body, None
+        else:
+            self.shared_buffer.seek(0)
+            self.shared_buffer.write(body)
+            inline_body, body_size = None, len(body)
+        self.conn.send((task, grab.dump_config(), grab_state, doc_state,
+                        body_size, inline_body))
+        while True:
+            msg = self.conn.recv()
+            if msg[0] == 'done':
+                break
+            else:
+                yield msg
+
+    # ******************
+    # Parser process API
+    # ******************
+
+    def connect(self, address, authkey, buffer_path):
+        fd = os.open(buffer_path, os.O_RDWR)
+        try:
+            self.shared_buffer = mmap.mmap(fd, self.buffer_size)
+        finally:
+            os.close(fd)
+        self.child_conn = Client(address, family='AF_UNIX', authkey=authkey)
+
+    def child_callback(self):
+        spider = self.spider
+        # Tasks added with `add_task` inside task handler
+        # are sent to the spider process
+        spider.add_task = self.child_add_task
+        while True:
+            try:
+                msg = self.child_conn.recv()
+            except EOFError:
+                # Spider process has exited
+                break
+            if msg is None:
+                break
+            task, grab = self.restore_task_grab(*msg)
+            counters = dict(spider.stat.counters)
+            collection_sizes = dict((x, len(y)) for x, y
+                                    in spider.stat.collections.items())
+            try:
+                handler = spider.find_task_handler(task)
+            except NoTaskHandler as ex:
+                self.child_send(('no-handler', ex, format_exc()))
+            else:
+                try:
+                    handler_result = handler(grab, task)
+                    if handler_result is not None:
+                        for item in handler_result:
+                            self.child_send(('item', item))
+                except Exception as ex: # pylint: disable=broad-except
+                    self.child_send(('error', ex, format_exc()))
+            self.child_send(('stat',) + self.build_stat_delta(
+                counters, collection_sizes))
+            self.child_send(('done',))
+
+    def restore_task_grab(self, task, grab_config, grab_state, doc_state,
+                          body_size, inline_body):
+        grab = self.spider.create_grab_instance()
+        grab.load_config(grab_config)
+        for key, value in grab_state.items():
+            setattr(grab, key, value)
+        doc = Document(grab)
+        for key, value in doc_state.items():
+            setattr(doc, key, value)
+        if body_size is not None:
+            self.shared_buffer.seek(0)
+            doc.body = self.shared_buffer.read(body_size)
+        elif inline_body is not None:
+            doc.body = inline_body
+        grab.doc = doc
+        return task, grab
+
+    def build_stat_delta(self, counters, collection_sizes):
+        stat = self.spider.stat
+        counters_delta = {}
+        for key, value in stat.counters.items():
+            if value != counters.get(key, 0):
+                counters_delta[key] = value - counters.get(key, 0)
+        collections_delta = {}
+        for key, value in stat.collections.items():
+            size = collection_sizes.get(key, 0)
+            if len(value) > size:
+                collections_delta[key] = value[size:]
+        return counters_delta, collections_delta
+
+    # pylint: disable=unused-argument
+    def child_add_task(self, task, queue=None, raise_error=False):
+        # pylint: enable=unused-argument
+        self.child_send(('item', task))
+        return True
+
+    def child_send(self, msg):
+        try:
+            self.child_conn.send(msg)
+        except Exception as ex: # pylint: disable=broad-except
+            # Could not pickle the message
+            error = SpiderError('Could not send %s from parser process: %s'
+                                % (msg[0], ex))
+            self.child_conn.send(('error', error, format_exc()))
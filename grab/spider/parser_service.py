@@ -1,31 +1,77 @@
-import time
 from traceback import format_exc
 import sys
 
-from six.moves.queue import Queue
 from six.moves import queue
 
-from grab.spider.base_service import BaseService
-from grab.spider.error import NoTaskHandler
+from grab.spider.base_service import BaseService, ServiceQueue
+from grab.spider.error import NoTaskHandler, SpiderError
+from grab.spider.parser_process import (
+    ParserProcess, ParserProcessServer, DEFAULT_SHARED_BUFFER_SIZE,
+)
 
 
 class ParserService(BaseService):
-    def __init__(self, spider, pool_size):
+    def __init__(self, spider, pool_size, backend='thread'):
         self.spider = spider
-        self.input_queue = Queue()
+        self.input_queue = ServiceQueue()
         self.pool_size = pool_size
+        self.backend = backend
+        self.shared_buffer_size = DEFAULT_SHARED_BUFFER_SIZE
+        self.process_registry = {}
+        self.process_server = None
         self.workers_pool = []
         for _ in range(self.pool_size):
-            self.workers_pool.append(self.create_worker(self.worker_callback))
+            self.workers_pool.append(self.create_parser_worker())
         self.supervisor = self.create_worker(self.supervisor_callback)
         self.register_workers(self.workers_pool, self.supervisor)
 
+    def create_parser_worker(self):
+        if self.backend == 'process':
+            return self.create_worker(self.process_worker_callback)
+        else:
+            return self.create_worker(self.worker_callback)
+
+    def start(self):
+        if self.backend == 'process':
+            # Fork the process server before any worker thread is started,
+            # all parser processes are forked from it
+            self.process_server = ParserProcessServer(self.spider)
+            self.process_server.start()
+            for worker in self.workers_pool:
+                self.start_parser_process(worker)
+        super(ParserService, self).start()
+
+    def stop(self):
+        # Stop supervisor first to not allow it
+        # to restart stopped parser workers
+        self.supervisor.stop()
+        super(ParserService, self).stop()
+        if self.process_server:
+            self.process_server.stop()
+
+    def wakeup(self):
+        self.input_queue.wakeup()
+
+    def start_parser_process(self, worker):
+        proc = ParserProcess(self.spider, self.shared_buffer_size)
+        proc.start(self.process_server)
+        self.process_registry[worker] = proc
+        return proc
+
+    def stop_parser_process(self, worker):
+        proc = self.process_registry.pop(worker, None)
+        if proc:
+            proc.stop()
+
     def check_pool_health(self):
         to_remove = []
-        for worker in self.workers_pool:
+        for worker in list(self.workers_pool):
+            if self.supervisor.stop_event.is_set():
+                # Do not restart workers of stopped service
+                break
             if not worker.is_alive():
                 self.spider.stat.inc('parser:worker-restarted')
-                new_worker = self.create_worker(self.worker_callback)
+                new_worker = self.create_parser_worker()
                 self.workers_pool.append(new_worker)
                 new_worker.start()
                 to_remove.append(worker)
@@ -36,14 +82,14 @@ class ParserService(BaseService):
         while not worker.stop_event.is_set():
             worker.process_pause_signal()
             self.check_pool_health()
-            time.sleep(1)
+            worker.sleep(1)
 
     def worker_callback(self, worker):
         process_request_count = 0
         while not worker.stop_event.is_set():
             worker.process_pause_signal()
             try:
-                result, task = self.input_queue.get(True, 0.1)
+                result, task = self.input_queue.get_or_wakeup(worker)
             except queue.Empty:
                 pass
             else:
@@ -61,6 +107,7 @@ class ParserService(BaseService):
                     else:
                         self.execute_task_handler(handler, result, task)
                         self.spider.stat.inc('parser:handler-processed')
+                    self.send_task_done(task)
                     if self.spider.parser_requests_per_process:
                         if (process_request_count >=
                                 self.spider.parser_requests_per_process):
@@ -71,6 +118,90 @@ class ParserService(BaseService):
                 finally:
                     worker.is_busy_event.clear()
 
+    def process_worker_callback(self, worker):
+        """
+        Pass network results to the parser process and
+        forward the results of task handler back to the task dispatcher.
+        """
+
+        proc = self.process_registry.get(worker)
+        if proc is None:
+            # The worker has been restarted by supervisor
+            proc = self.start_parser_process(worker)
+        process_request_count = 0
+        try:
+            while not worker.stop_event.is_set():
+                worker.process_pause_signal()
+                try:
+                    result, task = self.input_queue.get_or_wakeup(worker)
+                except queue.Empty:
+                    pass
+                else:
+                    worker.is_busy_event.set()
+                    try:
+                        process_request_count += 1
+                        try:
+                            self.process_parser_process_messages(
+                                proc.submit(result, task), task)
+                        except (EOFError, IOError, OSError):
+                            self.spider.stat.inc('parser:process-died')
+                            ex = SpiderError('Parser process has died')
+                            self.spider.task_dispatcher.input_queue.put(
+                                (ex, task, {'exc_info': (SpiderError, ex,
+                                                         None),
+                                            'from': 'parser'})
+                            )
+                            self.send_task_done(task)
+                            return
+                        self.send_task_done(task)
+                        if self.spider.parser_requests_per_process:
+                            if (process_request_count >=
+                                    self.spider.parser_requests_per_process):
+                                self.spider.stat.inc(
+                                    'parser:handler-req-limit',
+                                )
+                                return
+                    finally:
+                        worker.is_busy_event.clear()
+        finally:
+            self.stop_parser_process(worker)
+
+    def process_parser_process_messages(self, messages, task):
+        handler_found = True
+        for msg in messages:
+            if msg[0] == 'item':
+                self.spider.task_dispatcher.input_queue.put(
+                    (msg[1], task, None),
+                )
+            elif msg[0] in ('error', 'no-handler'):
+                _, ex, traceback = msg
+                meta = {
+                    'exc_info': (ex.__class__, ex, None),
+                    'traceback': traceback,
+                }
+                if msg[0] == 'error':
+                    meta['from'] = 'parser'
+                else:
+                    handler_found = False
+                    self.spider.stat.inc('parser:handler-not-found')
+                self.spider.task_dispatcher.input_queue.put((ex, task, meta))
+            elif msg[0] == 'stat':
+                _, counters, collections = msg
+                for key, value in counters.items():
+                    self.spider.stat.inc(key, value)
+                for key, items in collections.items():
+                    for item in items:
+                        self.spider.stat.collect(key, item)
+        if handler_found:
+            self.spider.stat.inc('parser:handler-processed')
+
+    def send_task_done(self, task):
+        # Goes through the task dispatcher queue to be processed
+        # after all items generated by the task handler
+        self.spider.task_dispatcher.input_queue.put(
+            (None, task, {'task_done': True}),
+        )
+
     def execute_task_handler(self, handler, result, task):
         # pylint: disable=broad-except
         try:
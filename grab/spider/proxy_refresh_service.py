@@ -0,0 +1,48 @@
+import logging
+import time
+
+from grab.spider.base_service import BaseService
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.spider.proxy_refresh_service')
+# pylint: enable=invalid-name
+
+
+class ProxyRefreshService(BaseService):
+    """
+    Reloads proxy list of the spider from its source each `interval`
+    seconds.
+
+    The source is loaded in the thread of the service, network services
+    use the old list until the new one is loaded.
+    """
+
+    def __init__(self, spider, interval):
+        self.spider = spider
+        self.interval = interval
+        self.worker = self.create_worker(self.worker_callback)
+        self.register_workers(self.worker)
+
+    def worker_callback(self, worker):
+        refresh_time = time.time() + self.interval
+        while not worker.stop_event.is_set():
+            worker.process_pause_signal()
+            now = time.time()
+            if now < refresh_time:
+                worker.sleep(refresh_time - now)
+                continue
+            self.refresh()
+            refresh_time = time.time() + self.interval
+
+    def refresh(self):
+        try:
+            number = self.spider.proxylist.reload()
+        except Exception as ex: # pylint: disable=broad-except
+            logger.error('Could not reload proxy list', exc_info=ex)
+            self.spider.stat.inc('spider:proxylist-refresh-error')
+        else:
+            if number:
+                self.spider.stat.inc('spider:proxylist-refresh')
+            else:
+                logger.error('Proxy source returned empty list')
+                self.spider.stat.inc('spider:proxylist-refresh-error')
@@ -1,11 +1,25 @@
 """
 QueueInterface defines interface of queue backend.
 """
+from six.moves.queue import Empty
 
 
 class QueueInterface(object):
     def __init__(self, spider_name, **kwargs):
-        pass
+        self.put_hooks = []
+
+    def add_put_hook(self, callback):
+        """
+        Register function which is called each time new task is put
+        into the queue.
+
+        Used to wake up the consumers waiting for new tasks.
+        """
+        self.put_hooks.append(callback)
+
+    def process_put_hooks(self):
+        for callback in self.put_hooks:
+            callback()
 
     def put(self, task, priority, schedule_time=None):
         raise NotImplementedError
@@ -19,6 +33,59 @@ class QueueInterface(object):
         """
         raise NotImplementedError
 
+    def put_many(self, items):
+        """
+        Put multiple tasks into the queue.
+
+        :param items: list of (task, priority, schedule_time) tuples
+        """
+        for task, priority, schedule_time in items:
+            self.put(task, priority, schedule_time=schedule_time)
+
+    def get_many(self, number):
+        """
+        Return list of at most `number` tasks
+
+        Returns empty list if there are no tasks ready to be processed.
+        """
+        tasks = []
+        for _ in range(number):
+            try:
+                tasks.append(self.get())
+            except Empty:
+                break
+        return tasks
+
+    def complete_task(self, task):
+        """
+        Called when the processing of the task taken from
+        the queue is completed.
+
+        Backends which claim tasks for limited time delete
+        the claimed task here.
+        """
+        pass
+
+    def dump(self):
+        """
+        Return list of (task, priority, schedule_time) items
+        of all tasks in the queue without removing them.
+
+        Used to save spider checkpoint. Returns None if the backend
+        keeps tasks in persistent storage.
+        """
+        return None
+
+    def get_next_schedule_time(self):
+        """
+        Return the time (UTC datetime) when the earliest delayed task
+        becomes available.
+
+        Returns None if there are no delayed tasks or if the backend
+        does not support that query.
+        """
+        return None
+
     def size(self):
         raise NotImplementedError
 
@@ -0,0 +1,185 @@
+"""
+Spider task queue backend which keeps tasks in crawl coordinator server
+
+The queue could be shared by spiders running on multiple hosts. Tasks taken
+from the queue are leased to the spider until the spider completes them.
+The leases of unfinished tasks are renewed while the spider works.
+See `grab.spider.coordinator` module.
+"""
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from datetime import datetime
+import logging
+from threading import Lock
+import time
+
+from grab.spider.coordinator import (
+    CoordinatorClient, DEFAULT_HOST, DEFAULT_PORT,
+)
+from grab.spider.error import SpiderMisuseError
+from grab.spider.queue_backend.base import QueueInterface
+from grab.spider.scheduler import get_task_host
+from grab.spider.task_codec import encode_task, decode_task
+from grab.util.misc import datetime_to_timestamp
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.spider.queue_backend.coordinator')
+# pylint: enable=invalid-name
+
+# Number of seconds the task taken from the queue is
+# not available to other consumers
+DEFAULT_LEASE_TIMEOUT = 600
+# Completed tasks are acknowledged in batches
+COMPLETED_ITEMS_BATCH_SIZE = 100
+
+
+class QueueBackend(QueueInterface):
+    def __init__(self, spider_name, address=(DEFAULT_HOST, DEFAULT_PORT),
+                 authkey=None, queue_name=None,
+                 lease_timeout=DEFAULT_LEASE_TIMEOUT, **kwargs):
+        """
+        Args:
+            :param address: address of coordinator server, (host, port)
+                tuple or "host:port" string
+            :param authkey: secret key shared with coordinator server
+            :param queue_name: name of the queue in coordinator
+            :param lease_timeout: number of seconds the task taken
+                from the queue is not available to other spiders, the lease
+                is renewed while the task is not completed
+        """
+
+        super(QueueBackend, self).__init__(spider_name, **kwargs)
+        if queue_name is None:
+            queue_name = 'task_queue_%s' % spider_name
+        self.queue_name = queue_name
+        self.lease_timeout = lease_timeout
+        self.client = CoordinatorClient(address, authkey)
+        # id(task) -> lease ID
+        self.leases = {}
+        # Lease IDs of completed tasks
+        self.completed_items = []
+        self.completed_lock = Lock()
+        # Time when the leases of unfinished tasks should be renewed
+        self.lease_renew_time = None
+        self.lease_lock = Lock()
+        logger.debug('Using coordinator queue: %s (%s)',
+                     self.client.address, self.queue_name)
+
+    def put(self, task, priority, schedule_time=None):
+        self.put_many([(task, priority, schedule_time)])
+
+    def put_many(self, items):
+        if not items:
+            return
+        rows = []
+        for task, priority, schedule_time in items:
+            if schedule_time is not None:
+                schedule_time = datetime_to_timestamp(schedule_time)
+            # Tasks are never pickled because pickled data received
+            # from the network could run arbitrary code
+            try:
+                data = encode_task(task, allow_pickle=False)
+            except TypeError as ex:
+                raise SpiderMisuseError('Task could not be sent to the '
+                                        'coordinator: %s' % ex)
+            rows.append((data, priority, schedule_time,
+                         get_task_host(task)))
+        self.client.request('put', self.queue_name, rows)
+        self.process_put_hooks()
+
+    def get(self):
+        tasks = self.get_many(1)
+        if tasks:
+            return tasks[0]
+        else:
+            raise queue.Empty()
+
+    def take_completed_items(self):
+        with self.completed_lock:
+            lease_ids = self.completed_items
+            self.completed_items = []
+        return lease_ids
+
+    def take_renewed_leases(self):
+        """
+        Return lease IDs of unfinished tasks if it is time to renew them.
+
+        Leases are renewed when half of the lease timeout has passed.
+        """
+
+        now = time.time()
+        with self.lease_lock:
+            if self.lease_renew_time is None or now < self.lease_renew_time:
+                return []
+            lease_ids = list(self.leases.values())
+            if lease_ids:
+                self.lease_renew_time = now + self.lease_timeout / 2.0
+            else:
+                self.lease_renew_time = None
+        return lease_ids
+
+    def renew_leases(self):
+        lease_ids = self.take_renewed_leases()
+        if lease_ids:
+            self.client.request('renew', self.queue_name, lease_ids,
+                                self.lease_timeout)
+
+    def get_many(self, number):
+        # Completed tasks are acknowledged and leases are renewed
+        # with the same request
+        now = time.time()
+        items = self.client.request('get', self.queue_name, number,
+                                    self.lease_timeout,
+                                    self.take_completed_items(),
+                                    self.take_renewed_leases())
+        tasks = []
+        for lease_id, data in items:
+            task = decode_task(data, allow_pickle=False)
+            self.leases[id(task)] = lease_id
+            tasks.append(task)
+        with self.lease_lock:
+            if tasks and self.lease_renew_time is None:
+                self.lease_renew_time = now + self.lease_timeout / 2.0
+        return tasks
+
+    def complete_task(self, task):
+        lease_id = self.leases.pop(id(task), None)
+        if lease_id is not None:
+            with self.completed_lock:
+                self.completed_items.append(lease_id)
+                is_full = (len(self.completed_items)
+                           >= COMPLETED_ITEMS_BATCH_SIZE)
+            if is_full:
+                self.flush_completed_items()
+        self.renew_leases()
+
+    def flush_completed_items(self):
+        lease_ids = self.take_completed_items()
+        if lease_ids:
+            self.client.request('ack', self.queue_name, lease_ids)
+
+    def get_next_schedule_time(self):
+        timestamp = self.client.request('next_schedule_time',
+                                        self.queue_name)
+        if timestamp is None:
+            return None
+        else:
+            return datetime.utcfromtimestamp(timestamp)
+
+    def size(self):
+        self.flush_completed_items()
+        self.renew_leases()
+        return self.client.request('size', self.queue_name)
+
+    def clear(self):
+        self.take_completed_items()
+        self.leases = {}
+        with self.lease_lock:
+            self.lease_renew_time = None
+        self.client.request('clear', self.queue_name)
+
+    def close(self):
+        self.flush_completed_items()
+        self.client.close()
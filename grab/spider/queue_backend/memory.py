@@ -1,40 +1,93 @@
 from datetime import datetime
+import heapq
+from itertools import count
+from threading import Lock
 try:
     from Queue import PriorityQueue, Empty
 except ImportError:
     from queue import PriorityQueue, Empty
 
 from grab.spider.queue_backend.base import QueueInterface
+from grab.spider.task import Task
+from grab.spider.task_codec import pack_task, unpack_task
 
 
 class QueueBackend(QueueInterface):
     def __init__(self, spider_name, **kwargs):
         super(QueueBackend, self).__init__(spider_name, **kwargs)
+        # Tasks with grab config are stored in compact form, see
+        # `pack_task`, other tasks are stored as is
+        # Queue of (priority, number, task data) items
         self.queue_object = PriorityQueue()
+        # Heap of (schedule_time, number, task data) items
         self.schedule_list = []
+        self.counter = count()
+        self.schedule_lock = Lock()
 
     def put(self, task, priority, schedule_time=None):
-        if schedule_time is None:
-            self.queue_object.put((priority, task))
+        self.put_many([(task, priority, schedule_time)])
+
+    def put_many(self, items):
+        for task, priority, schedule_time in items:
+            data = pack_task(task) if task.peek_grab_config() else task
+            if schedule_time is None:
+                self.queue_object.put((priority, next(self.counter), data))
+            else:
+                with self.schedule_lock:
+                    heapq.heappush(self.schedule_list,
+                                   (schedule_time, next(self.counter), data))
+        if items:
+            self.process_put_hooks()
+
+    def process_schedule_list(self):
+        if self.schedule_list:
+            now = datetime.utcnow()
+            with self.schedule_lock:
+                while self.schedule_list and self.schedule_list[0][0] <= now:
+                    _, number, data = heapq.heappop(self.schedule_list)
+                    self.queue_object.put((1, number, data))
+
+    def load_task(self, data):
+        if isinstance(data, Task):
+            return data
         else:
-            self.schedule_list.append((schedule_time, task))
+            return unpack_task(data)
 
     def get(self):
-        now = datetime.utcnow()
+        self.process_schedule_list()
+        _, _, data = self.queue_object.get(block=False)
+        return self.load_task(data)
 
-        removed_indexes = []
-        index = 0
-        for schedule_time, task in self.schedule_list:
-            if schedule_time <= now:
-                self.put(task, 1)
-                removed_indexes.append(index)
-            index += 1
+    def get_many(self, number):
+        self.process_schedule_list()
+        tasks = []
+        try:
+            for _ in range(number):
+                _, _, data = self.queue_object.get(block=False)
+                tasks.append(self.load_task(data))
+        except Empty:
+            pass
+        return tasks
 
-        self.schedule_list = [x for idx, x in enumerate(self.schedule_list)
-                              if idx not in removed_indexes]
+    def dump(self):
+        with self.queue_object.mutex:
+            ready = list(self.queue_object.queue)
+        with self.schedule_lock:
+            delayed = list(self.schedule_list)
+        items = []
+        for priority, _, data in sorted(ready):
+            items.append((self.load_task(data), priority, None))
+        for schedule_time, _, data in sorted(delayed):
+            task = self.load_task(data)
+            items.append((task, task.priority, schedule_time))
+        return items
 
-        _, task = self.queue_object.get(block=False)
-        return task
+    def get_next_schedule_time(self):
+        with self.schedule_lock:
+            if self.schedule_list:
+                return self.schedule_list[0][0]
+            else:
+                return None
 
     def size(self):
         return self.queue_object.qsize() + len(self.schedule_list)
@@ -45,7 +98,8 @@ class QueueBackend(QueueInterface):
                 self.queue_object.get(False)
         except Empty:
             pass
-        self.schedule_list = []
+        with self.schedule_lock:
+            self.schedule_list = []
 
     def close(self):
         pass
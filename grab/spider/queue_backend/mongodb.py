@@ -2,27 +2,39 @@ try:
     import Queue as queue
 except ImportError:
     import queue
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+from threading import Lock
 
-from bson import Binary
+from bson import Binary, ObjectId
 import pymongo
 
 from grab.spider.queue_backend.base import QueueInterface
+from grab.spider.task_codec import encode_task, decode_task
 
 # pylint: disable=invalid-name
 logger = logging.getLogger('grab.spider.queue_backend.mongodb')
 # pylint: enable=invalid-name
 
+# Number of seconds the task taken from the queue is
+# not available to other consumers
+DEFAULT_LEASE_TIMEOUT = 600
+# Completed items are deleted from the queue in batches
+COMPLETED_ITEMS_BATCH_SIZE = 100
+
 
 class QueueBackend(QueueInterface):
     def __init__(self, spider_name, database=None, queue_name=None,
-                 **kwargs):
+                 lease_timeout=DEFAULT_LEASE_TIMEOUT, **kwargs):
         """
+        Tasks taken from the queue are not deleted at once. They are
+        claimed for `lease_timeout` seconds and are deleted when spider
+        completes their processing. The lease of unfinished tasks is
+        renewed while the spider works: tasks could wait in the buffer
+        of the task scheduler longer than the lease timeout. If spider
+        crashes then claimed tasks become available again when the lease
+        expires.
+
         All "unexpected" kwargs goes to `pymongo.MongoClient()` method
         """
         if queue_name is None:
@@ -30,40 +42,164 @@ class QueueBackend(QueueInterface):
 
         self.database = database
         self.queue_name = queue_name
+        self.lease_timeout = lease_timeout
         self.connection = pymongo.MongoClient(**kwargs)
         self.collection = self.connection[self.database][self.queue_name]
         logger.debug('Using collection: %s', self.collection)
 
-        self.collection.ensure_index('priority')
+        # Ready tasks are selected with range filter on schedule_time
+        # and sorted by priority. The sorted field goes first in the index
+        # to walk the index in the order of priority instead of sorting
+        # all ready tasks on each query.
+        self.collection.create_index([
+            ('priority', pymongo.ASCENDING),
+            ('schedule_time', pymongo.ASCENDING),
+        ])
+        self.collection.create_index('schedule_time')
+        self.collection.create_index('claim_id', sparse=True)
+        # id(task) -> ID of claimed item
+        self.claimed_items = {}
+        # Time when the lease of claimed items should be renewed
+        self.lease_renew_time = None
+        self.lease_lock = Lock()
+        # IDs of items which processing is completed
+        self.completed_items = []
+        self.completed_lock = Lock()
 
         super(QueueBackend, self).__init__(spider_name, **kwargs)
 
     def size(self):
+        self.flush_completed_items()
+        self.renew_leases()
         return self.collection.count()
 
-    def put(self, task, priority, schedule_time=None):
+    def build_item(self, task, priority, schedule_time):
         if schedule_time is None:
             schedule_time = datetime.utcnow()
-
-        item = {
-            'task': Binary(pickle.dumps(task)),
+        return {
+            'task': Binary(encode_task(task)),
             'priority': priority,
             'schedule_time': schedule_time,
         }
-        self.collection.save(item)
+
+    def put(self, task, priority, schedule_time=None):
+        self.collection.insert_one(
+            self.build_item(task, priority, schedule_time)
+        )
+        self.process_put_hooks()
+
+    def put_many(self, items):
+        if items:
+            self.collection.insert_many(
+                [self.build_item(*x) for x in items], ordered=False,
+            )
+            self.process_put_hooks()
 
     def get(self):
-        item = self.collection.find_one_and_delete(
-            {'schedule_time': {'$lt': datetime.utcnow()}},
-            sort=[('priority', pymongo.ASCENDING)]
+        tasks = self.get_many(1)
+        if tasks:
+            return tasks[0]
+        else:
+            raise queue.Empty()
+
+    def get_many(self, number):
+        self.flush_completed_items()
+        self.renew_leases()
+        now = datetime.utcnow()
+        ids = [x['_id'] for x in self.collection.find(
+            {'schedule_time': {'$lte': now}},
+            projection=['_id'],
+            sort=[('priority', pymongo.ASCENDING)],
+            limit=number,
+        )]
+        if not ids:
+            return []
+        # Claimed item is moved into the future till the lease expiration
+        # time so it is not available to other consumers. The filter on
+        # schedule_time skips items claimed by other consumer between
+        # the queries.
+        claim_id = ObjectId()
+        self.collection.update_many(
+            {'_id': {'$in': ids}, 'schedule_time': {'$lte': now}},
+            {'$set': {
+                'claim_id': claim_id,
+                'schedule_time': now + timedelta(seconds=self.lease_timeout),
+            }},
+        )
+        tasks = []
+        for item in self.collection.find(
+                {'claim_id': claim_id},
+                sort=[('priority', pymongo.ASCENDING)]):
+            task = decode_task(bytes(item['task']))
+            self.claimed_items[id(task)] = item['_id']
+            tasks.append(task)
+        with self.lease_lock:
+            if tasks and self.lease_renew_time is None:
+                self.lease_renew_time = now + timedelta(
+                    seconds=self.lease_timeout / 2.0)
+        return tasks
+
+    def renew_leases(self):
+        """
+        Prolong the lease of claimed items which are not completed yet.
+
+        Leases are renewed when half of the lease timeout has passed.
+        """
+
+        now = datetime.utcnow()
+        with self.lease_lock:
+            if self.lease_renew_time is None or now < self.lease_renew_time:
+                return
+            ids = list(self.claimed_items.values())
+            if ids:
+                self.lease_renew_time = now + timedelta(
+                    seconds=self.lease_timeout / 2.0)
+            else:
+                self.lease_renew_time = None
+        if ids:
+            self.collection.update_many(
+                {'_id': {'$in': ids}},
+                {'$set': {
+                    'schedule_time': (
+                        now + timedelta(seconds=self.lease_timeout)),
+                }},
+            )
+
+    def complete_task(self, task):
+        item_id = self.claimed_items.pop(id(task), None)
+        if item_id is not None:
+            with self.completed_lock:
+                self.completed_items.append(item_id)
+                is_full = (len(self.completed_items)
+                           >= COMPLETED_ITEMS_BATCH_SIZE)
+            if is_full:
+                self.flush_completed_items()
+        self.renew_leases()
+
+    def flush_completed_items(self):
+        with self.completed_lock:
+            ids = self.completed_items
+            self.completed_items = []
+        if ids:
+            self.collection.delete_many({'_id': {'$in': ids}})
+
+    def get_next_schedule_time(self):
+        item = self.collection.find_one(
+            sort=[('schedule_time', pymongo.ASCENDING)]
         )
         if item is None:
-            raise queue.Empty()
+            return None
         else:
-            return pickle.loads(item['task'])
+            return item['schedule_time']
 
     def clear(self):
+        with self.completed_lock:
+            self.completed_items = []
+        self.claimed_items = {}
+        with self.lease_lock:
+            self.lease_renew_time = None
         self.collection.remove()
 
     def close(self):
+        self.flush_completed_items()
         self.connection.close()
@@ -1,54 +1,124 @@
 """
 Spider task queue backend powered by redis
+
+Ready tasks are stored in the sorted set scored by priority, delayed tasks
+are stored in the other sorted set scored by the time when the task becomes
+available. Delayed tasks are moved to the set of ready tasks by server-side
+script which also pops ready tasks.
 """
+from __future__ import absolute_import
 try:
     import Queue as queue
 except ImportError:
     import queue
-import random
+from datetime import datetime
 import logging
+from uuid import uuid4
 
-from qr import PriorityQueue
+import redis
 
 from grab.spider.queue_backend.base import QueueInterface
-from grab.spider.error import SpiderMisuseError
+from grab.spider.task_codec import encode_task, decode_task
+from grab.util.misc import datetime_to_timestamp
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.spider.queue_backend.redis')
+# pylint: enable=invalid-name
+
+# Max. number of delayed tasks moved to ready tasks in one call
+PROMOTE_LIMIT = 1000
+# KEYS: ready set, delayed set; ARGV: current timestamp, number of tasks
+# Member format: "<priority>:<unique id>:<encoded task>"
+POP_SCRIPT = """
+local delayed = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1],
+                           'LIMIT', 0, %d)
+for _, member in ipairs(delayed) do
+    local priority = tonumber(string.match(member, '^([^:]*):'))
+    redis.call('ZADD', KEYS[1], priority, member)
+    redis.call('ZREM', KEYS[2], member)
+end
+local number = tonumber(ARGV[2])
+local items = redis.call('ZRANGE', KEYS[1], 0, number - 1)
+if #items > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, number - 1)
+end
+return items
+""" % PROMOTE_LIMIT
 
 
 class QueueBackend(QueueInterface):
     def __init__(self, spider_name, queue_name=None, **kwargs):
+        """
+        All "unexpected" kwargs goes to `redis.StrictRedis()` method
+        """
         super(QueueBackend, self).__init__(spider_name, **kwargs)
         self.spider_name = spider_name
         if queue_name is None:
             queue_name = 'task_queue_%s' % spider_name
         self.queue_name = queue_name
-        self.queue_object = PriorityQueue(queue_name, **kwargs)
-        logging.debug('Redis queue key: %s', self.queue_name)
+        self.ready_key = '%s:ready' % queue_name
+        self.delayed_key = '%s:delayed' % queue_name
+        self.connection = redis.StrictRedis(**kwargs)
+        self.pop_script = self.connection.register_script(POP_SCRIPT)
+        logger.debug('Redis queue key: %s', self.queue_name)
+
+    def build_member(self, task, priority):
+        # Unique ID allows to store equal tasks in the sorted set
+        return (('%s:%s:' % (priority, uuid4().hex)).encode('ascii')
+                + encode_task(task))
 
     def put(self, task, priority, schedule_time=None):
-        if schedule_time is not None:
-            raise SpiderMisuseError('Redis task queue does not support '
-                                    'delayed task')
-        # Add attribute with random value
-        # This is required because qr library
-        # does not allow to store multiple values with same hash
-        # in the PriorityQueue
+        self.put_many([(task, priority, schedule_time)])
 
-        task.redis_qr_rnd = random.random()
-        self.queue_object.push(task, priority)
+    def put_many(self, items):
+        if not items:
+            return
+        ready = {}
+        delayed = {}
+        for task, priority, schedule_time in items:
+            member = self.build_member(task, priority)
+            if schedule_time is None:
+                ready[member] = priority
+            else:
+                delayed[member] = datetime_to_timestamp(schedule_time)
+        pipe = self.connection.pipeline(transaction=False)
+        if ready:
+            pipe.zadd(self.ready_key, ready)
+        if delayed:
+            pipe.zadd(self.delayed_key, delayed)
+        pipe.execute()
+        self.process_put_hooks()
 
     def get(self):
-        task = self.queue_object.pop()
-        if task is None:
+        tasks = self.get_many(1)
+        if tasks:
+            return tasks[0]
+        else:
             raise queue.Empty()
+
+    def get_many(self, number):
+        members = self.pop_script(
+            keys=[self.ready_key, self.delayed_key],
+            args=[datetime_to_timestamp(datetime.utcnow()), number],
+        )
+        return [decode_task(x.split(b':', 2)[2]) for x in members]
+
+    def get_next_schedule_time(self):
+        items = self.connection.zrange(self.delayed_key, 0, 0,
+                                       withscores=True)
+        if items:
+            return datetime.utcfromtimestamp(items[0][1])
         else:
-            return task
+            return None
 
     def size(self):
-        return len(self.queue_object)
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.zcard(self.ready_key)
+        pipe.zcard(self.delayed_key)
+        return sum(pipe.execute())
 
     def clear(self):
-        self.queue_object.clear()
+        self.connection.delete(self.ready_key, self.delayed_key)
 
     def close(self):
-        # get conneciton opened by qr and close it
-        pass
+        self.connection.connection_pool.disconnect()
@@ -0,0 +1,239 @@
+"""
+Spider task queue backend powered by sqlite
+
+Tasks are stored in local database file so the queue survives the crash
+of the spider process and does not need much memory. Only one spider
+process could use the database file at the same time.
+"""
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from collections import deque
+from datetime import datetime
+import logging
+import sqlite3
+from threading import Lock
+
+from grab.spider.queue_backend.base import QueueInterface
+from grab.spider.task_codec import encode_task, decode_task
+from grab.util.misc import datetime_to_timestamp
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.spider.queue_backend.sqlite')
+# pylint: enable=invalid-name
+
+# Number of new tasks which are inserted into database in one transaction
+DEFAULT_BATCH_SIZE = 1000
+# Number of tasks which are read from database in one query
+DEFAULT_READ_AHEAD = 1000
+# Priority of delayed tasks, memory queue gives the same priority to
+# delayed tasks when they become available
+DELAYED_TASK_PRIORITY = 1
+
+
+class QueueBackend(QueueInterface):
+    def __init__(self, spider_name, path=None, queue_name=None,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 read_ahead=DEFAULT_READ_AHEAD, **kwargs):
+        """
+        Args:
+            :param path: path to database file, by default the file
+                is created in current directory
+            :param queue_name: name of the database table
+            :param batch_size: max. number of new tasks kept in memory
+                before they are written to the database
+            :param read_ahead: number of tasks which are read from
+                the database in one query
+        """
+
+        super(QueueBackend, self).__init__(spider_name, **kwargs)
+        if queue_name is None:
+            queue_name = 'task_queue_%s' % spider_name
+        if path is None:
+            path = '%s.sqlite' % queue_name
+        self.path = path
+        self.queue_name = queue_name
+        self.batch_size = batch_size
+        self.read_ahead = read_ahead
+        self.lock = Lock()
+        # (priority, schedule_time, task data) items waiting to be inserted
+        self.write_buffer = []
+        # (id, task data) items read from database ordered by priority
+        self.read_buffer = deque()
+        self.read_buffer_priority = None
+        self.read_buffer_expire_time = None
+        # IDs of rows which tasks have been taken from the queue
+        self.delete_buffer = []
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        # Ready tasks are selected in the order of priority, the index
+        # starts with priority to not sort all tasks on each query
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS "%s" ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'priority INTEGER NOT NULL, '
+                'schedule_time REAL NOT NULL, '
+                'task BLOB NOT NULL)' % self.queue_name
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS "%s_priority_schedule_time" '
+                'ON "%s" (priority, schedule_time)'
+                % (self.queue_name, self.queue_name)
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS "%s_schedule_time" '
+                'ON "%s" (schedule_time)' % (self.queue_name, self.queue_name)
+            )
+        self.queue_size = self.connection.execute(
+            'SELECT COUNT(*) FROM "%s"' % self.queue_name
+        ).fetchone()[0]
+        logger.debug('Using sqlite queue: %s (%s)', self.path, self.queue_name)
+
+    def flush(self):
+        """
+        Write buffered new tasks and removals into the database.
+
+        Must be called with acquired lock.
+        """
+
+        if self.write_buffer or self.delete_buffer:
+            with self.connection:
+                if self.write_buffer:
+                    self.connection.executemany(
+                        'INSERT INTO "%s" (priority, schedule_time, task) '
+                        'VALUES (?, ?, ?)' % self.queue_name,
+                        self.write_buffer,
+                    )
+                if self.delete_buffer:
+                    self.connection.executemany(
+                        'DELETE FROM "%s" WHERE id = ?' % self.queue_name,
+                        [(x,) for x in self.delete_buffer],
+                    )
+            self.write_buffer = []
+            self.delete_buffer = []
+
+    def put(self, task, priority, schedule_time=None):
+        self.put_many([(task, priority, schedule_time)])
+
+    def put_many(self, items):
+        rows = []
+        for task, priority, schedule_time in items:
+            if schedule_time is None:
+                # Tasks without delay are available at once
+                timestamp = 0
+            else:
+                timestamp = datetime_to_timestamp(schedule_time)
+                # Delayed task which has become available goes before
+                # other tasks like in the memory queue
+                priority = DELAYED_TASK_PRIORITY
+            rows.append((priority, timestamp,
+                         sqlite3.Binary(encode_task(task))))
+        if not rows:
+            return
+        with self.lock:
+            self.write_buffer.extend(rows)
+            self.queue_size += len(rows)
+            if self.read_buffer_priority is not None:
+                ready = [x[0] for x in rows if not x[1]]
+                if ready and min(ready) < self.read_buffer_priority:
+                    # New task must go before tasks of the read buffer
+                    self.reset_read_buffer()
+                delayed = [x[1] for x in rows if x[1]]
+                if delayed:
+                    # Read buffer must be refilled when new delayed
+                    # task becomes available
+                    expire_time = min(delayed)
+                    if (self.read_buffer_expire_time is None
+                            or expire_time < self.read_buffer_expire_time):
+                        self.read_buffer_expire_time = expire_time
+            if len(self.write_buffer) >= self.batch_size:
+                self.flush()
+        self.process_put_hooks()
+
+    def reset_read_buffer(self):
+        self.read_buffer.clear()
+        self.read_buffer_priority = None
+        self.read_buffer_expire_time = None
+
+    def fill_read_buffer(self):
+        self.flush()
+        now = datetime_to_timestamp(datetime.utcnow())
+        rows = self.connection.execute(
+            'SELECT id, priority, task FROM "%s" WHERE schedule_time <= ? '
+            'ORDER BY priority, id LIMIT ?' % self.queue_name,
+            (now, self.read_ahead),
+        ).fetchall()
+        for row_id, _, data in rows:
+            self.read_buffer.append((row_id, data))
+        if rows:
+            self.read_buffer_priority = rows[-1][1]
+            # Delayed tasks which become available must not wait
+            # until the whole read buffer is processed
+            self.read_buffer_expire_time = self.connection.execute(
+                'SELECT MIN(schedule_time) FROM "%s" WHERE schedule_time > ?'
+                % self.queue_name, (now,),
+            ).fetchone()[0]
+
+    def get(self):
+        tasks = self.get_many(1)
+        if tasks:
+            return tasks[0]
+        else:
+            raise queue.Empty()
+
+    def get_many(self, number):
+        items = []
+        with self.lock:
+            if (self.read_buffer_expire_time is not None
+                    and (datetime_to_timestamp(datetime.utcnow())
+                         >= self.read_buffer_expire_time)):
+                self.reset_read_buffer()
+            while len(items) < number:
+                if not self.read_buffer:
+                    self.reset_read_buffer()
+                    self.fill_read_buffer()
+                    if not self.read_buffer:
+                        break
+                row_id, data = self.read_buffer.popleft()
+                items.append(data)
+                # The row is deleted with the next batch so the task
+                # could be processed again if the spider crashes
+                self.delete_buffer.append(row_id)
+                self.queue_size -= 1
+            if not self.read_buffer:
+                self.reset_read_buffer()
+            if len(self.delete_buffer) >= self.batch_size:
+                self.flush()
+        return [decode_task(bytes(x)) for x in items]
+
+    def get_next_schedule_time(self):
+        with self.lock:
+            self.flush()
+            timestamp = self.connection.execute(
+                'SELECT MIN(schedule_time) FROM "%s" WHERE schedule_time > 0'
+                % self.queue_name
+            ).fetchone()[0]
+        if timestamp is None:
+            return None
+        else:
+            return datetime.utcfromtimestamp(timestamp)
+
+    def size(self):
+        return self.queue_size
+
+    def clear(self):
+        with self.lock:
+            self.write_buffer = []
+            self.delete_buffer = []
+            self.reset_read_buffer()
+            with self.connection:
+                self.connection.execute('DELETE FROM "%s"' % self.queue_name)
+            self.queue_size = 0
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.connection.close()
@@ -0,0 +1,256 @@
+"""
+Host scheduler controls the order in which tasks are taken from
+the task queue to be processed by network service.
+
+Tasks are taken from the task queue backend into per-host sub-queues.
+The scheduler hands out the highest-priority task among the hosts which
+have not reached the limit of concurrent connections and which have not
+been requested recently. Head items of such hosts are kept in a heap,
+hosts which reached their limits wait for the release of the connection
+or for the end of the request delay.
+"""
+import heapq
+from itertools import count
+from threading import Lock
+import time
+
+from six.moves.queue import Empty
+from six.moves.urllib.parse import urlsplit
+
+# Number of tasks the scheduler takes from the task queue at once
+DEFAULT_BUFFER_SIZE = 1000
+# Max. number of tasks taken from the task queue when the tasks
+# in the buffer belong to hosts which have reached their limits
+DEFAULT_MAX_BUFFER_SIZE = 10000
+
+
+def get_task_host(task):
+    try:
+        return urlsplit(task.url).hostname or ''
+    except ValueError:
+        return ''
+
+
+class HostScheduler(object):
+    def __init__(self, task_queue, max_connections_per_host=None,
+                 host_request_delay=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                 concurrency_controller=None,
+                 max_buffer_size=DEFAULT_MAX_BUFFER_SIZE):
+        """
+        Args:
+            :param task_queue: task queue backend
+            :param max_connections_per_host: max. number of tasks of one
+                host which are processed by network service at the same time
+            :param host_request_delay: min. number of seconds between
+                two requests to the same host
+            :param buffer_size: number of tasks taken from the task queue
+            :param concurrency_controller: if it is set then it provides
+                the limit of concurrent connections of each host
+            :param max_buffer_size: max. number of tasks taken from the task
+                queue if no task in the buffer could be processed right now
+        """
+
+        self.task_queue = task_queue
+        self.max_connections_per_host = max_connections_per_host
+        self.host_request_delay = host_request_delay
+        self.buffer_size = buffer_size
+        self.max_buffer_size = max(buffer_size, max_buffer_size)
+        self.concurrency_controller = concurrency_controller
+        self.counter = count()
+        self.host_connections = {}
+        self.host_request_time = {}
+        # id(task) -> host, tasks which were handed out
+        # to network service and not released yet
+        self.active_tasks = {}
+        self.lock = Lock()
+        self.clear_buffer()
+
+    def clear_buffer(self):
+        # host -> heap of (priority, number, task) items
+        self.host_queues = {}
+        # Heap of (priority, number, host) items, head items of hosts
+        # which could be available. Item is outdated if the host
+        # has other head item or if the host is waiting.
+        self.ready_hosts = []
+        # host -> time when the host becomes available or None if
+        # the host waits for the release of its connection
+        self.waiting_hosts = {}
+        # Heap of (time, host) items of waiting hosts
+        self.delayed_hosts = []
+        self.buffered_number = 0
+
+    def fill_buffer(self, limit):
+        """
+        Take tasks from the task queue until the buffer
+        contains `limit` tasks.
+
+        Returns the number of taken tasks.
+        """
+
+        number = min(self.buffer_size, limit - self.buffered_number)
+        if number <= 0:
+            return 0
+        tasks = self.task_queue.get_many(number)
+        for task in tasks:
+            self.push_task(task)
+        return len(tasks)
+
+    def push_task(self, task):
+        host = get_task_host(task)
+        item = (task.priority, next(self.counter), task)
+        host_queue = self.host_queues.get(host)
+        if host_queue is None:
+            host_queue = self.host_queues[host] = []
+        heapq.heappush(host_queue, item)
+        self.buffered_number += 1
+        if host_queue[0] is item and host not in self.waiting_hosts:
+            heapq.heappush(self.ready_hosts, (item[0], item[1], host))
+
+    def get_host_limit(self, host):
+        if self.concurrency_controller and self.max_connections_per_host:
+            return self.concurrency_controller.get_host_limit(host)
+        else:
+            return self.max_connections_per_host
+
+    def is_host_connection_available(self, host):
+        limit = self.get_host_limit(host)
+        return not limit or self.host_connections.get(host, 0) < limit
+
+    def is_host_available(self, host, now):
+        if not self.is_host_connection_available(host):
+            return False
+        if (self.host_request_delay
+                and host in self.host_request_time
+                and (now < self.host_request_time[host]
+                     + self.host_request_delay)):
+            return False
+        return True
+
+    def schedule_host(self, host, now):
+        """
+        Make the head item of the host available to `take_task` or
+        move the host into waiting state until it becomes available.
+        """
+
+        self.waiting_hosts.pop(host, None)
+        host_queue = self.host_queues.get(host)
+        if not host_queue:
+            return
+        if not self.is_host_connection_available(host):
+            self.waiting_hosts[host] = None
+            return
+        if self.host_request_delay and host in self.host_request_time:
+            available_time = (self.host_request_time[host]
+                              + self.host_request_delay)
+            if now < available_time:
+                self.waiting_hosts[host] = available_time
+                heapq.heappush(self.delayed_hosts, (available_time, host))
+                return
+        item = host_queue[0]
+        heapq.heappush(self.ready_hosts, (item[0], item[1], host))
+
+    def process_delayed_hosts(self, now):
+        while self.delayed_hosts and self.delayed_hosts[0][0] <= now:
+            available_time, host = heapq.heappop(self.delayed_hosts)
+            # Skip outdated item
+            if self.waiting_hosts.get(host) == available_time:
+                self.schedule_host(host, now)
+
+    def get(self):
+        """
+        Return the highest-priority task of available hosts.
+
+        :raises: `Queue.Empty` if there is no task which could be
+            processed right now
+        """
+
+        tasks = self.get_many(1)
+        if tasks:
+            return tasks[0]
+        else:
+            raise Empty
+
+    def get_many(self, number):
+        """
+        Return list of at most `number` tasks of available hosts.
+        """
+
+        tasks = []
+        with self.lock:
+            self.fill_buffer(self.buffer_size)
+            now = time.time()
+            while len(tasks) < number:
+                task = self.take_task(now)
+                if task is None:
+                    # Tasks of available hosts could be behind the tasks
+                    # of busy hosts in the task queue
+                    if not self.fill_buffer(self.max_buffer_size):
+                        break
+                else:
+                    tasks.append(task)
+        return tasks
+
+    def take_task(self, now):
+        self.process_delayed_hosts(now)
+        while self.ready_hosts:
+            _, number, host = heapq.heappop(self.ready_hosts)
+            host_queue = self.host_queues.get(host)
+            if (host in self.waiting_hosts or not host_queue
+                    or host_queue[0][1] != number):
+                # Outdated item
+                continue
+            if not self.is_host_available(host, now):
+                self.schedule_host(host, now)
+                continue
+            task = heapq.heappop(host_queue)[2]
+            self.buffered_number -= 1
+            self.host_connections[host] = (
+                self.host_connections.get(host, 0) + 1)
+            if self.host_request_delay:
+                if len(self.host_request_time) > self.buffer_size:
+                    self.prune_request_time(now)
+                self.host_request_time[host] = now
+            self.active_tasks[id(task)] = host
+            if host_queue:
+                self.schedule_host(host, now)
+            else:
+                del self.host_queues[host]
+            return task
+        return None
+
+    def prune_request_time(self, now):
+        for host, request_time in list(self.host_request_time.items()):
+            if now - request_time >= self.host_request_delay:
+                del self.host_request_time[host]
+
+    def release(self, task):
+        """
+        Release the connection slot of the task's host.
+
+        Called when network service completes the processing of the task.
+        It is safe to call it multiple times for the same task.
+        """
+
+        with self.lock:
+            host = self.active_tasks.pop(id(task), None)
+            if host is not None:
+                self.host_connections[host] -= 1
+                if not self.host_connections[host]:
+                    del self.host_connections[host]
+                if (host in self.waiting_hosts
+                        and self.waiting_hosts[host] is None):
+                    self.schedule_host(host, time.time())
+
+    def dump(self):
+        """Return list of tasks taken from the task queue"""
+        with self.lock:
+            return [item[2] for host_queue in self.host_queues.values()
+                    for item in host_queue]
+
+    def size(self):
+        """Return number of tasks taken from the task queue"""
+        return self.buffered_number
+
+    def clear(self):
+        with self.lock:
+            self.clear_buffer()
@@ -0,0 +1,280 @@
+"""
+Multi-process spider with host-sharded task queues.
+
+Supervisor process forks worker processes, each worker runs its own copy of
+the spider and processes only the tasks of hosts which belong to its shard.
+Tasks of other shards are sent to the supervisor which forwards them to
+the worker of that shard.
+
+Worker reports to supervisor when it has nothing to do. The work is done
+when all workers are idle and each worker has received all the tasks
+forwarded to it. Then supervisor asks workers to stop, each worker sends
+back its stat counters and collections.
+"""
+import logging
+import os
+from threading import Thread, Lock
+import time
+from zlib import crc32
+
+from six.moves.queue import Queue, Empty
+from weblib.encoding import make_str
+
+from grab.spider.parser_process import get_process_context
+from grab.spider.scheduler import get_task_host
+from grab.spider.task_codec import encode_task, decode_task
+
+# pylint: disable=invalid-name
+logger = logging.getLogger('grab.spider.shard')
+# pylint: enable=invalid-name
+
+# Time to wait for the results of workers after they are asked to stop
+STOP_TIMEOUT = 30
+# Max. time to wait for message from workers, KeyboardInterrupt
+# does not interrupt infinite wait in py2
+WAIT_TIMEOUT = 1
+
+
+def get_host_shard(host, shard_count):
+    # Built-in hash of string is randomized for each process
+    return (crc32(make_str(host)) & 0xffffffff) % shard_count
+
+
+def get_task_shard(task, shard_count):
+    return get_host_shard(get_task_host(task), shard_count)
+
+
+def get_shard_checkpoint_path(path, shard):
+    """
+    Return the path of the checkpoint file of the given shard.
+    """
+
+    root, ext = os.path.splitext(path)
+    return '%s_shard%d%s' % (root, shard, ext)
+
+
+class ShardRouter(object):
+    """
+    Worker side of the connection with supervisor.
+    """
+
+    def __init__(self, spider, shard_number, shard_count, conn):
+        self.spider = spider
+        self.shard_number = shard_number
+        self.shard_count = shard_count
+        self.conn = conn
+        self.send_lock = Lock()
+        # Number of tasks received from supervisor
+        self.received_number = 0
+        self.reported_number = None
+        self.thread = Thread(target=self.receiver_callback)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def send(self, msg):
+        with self.send_lock:
+            self.conn.send(msg)
+
+    def is_local_task(self, task):
+        return get_task_shard(task, self.shard_count) == self.shard_number
+
+    def route_task(self, task):
+        """
+        Send task to the worker of the task's shard.
+        """
+
+        shard = get_task_shard(task, self.shard_count)
+        self.spider.stat.inc('spider:task-routed')
+        self.send(('task', shard, encode_task(task)))
+
+    def check_idle(self):
+        """
+        Report to supervisor if the spider has nothing to do.
+
+        Called periodically by the main loop of the spider.
+        """
+
+        # The number is taken before the spider is checked so the
+        # reported number never includes task which is not processed
+        received_number = self.received_number
+        if (self.reported_number != received_number
+                and self.spider.is_idle()):
+            self.reported_number = received_number
+            self.send(('idle', received_number))
+
+    def receiver_callback(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, IOError, OSError):
+                # Supervisor has died
+                self.spider.stop()
+                break
+            if msg[0] == 'task':
+                self.spider.add_task(decode_task(msg[1]))
+                self.received_number += 1
+                # Spider main loop checks if it is idle
+                self.spider.wakeup_main_loop()
+            elif msg[0] == 'stop':
+                self.spider.stop()
+                break
+
+    def close(self):
+        """
+        Send stat of the spider to supervisor.
+        """
+
+        self.send(('result', dict(self.spider.stat.counters),
+                   dict(self.spider.stat.collections)))
+
+
+class ShardSupervisor(object):
+    def __init__(self, spider, worker_number, setup_worker=None):
+        """
+        Args:
+            :param spider: spider instance which is copied into
+                the worker processes, its stat receives the aggregated
+                stat of all workers
+            :param worker_number: number of worker processes
+            :param setup_worker: function which is called in each worker
+                process with spider and shard number arguments before
+                the spider is started, it should open database connections
+                of the worker (task queue, cache, etc)
+        """
+
+        self.spider = spider
+        self.worker_number = worker_number
+        self.setup_worker = setup_worker
+        self.processes = []
+        self.connections = []
+        # (shard, message) items received from workers
+        self.input_queue = Queue()
+
+    def start(self):
+        context = get_process_context()
+        for shard in range(self.worker_number):
+            conn, child_conn = context.Pipe()
+            proc = context.Process(target=self.worker_callback,
+                                   args=(shard, child_conn))
+            proc.daemon = True
+            proc.start()
+            child_conn.close()
+            self.processes.append(proc)
+            self.connections.append(conn)
+        for shard, conn in enumerate(self.connections):
+            thread = Thread(target=self.reader_callback, args=(shard, conn))
+            thread.daemon = True
+            thread.start()
+
+    def worker_callback(self, shard, conn):
+        for other_conn in self.connections:
+            other_conn.close()
+        spider = self.spider
+        if spider.checkpoint_path:
+            # Each worker saves the state of its own shard
+            spider.checkpoint_path = get_shard_checkpoint_path(
+                spider.checkpoint_path, shard)
+        if self.setup_worker:
+            self.setup_worker(spider, shard)
+        if spider.task_queue is None:
+            spider.setup_queue()
+        router = ShardRouter(spider, shard, self.worker_number, conn)
+        spider.shard_router = router
+        if shard:
+            # Only first worker generates initial tasks
+            spider.task_generator_service.real_generator = iter(())
+        router.start()
+        try:
+            spider.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            router.close()
+
+    def reader_callback(self, shard, conn):
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, IOError, OSError):
+                self.input_queue.put((shard, ('exit',)))
+                break
+            self.input_queue.put((shard, msg))
+
+    def send(self, shard, msg):
+        try:
+            self.connections[shard].send(msg)
+        except (IOError, OSError):
+            logger.error('Could not send message to worker %d', shard)
+
+    def stop_workers(self):
+        for shard in range(self.worker_number):
+            self.send(shard, ('stop',))
+
+    def merge_stat(self, counters, collections):
+        stat = self.spider.stat
+        for key, value in counters.items():
+            stat.counters[key] += value
+        for key, items in collections.items():
+            stat.collections[key].extend(items)
+
+    def run(self):
+        """
+        Start workers and wait until they complete the work.
+        """
+
+        # pylint: disable=protected-access
+        self.spider._started = time.time()
+        self.start()
+        try:
+            self.process_messages()
+        except KeyboardInterrupt:
+            self.stop_workers()
+            self.process_messages(only_results=True)
+            raise
+        finally:
+            for proc in self.processes:
+                proc.join(1)
+                if proc.is_alive():
+                    proc.terminate()
+            for conn in self.connections:
+                conn.close()
+
+    def process_messages(self, only_results=False):
+        # Number of tasks forwarded to each worker
+        forwarded = [0] * self.worker_number
+        # Number of received tasks which were reported by idle worker
+        idle = [None] * self.worker_number
+        finished = set()
+        wait_time = 0
+        while len(finished) < self.worker_number:
+            try:
+                shard, msg = self.input_queue.get(True, WAIT_TIMEOUT)
+            except Empty:
+                wait_time += WAIT_TIMEOUT
+                if only_results and wait_time >= STOP_TIMEOUT:
+                    break
+                continue
+            if msg[0] == 'task':
+                target = msg[1]
+                idle[shard] = None
+                if target in finished:
+                    logger.error('Task for stopped worker %d is lost', target)
+                else:
+                    forwarded[target] += 1
+                    self.send(target, ('task', msg[2]))
+            elif msg[0] == 'idle':
+                idle[shard] = msg[1]
+            elif msg[0] in ('result', 'exit'):
+                if msg[0] == 'result':
+                    self.merge_stat(msg[1], msg[2])
+                elif shard not in finished:
+                    logger.error('Worker %d has died', shard)
+                finished.add(shard)
+            if not only_results and all(
+                    idle[x] == forwarded[x]
+                    for x in range(self.worker_number) if x not in finished):
+                # Nothing to do and no tasks on the way
+                self.stop_workers()
+                only_results = True
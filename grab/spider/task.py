@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 from datetime import datetime, timedelta
+from operator import attrgetter
 
 from grab.spider.error import SpiderMisuseError
 from grab.base import copy_config
@@ -7,14 +8,28 @@ from grab.util.warning import warn
 
 
 class BaseTask(object):
-    pass
+    __slots__ = ()
 
 
 class Task(BaseTask):
     """
     Task for spider.
+
+    Standard attributes are stored in slots, custom attributes
+    are stored in the instance dict which is created only when
+    the first custom attribute is set. Grab config of cloned task
+    is shared with the original task until one of them accesses
+    `grab_config` attribute.
     """
 
+    __slots__ = (
+        'name', 'url', '_grab_config', '_config_shared', 'priority',
+        'priority_set_explicitly', 'network_try_count', 'task_try_count',
+        'disable_cache', 'refresh_cache', 'valid_status', 'use_proxylist',
+        'cache_timeout', 'schedule_time', 'raw', 'callback', 'fallback_name',
+        'coroutines_stack', '__dict__',
+    )
+
     def __init__(self, name=None, url=None, grab=None, grab_config=None,
                  priority=None, priority_set_explicitly=True,
                  network_try_count=0, task_try_count=1,
@@ -124,7 +139,7 @@ class Task(BaseTask):
             self.url = url
 
         if valid_status is None:
-            self.valid_status = []
+            self.valid_status = ()
         else:
             self.valid_status = valid_status
 
@@ -146,8 +161,52 @@ class Task(BaseTask):
         self.use_proxylist = use_proxylist
         self.raw = raw
         self.callback = callback
-        self.coroutines_stack = []
-        for key, value in kwargs.items():
+        self.coroutines_stack = ()
+        if kwargs:
+            self.__dict__.update(kwargs)
+
+    @property
+    def grab_config(self):
+        """
+        Grab config of the task.
+
+        Config shared with the clone of the task is copied
+        because the caller could change it.
+        """
+
+        if self._config_shared:
+            self._grab_config = copy_config(self._grab_config)
+            self._config_shared = False
+        return self._grab_config
+
+    @grab_config.setter
+    def grab_config(self, config):
+        self._grab_config = config
+        self._config_shared = False
+
+    def peek_grab_config(self):
+        """
+        Return grab config of the task without copying shared config.
+
+        The result must not be changed.
+        """
+
+        return self._grab_config
+
+    @property
+    def extras(self):
+        """Dict of custom attributes of the task"""
+        return self.__dict__
+
+    def __getstate__(self):
+        state = dict(zip(TASK_SLOTS, get_task_slots(self)))
+        state['grab_config'] = self._grab_config
+        state.update(self.__dict__)
+        return state
+
+    def __setstate__(self, state):
+        self._config_shared = False
+        for key, value in state.items():
             setattr(self, key, value)
 
     def get(self, key, default=None):
@@ -173,26 +232,8 @@ class Task(BaseTask):
 
         Reset network_try_count, increase task_try_count.
         Reset priority attribute if it was not set explicitly.
-        """
 
-        # First, create exact copy of the current Task object
-        attr_copy = self.__dict__.copy()
-        if attr_copy.get('grab_config') is not None:
-            del attr_copy['url']
-        if not attr_copy['priority_set_explicitly']:
-            attr_copy['priority'] = None
-        task = Task(**attr_copy)
-
-        # Reset some task properties if they have not
-        # been set explicitly in kwargs
-        if 'network_try_count' not in kwargs:
-            task.network_try_count = 0
-        if 'task_try_count' not in kwargs:
-            task.task_try_count = self.task_try_count + 1
-        if 'refresh_cache' not in kwargs:
-            task.refresh_cache = False
-        if 'disable_cache' not in kwargs:
-            task.disable_cache = False
+        """
 
         if kwargs.get('url') is not None and kwargs.get('grab') is not None:
             raise SpiderMisuseError('Options url and grab could not be '
@@ -208,6 +249,45 @@ class Task(BaseTask):
             raise SpiderMisuseError('Options grab and grab_config could not '
                                     'be used together')
 
+        # First, create exact copy of the current Task object
+        task = Task.__new__(Task)
+        task.name = self.name
+        task.url = self.url
+        # Config is copied when one of the tasks accesses it
+        task._grab_config = self._grab_config
+        task._config_shared = self._config_shared = (
+            self._grab_config is not None)
+        if self.priority_set_explicitly:
+            task.priority = self.priority
+        else:
+            task.priority = None
+        task.priority_set_explicitly = self.priority_set_explicitly
+        task.network_try_count = self.network_try_count
+        task.task_try_count = self.task_try_count
+        task.disable_cache = self.disable_cache
+        task.refresh_cache = self.refresh_cache
+        task.valid_status = self.valid_status
+        task.use_proxylist = self.use_proxylist
+        task.cache_timeout = self.cache_timeout
+        task.schedule_time = self.schedule_time
+        task.raw = self.raw
+        task.callback = self.callback
+        task.fallback_name = self.fallback_name
+        task.coroutines_stack = self.coroutines_stack
+        if self.__dict__:
+            task.__dict__.update(self.__dict__)
+
+        # Reset some task properties if they have not
+        # been set explicitly in kwargs
+        if 'network_try_count' not in kwargs:
+            task.network_try_count = 0
+        if 'task_try_count' not in kwargs:
+            task.task_try_count = self.task_try_count + 1
+        if 'refresh_cache' not in kwargs:
+            task.refresh_cache = False
+        if 'disable_cache' not in kwargs:
+            task.disable_cache = False
+
         if kwargs.get('grab'):
             task.setup_grab_config(kwargs['grab'].dump_config())
             del kwargs['grab']
@@ -248,3 +328,11 @@ class Task(BaseTask):
                 return getattr(spider, fb_name)
         else:
             return None
+
+
+# Slots saved in the state of the task, grab config
+# is saved separately because it could be shared
+TASK_SLOTS = tuple(x for x in Task.__slots__
+                   if x not in ('__dict__', '_grab_config', '_config_shared'))
+# Returns tuple of slot values of the task
+get_task_slots = attrgetter(*TASK_SLOTS) # pylint: disable=invalid-name
@@ -0,0 +1,227 @@
+"""
+Compact representation of tasks stored in the task queue.
+
+The grab config of the task keeps only the values which differ from
+the defaults. In memory the tasks created from the same cookie jar refer
+to one shared list of cookies. Persistent queue backends serialize tasks
+with JSON which is readable by any version of python, the `pickle` is used
+only if the task contains objects which JSON does not support.
+"""
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from base64 import b64decode, b64encode
+from datetime import datetime
+import json
+from weakref import WeakValueDictionary
+
+import six
+from six.moves.http_cookiejar import Cookie
+
+from grab.base import compact_config, expand_config
+from grab.spider.error import SpiderError
+from grab.spider.task import Task
+from grab.util.misc import datetime_to_timestamp
+
+JSON_PREFIX = b'\x00j'
+PICKLE_PREFIX = b'\x00p'
+# JSON objects with one of these keys keep values of types
+# which JSON does not support
+BYTES_TAG = '__bytes__'
+TUPLE_TAG = '__tuple__'
+DICT_TAG = '__dict__'
+JSON_TAGS = (BYTES_TAG, TUPLE_TAG, DICT_TAG)
+COOKIE_ATTRS = (
+    'version', 'name', 'value', 'port', 'port_specified', 'domain',
+    'domain_specified', 'domain_initial_dot', 'path', 'path_specified',
+    'secure', 'expires', 'discard', 'comment', 'comment_url', 'rfc2109',
+)
+
+
+class SharedCookieList(object):
+    __slots__ = ('cookies', '__weakref__')
+
+    def __init__(self, cookies):
+        self.cookies = tuple(cookies)
+
+
+# tuple of cookie IDs -> SharedCookieList
+SHARED_COOKIE_LISTS = WeakValueDictionary()
+
+
+def share_cookie_list(cookies):
+    key = tuple(id(x) for x in cookies)
+    shared = SHARED_COOKIE_LISTS.get(key)
+    if shared is None:
+        shared = SharedCookieList(cookies)
+        SHARED_COOKIE_LISTS[key] = shared
+    return shared
+
+
+def cookie_to_dict(cookie):
+    data = dict((x, getattr(cookie, x)) for x in COOKIE_ATTRS)
+    # pylint: disable=protected-access
+    data['rest'] = cookie._rest
+    return data
+
+
+def pack_cookie_list(cookies, portable):
+    if portable:
+        return [cookie_to_dict(x) for x in cookies]
+    else:
+        return share_cookie_list(cookies)
+
+
+def unpack_cookie_list(cookies):
+    if isinstance(cookies, SharedCookieList):
+        return list(cookies.cookies)
+    else:
+        return [Cookie(**x) for x in cookies]
+
+
+def to_json_value(value):
+    """
+    Convert value into the object which could be serialized with JSON.
+
+    Bytes, tuples and dicts with non-string keys are converted into
+    tagged JSON objects. Raises `TypeError` if the value contains
+    objects of other types.
+    """
+
+    if value is None or isinstance(value, (bool, float) + six.integer_types):
+        return value
+    elif isinstance(value, six.text_type):
+        return value
+    elif isinstance(value, six.binary_type):
+        if six.PY2:
+            # Native strings of py2 are text in most cases
+            try:
+                return value.decode('ascii')
+            except UnicodeDecodeError:
+                pass
+        return {BYTES_TAG: b64encode(value).decode('ascii')}
+    elif isinstance(value, list):
+        return [to_json_value(x) for x in value]
+    elif isinstance(value, tuple):
+        return {TUPLE_TAG: [to_json_value(x) for x in value]}
+    elif isinstance(value, dict):
+        items = [(to_json_value(key), to_json_value(val))
+                 for key, val in value.items()]
+        if all(isinstance(key, six.text_type) and key not in JSON_TAGS
+               for key, _ in items):
+            return dict(items)
+        else:
+            return {DICT_TAG: [[key, val] for key, val in items]}
+    else:
+        raise TypeError('Could not convert %s to JSON'
+                        % type(value).__name__)
+
+
+def from_json_value(value):
+    """
+    Build the value from the result of `to_json_value` function.
+    """
+
+    if isinstance(value, list):
+        return [from_json_value(x) for x in value]
+    elif isinstance(value, dict):
+        if len(value) == 1:
+            tag, tagged = next(iter(value.items()))
+            if tag == BYTES_TAG:
+                return b64decode(tagged)
+            elif tag == TUPLE_TAG:
+                return tuple(from_json_value(x) for x in tagged)
+            elif tag == DICT_TAG:
+                return dict((from_json_value(key), from_json_value(val))
+                            for key, val in tagged)
+        return dict((key, from_json_value(val))
+                    for key, val in value.items())
+    else:
+        return value
+
+
+def pack_task(task, portable=False):
+    """
+    Convert task into dict with compact grab config.
+
+    If `portable` is True then the result contains only
+    builtin types which could be serialized with JSON
+    if the task does not contain custom objects.
+    """
+
+    data = task.__getstate__()
+    if data.get('grab_config') is not None:
+        config = compact_config(data['grab_config'])
+        # Spider generates new common headers for each request
+        config.pop('common_headers', None)
+        cookies = config.pop('state', {}).get('cookiejar_cookies')
+        if cookies:
+            config['state'] = {
+                'cookiejar_cookies': pack_cookie_list(cookies, portable),
+            }
+        data['grab_config'] = config
+    if portable and data.get('schedule_time') is not None:
+        data['schedule_time'] = datetime_to_timestamp(data['schedule_time'])
+    return data
+
+
+def unpack_task(data):
+    """
+    Build task from the result of `pack_task` function.
+    """
+
+    task = Task.__new__(Task)
+    task.__setstate__(data)
+    if data.get('grab_config') is not None:
+        config = expand_config(data['grab_config'])
+        cookies = config['state'].get('cookiejar_cookies')
+        if cookies:
+            config['state'] = {
+                'cookiejar_cookies': unpack_cookie_list(cookies),
+            }
+        task.grab_config = config
+    if isinstance(data.get('schedule_time'), float):
+        task.schedule_time = datetime.utcfromtimestamp(data['schedule_time'])
+    return task
+
+
+def encode_task(task, allow_pickle=True):
+    """
+    Serialize task into bytes.
+
+    If `allow_pickle` is False then `TypeError` is raised
+    if the task contains objects which JSON does not support.
+    """
+
+    data = pack_task(task, portable=True)
+    try:
+        return JSON_PREFIX + json.dumps(
+            to_json_value(data), separators=(',', ':')).encode('utf-8')
+    except TypeError:
+        if not allow_pickle:
+            raise
+        # Task contains objects which JSON does not support
+        return PICKLE_PREFIX + pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+
+def decode_task(data, allow_pickle=True):
+    """
+    Build task from the result of `encode_task` function.
+
+    Tasks serialized with `pickle` by old versions of queue
+    backends are supported too. If `allow_pickle` is False then
+    pickled tasks are not loaded: unpickling of data received from
+    untrusted source could run arbitrary code.
+    """
+
+    prefix = data[:2]
+    if prefix == JSON_PREFIX:
+        return unpack_task(from_json_value(
+            json.loads(data[2:].decode('utf-8'))))
+    elif not allow_pickle:
+        raise SpiderError('Task is not encoded with JSON')
+    elif prefix == PICKLE_PREFIX:
+        return unpack_task(pickle.loads(data[2:]))
+    else:
+        return pickle.loads(data)
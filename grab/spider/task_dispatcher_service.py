@@ -1,15 +1,20 @@
-from six.moves.queue import Empty, Queue
+from six.moves.queue import Empty
 from weblib.error import ResponseNotValid
 
-from grab.spider.base_service import BaseService
+from grab.spider.base_service import BaseService, ServiceQueue
 from grab.spider.task import Task
 from grab.spider.error import FatalError, SpiderError
 
 
+# Max. number of results which are processed in one batch
+DEFAULT_BATCH_SIZE = 100
+
+
 class TaskDispatcherService(BaseService):
-    def __init__(self, spider):
-        self.input_queue = Queue()
+    def __init__(self, spider, batch_size=DEFAULT_BATCH_SIZE):
+        self.input_queue = ServiceQueue()
         self.spider = spider
+        self.batch_size = batch_size
         self.worker = self.create_worker(self.worker_callback)
         self.register_workers(self.worker)
 
@@ -20,11 +25,48 @@ class TaskDispatcherService(BaseService):
         while not worker.stop_event.is_set():
             worker.process_pause_signal()
             try:
-                result, task, meta = self.input_queue.get(True, 0.1)
+                items = [self.input_queue.get_or_wakeup(worker)]
             except Empty:
                 pass
             else:
+                # Take all results available right now to put new tasks
+                # into the task queue with one call of queue backend
+                while len(items) < self.batch_size:
+                    try:
+                        items.append(self.input_queue.get_nowait())
+                    except Empty:
+                        break
+                self.process_service_results(items)
+
+    def wakeup(self):
+        self.input_queue.wakeup()
+
+    def process_service_results(self, items):
+        """
+        Process list of (result, task, meta) items.
+
+        New tasks from task generator and task handlers are added to
+        the task queue in batches, the order of other results is kept.
+        """
+
+        new_tasks = []
+        for result, task, meta in items:
+            if (isinstance(result, Task)
+                    and (meta is None
+                         or meta.get('source') != 'cache_reader')):
+                new_tasks.append((result, meta))
+            else:
+                self.add_new_tasks(new_tasks)
+                new_tasks = []
                 self.process_service_result(result, task, meta)
+        self.add_new_tasks(new_tasks)
+
+    def add_new_tasks(self, items):
+        if items:
+            self.spider.add_tasks([x[0] for x in items])
+            for task, meta in items:
+                if meta and meta.get('source') == 'task_generator':
+                    self.spider.complete_task(task)
 
     def process_service_result(self, result, task, meta=None):
         """
@@ -40,7 +82,12 @@ class TaskDispatcherService(BaseService):
             {ok, ecode, emsg, error_abbr, exc, grab, grab_config_backup}
 
         Exception can come only from parser_service and it always has
-        meta {"from": "parser", "exc_info": <...>}
+        meta {"from": "parser", "exc_info": <...>}. If the exception
+        comes from parser process then meta also contains
+        formatted traceback in "traceback" key.
+
+        Parser service sends `None` result with meta {"task_done": True}
+        when task handler is completed.
         """
 
         if meta is None:
@@ -48,10 +95,15 @@ class TaskDispatcherService(BaseService):
         if isinstance(result, Task):
             if meta.get('source') == 'cache_reader':
                 self.spider.add_task(result, queue=self.spider.task_queue)
+                self.spider.complete_task(result)
+            elif meta.get('source') == 'task_generator':
+                self.spider.add_task(result)
+                self.spider.complete_task(result)
             else:
                 self.spider.add_task(result)
         elif result is None:
-            pass
+            if meta.get('task_done'):
+                self.spider.complete_task(task)
         elif isinstance(result, ResponseNotValid):
             self.spider.add_task(task.clone(refresh_cache=True))
             error_code = result.__class__.__name__.replace('_', '-')
@@ -64,10 +116,15 @@ class TaskDispatcherService(BaseService):
                 handler_name = 'NA'
             self.spider.process_parser_error(
                 handler_name, task, meta['exc_info'],
+                traceback=meta.get('traceback'),
             )
             if isinstance(result, FatalError):
                 self.spider.fatal_error_queue.put(meta['exc_info'])
         elif isinstance(result, dict) and 'grab' in result:
+            if not result.get('from_cache'):
+                self.spider.update_concurrency_limits(result, task)
+                self.spider.update_proxy_stat(result, task)
+                self.spider.release_task_host(task)
             if (self.spider.cache_writer_service
                     and not result.get('from_cache')
                     and result['ok']):
@@ -100,6 +157,7 @@ class TaskDispatcherService(BaseService):
                     task.setup_grab_config(
                         result['grab_config_backup'])
                     self.spider.add_task(task)
+                self.spider.complete_task(task)
             if result.get('from_cache'):
                 self.spider.stat.inc('spider:task-%s-cache'
                                      % task.name)
@@ -1,4 +1,3 @@
-import time
 import six
 
 from grab.spider.base_service import BaseService
@@ -9,10 +8,23 @@ class TaskGeneratorService(BaseService):
         self.real_generator = real_generator
         self.spider = spider
         self.task_queue_threshold = max(200, self.spider.thread_number * 2)
+        # Number of tasks taken from the generator
+        self.generated_number = 0
+        # Number of tasks to skip, used to resume the spider
+        # which tasks have been generated before
+        self.skip_number = 0
+        self.is_completed = False
         self.worker = self.create_worker(self.worker_callback)
         self.register_workers(self.worker)
 
     def worker_callback(self, worker):
+        try:
+            while self.generated_number < self.skip_number:
+                next(self.real_generator)
+                self.generated_number += 1
+        except StopIteration:
+            self.is_completed = True
+            return
         while not worker.stop_event.is_set():
             worker.process_pause_signal()
             queue_size = max(
@@ -26,12 +38,20 @@ class TaskGeneratorService(BaseService):
                     for _ in six.moves.range(
                             self.task_queue_threshold - queue_size):
                         if worker.pause_event.is_set():
-                            return
+                            break
                         task = next(self.real_generator)
+                        self.generated_number += 1
+                        # Task is active until task dispatcher
+                        # puts it into the task queue
+                        self.spider.inc_active_task_number()
+                        self.spider.track_active_tasks([task])
                         self.spider.task_dispatcher.input_queue.put((
                             task, None, {'source': 'task_generator'}
                         ))
                 except StopIteration:
+                    self.is_completed = True
+                    # Spider could be idle already
+                    self.spider.wakeup_main_loop()
                     return
             else:
-                time.sleep(0.1)
+                worker.sleep(0.1)
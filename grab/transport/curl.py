@@ -33,6 +33,18 @@ from grab.util.log import PycurlSigintHandler
 logger = logging.getLogger('grab.transport.curl')
 # pylint: enable=invalid-name
 
+# Values of `http_version` option, versions which are not
+# supported by installed pycurl are not available
+HTTP_VERSIONS = {}
+for key, name in (('1.0', 'CURL_HTTP_VERSION_1_0'),
+                  ('1.1', 'CURL_HTTP_VERSION_1_1'),
+                  ('2', 'CURL_HTTP_VERSION_2_0'),
+                  ('2tls', 'CURL_HTTP_VERSION_2TLS'),
+                  ('2-prior-knowledge',
+                   'CURL_HTTP_VERSION_2_PRIOR_KNOWLEDGE')):
+    if hasattr(pycurl, name):
+        HTTP_VERSIONS[key] = getattr(pycurl, name)
+
 # We should ignore SIGPIPE when using pycurl.NOSIGNAL - see
 # the libcurl tutorial for more info.
 
@@ -92,9 +104,12 @@ class CurlTransport(BaseTransport):
     Grab transport layer using pycurl.
     """
 
-    def __init__(self):
+    def __init__(self, curl=None):
         super(CurlTransport, self).__init__()
-        self.curl = pycurl.Curl()
+        # Curl handle could be borrowed from the owner which
+        # keeps it to reuse its connections in next requests.
+        # Without the owner the handle is created on first use.
+        self._curl = curl
 
         # this assignments makes pylint happy
         self.config_nobody = None
@@ -106,6 +121,17 @@ class CurlTransport(BaseTransport):
         self.response_body_chunks = None
         self.reset()
 
+    @property
+    def curl(self):
+        if self._curl is None:
+            self._curl = pycurl.Curl()
+        return self._curl
+
+    @curl.setter
+    def curl(self, curl):
+        # The owner of borrowed handle detaches it by setting None
+        self._curl = curl
+
     def reset(self):
         super(CurlTransport, self).reset()
         self.response_header_chunks = []
@@ -119,7 +145,8 @@ class CurlTransport(BaseTransport):
         self.request_body = b''
         #self.request_log = ''
 
-        self.curl.grab_callback_interrupted = False
+        if self._curl is not None:
+            self._curl.grab_callback_interrupted = False
 
     def header_processor(self, chunk):
         """
@@ -229,6 +256,13 @@ class CurlTransport(BaseTransport):
         if not grab.config['connection_reuse']:
             self.curl.setopt(pycurl.FRESH_CONNECT, 1)
             self.curl.setopt(pycurl.FORBID_REUSE, 1)
+        if grab.config['http_version'] is not None:
+            try:
+                http_version = HTTP_VERSIONS[grab.config['http_version']]
+            except KeyError:
+                raise GrabMisuseError('Invalid value of http_version option:'
+                                      ' %s' % grab.config['http_version'])
+            self.curl.setopt(pycurl.HTTP_VERSION, http_version)
 
         self.curl.setopt(pycurl.NOSIGNAL, 1)
         self.curl.setopt(pycurl.HEADERFUNCTION, self.header_processor)
@@ -27,6 +27,9 @@ from grab.document import Document
 from grab.upload import UploadFile, UploadContent
 from grab.transport.base import BaseTransport
 
+# Requests which could be sent once again without side effects
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE')
+
 
 def make_unicode(val, encoding='utf-8', errors='strict'):
     if isinstance(val, six.binary_type):
@@ -87,9 +90,14 @@ class Urllib3Transport(BaseTransport):
     """
     Grab network transport based on urllib3 library.
     """
-    def __init__(self):
+    def __init__(self, pool=None, proxy_pools=None):
         super(Urllib3Transport, self).__init__()
-        self.pool = PoolManager(10)
+        # Pools could be borrowed from the owner which keeps
+        # them to reuse their connections in next requests
+        self.pool = pool if pool is not None else PoolManager(10)
+        # (proxy type, proxy, proxy userpwd) -> pool of connections
+        # to the proxy
+        self.proxy_pools = proxy_pools if proxy_pools is not None else {}
 
         logger = logging.getLogger('urllib3.connectionpool')
         logger.setLevel(logging.WARNING)
@@ -223,10 +231,16 @@ class Urllib3Transport(BaseTransport):
 
         self._request = req
 
-    def request(self):
-        req = self._request
+    def get_proxy_pool(self, req):
+        """
+        Return pool of connections to the proxy of the request.
 
-        if req.proxy:
+        Pools are kept to reuse connections to the same proxy.
+        """
+
+        key = (req.proxy_type, req.proxy, req.proxy_userpwd)
+        pool = self.proxy_pools.get(key)
+        if pool is None:
             if req.proxy_userpwd:
                 headers = make_headers(proxy_basic_auth=req.proxy_userpwd)
             else:
@@ -236,6 +250,36 @@ class Urllib3Transport(BaseTransport):
                 pool = SOCKSProxyManager(proxy_url) # , proxy_headers=headers)
             else:
                 pool = ProxyManager(proxy_url, proxy_headers=headers)
+            self.proxy_pools[key] = pool
+        return pool
+
+    def send_request(self, pool, method, url, **kwargs):
+        """
+        Send request with the pool.
+
+        If the idempotent request fails on the connection which has been
+        reused then it is sent once again: server could close idle
+        connection. Other requests could have been processed by the server
+        so they are not repeated.
+        """
+
+        conn_pool = pool.connection_from_url(url)
+        conn_number = conn_pool.num_connections
+        try:
+            return pool.urlopen(method, url, **kwargs)
+        except exceptions.ProtocolError:
+            if (conn_pool.num_connections != conn_number
+                    or str(method).upper() not in IDEMPOTENT_METHODS):
+                # New connection has failed or the request is not safe
+                # to repeat
+                raise
+        return pool.urlopen(method, url, **kwargs)
+
+    def request(self):
+        req = self._request
+
+        if req.proxy:
+            pool = self.get_proxy_pool(req)
         else:
             pool = self.pool
         try:
@@ -254,15 +298,16 @@ class Urllib3Transport(BaseTransport):
                 req_url = make_str(req.url)
                 req_method = req.method
             req.op_started = time.time()
-            res = pool.urlopen(req_method,
-                               req_url,
-                               body=req.data, timeout=timeout,
-                               retries=retry, headers=req.headers,
-                               preload_content=False)
+            res = self.send_request(pool, req_method, req_url,
+                                    body=req.data, timeout=timeout,
+                                    retries=retry, headers=req.headers,
+                                    preload_content=False)
         except exceptions.ReadTimeoutError as ex:
             raise error.GrabTimeoutError('ReadTimeoutError', ex)
         except exceptions.ConnectTimeoutError as ex:
             raise error.GrabConnectionError('ConnectTimeoutError', ex)
+        except exceptions.ProxyError as ex:
+            raise error.GrabConnectionError('ProxyError', ex)
         except exceptions.ProtocolError as ex:
             # TODO:
             # the code
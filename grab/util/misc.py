@@ -1,3 +1,4 @@
+from calendar import timegm
 import re
 
 
@@ -10,3 +11,8 @@ def camel_case_to_underscore(name):
     res = RE_TOKEN1.sub(r'\1_\2', name)
     res = RE_TOKEN2.sub(r'\1_\2', res)
     return res.lower()
+
+
+def datetime_to_timestamp(value):
+    """Converts naive UTC datetime into unix timestamp"""
+    return timegm(value.utctimetuple()) + value.microsecond / 1000000.0
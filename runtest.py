@@ -80,6 +80,15 @@ SPIDER_TEST_LIST = (
     #'tests.spider_data',
     'tests.spider_stat',
     'tests.spider_multiprocess',
+    'tests.spider_parser_process',
+    'tests.spider_scheduler',
+    'tests.spider_concurrency',
+    'tests.spider_task_codec',
+    'tests.spider_dupe_filter',
+    'tests.spider_checkpoint',
+    'tests.spider_shard',
+    'tests.spider_coordinator',
+    'tests.spider_http2',
 )
 
 
@@ -26,6 +26,7 @@ setup(
         'grab.spider',
         'grab.spider.cache_backend',
         'grab.spider.queue_backend',
+        'grab.spider.dupe_filter',
         'grab.spider.network_service',
         'grab.transport',
         'grab.util',
@@ -1,5 +1,5 @@
 # coding: utf-8
-from tests.util import build_grab, temp_file
+from tests.util import build_grab, temp_file, only_grab_transport
 from tests.util import BaseGrabTestCase
 import six
 from grab.proxylist import BaseProxySource
@@ -43,6 +43,18 @@ class TestProxy(BaseGrabTestCase):
         self.assertEqual(b'123', grab.doc.body)
         self.assertEqual('yandex.ru', self.server.request['headers']['host'])
 
+    @only_grab_transport('urllib3')
+    def test_proxy_pool_reuse(self):
+        grab = build_grab()
+        proxy = '%s:%s' % (ADDRESS, self.server.port)
+        grab.setup(proxy=proxy, proxy_type='http')
+        grab.go('http://yandex.ru')
+        pool = grab.transport.proxy_pools[('http', proxy, None)]
+        grab.go('http://yandex.ru')
+        self.assertEqual(1, len(grab.transport.proxy_pools))
+        self.assertTrue(
+            grab.transport.proxy_pools[('http', proxy, None)] is pool)
+
     def test_deprecated_setup_proxylist(self):
         with temp_file() as tmp_file:
             proxy = '%s:%s' % (ADDRESS, self.server.port)
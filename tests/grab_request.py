@@ -1,9 +1,15 @@
 # coding: utf-8
-from tests.util import build_grab, exclude_grab_transport
+import time
+
+import mock
+
+from tests.util import (build_grab, exclude_grab_transport,
+                        only_grab_transport)
 from tests.util import BaseGrabTestCase
 
 from grab.error import (GrabInternalError, GrabCouldNotResolveHostError,
-                        GrabTimeoutError)
+                        GrabTimeoutError, GrabMisuseError,
+                        GrabNetworkError)
 
 
 class GrabRequestTestCase(BaseGrabTestCase):
@@ -77,3 +83,34 @@ class GrabRequestTestCase(BaseGrabTestCase):
         grab.setup(headers={'Foo': 'Bar'})
         grab.go(self.server.get_url())
         self.assertEqual('Bar', grab.request_headers['foo'])
+
+    @only_grab_transport('pycurl')
+    def test_http_version(self):
+        grab = build_grab(http_version='1.0', debug=True)
+        grab.go(self.server.get_url())
+        self.assertTrue(b' HTTP/1.0\r\n' in grab.request_head)
+
+        grab = build_grab(http_version='3.14')
+        self.assertRaises(GrabMisuseError, grab.go, self.server.get_url())
+
+    @only_grab_transport('urllib3')
+    def test_closed_connection_retry(self):
+        grab = build_grab()
+        grab.go(self.server.get_url())
+        # Test server closes the connection after the response
+        time.sleep(0.1)
+        # Closed connection is taken from the pool as alive one
+        with mock.patch('urllib3.connectionpool.is_connection_dropped',
+                        return_value=False):
+            grab.go(self.server.get_url())
+        self.assertEqual(200, grab.doc.code)
+
+    @only_grab_transport('urllib3')
+    def test_closed_connection_no_post_retry(self):
+        grab = build_grab()
+        grab.go(self.server.get_url())
+        time.sleep(0.1)
+        with mock.patch('urllib3.connectionpool.is_connection_dropped',
+                        return_value=False):
+            self.assertRaises(GrabNetworkError, grab.go,
+                              self.server.get_url(), post={'foo': 'bar'})
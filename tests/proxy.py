@@ -54,3 +54,95 @@ class ProxyListTestCase(BaseGrabTestCase):
             self.assertEqual(plist.get_next_proxy().host, 'foo')
             plist.load_file(path)
             self.assertEqual(plist.get_next_proxy().host, 'foo')
+
+    def test_proxy_quarantine(self):
+        plist = ProxyList()
+        plist.load_list(['foo:1', 'bar:1'])
+        for _ in range(2):
+            self.assertFalse(plist.process_result('foo:1', False, now=0))
+        self.assertTrue(plist.process_result('foo:1', False, now=0))
+        stats = plist.get_stats(now=1)
+        self.assertTrue(stats['foo:1']['quarantined'])
+        self.assertFalse(stats['bar:1']['quarantined'])
+        for _ in range(10):
+            self.assertEqual('bar', plist.get_best_proxy(now=1).host)
+        # Next failure after the quarantine doubles the quarantine time
+        self.assertTrue(plist.process_result('foo:1', False, now=31))
+        self.assertTrue(plist.get_stats(now=90)['foo:1']['quarantined'])
+        self.assertFalse(plist.get_stats(now=92)['foo:1']['quarantined'])
+
+    def test_all_proxies_quarantined(self):
+        plist = ProxyList()
+        plist.load_list(['foo:1', 'bar:1'])
+        for _ in range(3):
+            plist.process_result('bar:1', False, now=0)
+            plist.process_result('foo:1', False, now=1)
+        self.assertEqual('bar', plist.get_best_proxy(now=2).host)
+
+    def test_proxy_latency_selection(self):
+        plist = ProxyList()
+        plist.load_list(['foo:1', 'bar:1'])
+        plist.process_result('foo:1', True, 2.0)
+        plist.process_result('foo:1', True, 1.0)
+        plist.process_result('bar:1', True, 0.5)
+        self.assertEqual(1.7, plist.get_stats()['foo:1']['latency'])
+        for _ in range(10):
+            self.assertEqual('bar', plist.get_best_proxy().host)
+
+    def test_proxy_limits(self):
+        plist = ProxyList()
+        plist.load_list(['foo:1', 'bar:1'])
+        plist.setup_limits(max_connections=1, request_rate=1)
+        hosts = set()
+        for _ in range(2):
+            hosts.add(plist.acquire_proxy(now=0).host)
+        self.assertEqual(set(['foo', 'bar']), hosts)
+        self.assertEqual(None, plist.acquire_proxy(now=0))
+        plist.release_proxy('foo:1')
+        # Request rate limit
+        self.assertEqual(None, plist.acquire_proxy(now=0.5))
+        self.assertEqual(0.5, plist.get_capacity_timeout(now=0.5))
+        self.assertEqual('foo', plist.acquire_proxy(now=1).host)
+
+    def test_proxy_reserved_request(self):
+        plist = ProxyList()
+        plist.load_list(['foo:1'])
+        plist.setup_limits(request_rate=1)
+        self.assertEqual('foo', plist.acquire_proxy(now=0, charge=False).host)
+        # Proxy is reserved until the request is charged or cancelled
+        self.assertEqual(None, plist.acquire_proxy(now=0))
+        # Cancelled requests do not count in request rate
+        for _ in range(2):
+            plist.release_proxy('foo:1', cancel=True)
+            self.assertEqual('foo', plist.acquire_proxy(
+                now=0, charge=False).host)
+        plist.charge_proxy('foo:1', now=0.5)
+        plist.release_proxy('foo:1')
+        self.assertEqual(None, plist.acquire_proxy(now=1))
+        self.assertEqual('foo', plist.acquire_proxy(now=1.5).host)
+
+    def test_reload_keeps_stat(self):
+        with temp_file() as path:
+            plist = ProxyList()
+            self.generate_plist_file(path, 'foo:1\nbar:1')
+            plist.load_file(path)
+            plist.process_result('foo:1', True, 0.5)
+            plist.process_result('bar:1', True, 0.5)
+            self.generate_plist_file(path, 'foo:1\nbaz:1')
+            self.assertEqual(2, plist.reload())
+            stats = plist.get_stats()
+            self.assertEqual(set(['foo:1', 'baz:1']), set(stats))
+            self.assertEqual(1, stats['foo:1']['requests'])
+            self.assertEqual(0, stats['baz:1']['requests'])
+
+    def test_reload_web_source(self):
+        plist = ProxyList()
+        self.server.response['data'] = 'foo:1'
+        plist.load_url(self.server.get_url())
+        self.server.response['data'] = 'bar:1\nbaz:1'
+        self.assertEqual(2, plist.reload())
+        self.assertEqual(['bar', 'baz'], [x.host for x in plist])
+        # Empty list does not replace the current one
+        self.server.response['data'] = ''
+        self.assertEqual(0, plist.reload())
+        self.assertEqual(2, plist.size())
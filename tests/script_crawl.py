@@ -31,6 +31,17 @@ class FailSpider(Spider):
         raise Exception('Shit happens!')
 
 
+class ShardSpider(Spider):
+    urls = None
+
+    def task_generator(self):
+        for url in self.urls:
+            yield Task('page', url=url)
+
+    def task_page(self, grab, unused_task):
+        self.stat.collect('bodies', grab.doc.body)
+
+
 class ScriptCrawlTestCase(BaseGrabTestCase):
     def setUp(self):
         self.server.reset()
@@ -50,3 +61,17 @@ class ScriptCrawlTestCase(BaseGrabTestCase):
         self.server.response['data'] = b'1'
         SPIDER_REGISTRY.clear()
         crawl.main('fail_spider', settings_module='tests.files.crawl_settings')
+
+    def test_crawl_workers(self):
+        ShardSpider.urls = [
+            self.server.get_url(),
+            self.server.get_url().replace('localhost', '127.0.0.1'),
+        ]
+        self.server.response['data'] = b'1'
+        SPIDER_REGISTRY.clear()
+        result = crawl.main('shard_spider',
+                            settings_module='tests.files.crawl_settings',
+                            disable_report=True, workers=2,
+                            grab_transport='pycurl',
+                            network_service='multicurl')
+        self.assertTrue('bodies: 2' in result['spider_stats'])
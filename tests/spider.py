@@ -210,3 +210,30 @@ class BasicSpiderTestCase(BaseGrabTestCase):
         bot.setup_queue()
         bot.add_task(Task('page', url=self.server.get_url()))
         self.assertRaises(FatalError, bot.run)
+
+    def test_active_task_number(self):
+        class TestSpider(Spider):
+            def task_generator(self):
+                yield Task('page', url=server.get_url(), num=0)
+
+            def task_page(self, unused_grab, task):
+                self.stat.inc('pages')
+                if task.num < 3:
+                    yield Task('page', url=server.get_url(),
+                               num=task.num + 1)
+                    yield Task('page', url=server.get_url(),
+                               num=task.num + 1, network_try_count=100)
+
+            def check_task_limits(self, task):
+                if task.network_try_count > 10:
+                    return False, 'network-try-count'
+                return True, 'ok'
+
+        server = self.server
+        bot = build_spider(TestSpider)
+        bot.setup_queue()
+        bot.run()
+        self.assertEqual(4, bot.stat.counters['pages'])
+        self.assertEqual(
+            3, len(bot.stat.collections['network-count-rejected']))
+        self.assertEqual(0, bot.active_task_number)
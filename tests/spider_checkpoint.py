@@ -0,0 +1,112 @@
+import os
+import shutil
+from tempfile import mkdtemp
+
+from tests.util import BaseGrabTestCase, build_spider
+from grab.spider import Spider, Task
+
+
+class SpiderCheckpointTestCase(BaseGrabTestCase):
+    class SimpleSpider(Spider):
+        def task_page(self, unused_grab, task):
+            self.stat.collect('numbers', task.num)
+
+    def setUp(self):
+        super(SpiderCheckpointTestCase, self).setUp()
+        self.server.response['get.data'] = 'foo'
+        self.tmp_dir = mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'spider.checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(SpiderCheckpointTestCase, self).tearDown()
+
+    def test_checkpoint_resume(self):
+        bot = build_spider(self.SimpleSpider)
+        bot.setup_queue()
+        bot.setup_dupe_filter()
+        for num in range(3):
+            bot.add_task(Task('page', url=self.server.get_url() + str(num),
+                              num=num, priority=num + 1))
+        bot.add_task(Task('page', url=self.server.get_url(), num=3,
+                          delay=1))
+        bot.stat.inc('foo', 5)
+        bot.checkpoint(self.path)
+
+        bot = build_spider(self.SimpleSpider, thread_number=1)
+        bot.setup_queue()
+        bot.setup_dupe_filter()
+        bot.resume(self.path)
+        self.assertEqual(4, bot.task_queue.size())
+        self.assertEqual(5, bot.stat.counters['foo'])
+        self.assertFalse(bot.add_task(Task('page',
+                                           url=self.server.get_url() + '1')))
+        bot.run()
+        self.assertEqual([0, 1, 2, 3], bot.stat.collections['numbers'])
+
+    def test_graceful_shutdown(self):
+        server = self.server
+
+        class TestSpider(self.SimpleSpider):
+            def task_generator(self):
+                for num in range(10):
+                    yield Task('page', url=server.get_url(), num=num,
+                               priority=num + 1)
+
+            def task_page(self, grab, task):
+                super(TestSpider, self).task_page(grab, task)
+                if task.num == 2:
+                    self.stop()
+
+        bot = build_spider(TestSpider, thread_number=1,
+                           checkpoint_path=self.path)
+        bot.run()
+        numbers = set(bot.stat.collections['numbers'])
+        self.assertTrue(os.path.exists(self.path))
+        self.assertTrue(len(numbers) < 10)
+
+        bot = build_spider(TestSpider, thread_number=1,
+                           checkpoint_path=self.path)
+        bot.resume()
+        self.assertTrue(bot.task_queue.size() > 0)
+        bot.run()
+        self.assertEqual(set(range(10)),
+                         set(bot.stat.collections['numbers']))
+
+    def test_generator_skip(self):
+        server = self.server
+
+        class TestSpider(self.SimpleSpider):
+            def task_generator(self):
+                for num in range(5):
+                    yield Task('page', url=server.get_url(), num=num)
+
+        bot = build_spider(TestSpider)
+        bot.setup_queue()
+        bot.task_generator_service.generated_number = 3
+        bot.checkpoint(self.path)
+
+        bot = build_spider(TestSpider)
+        bot.resume(self.path)
+        bot.run()
+        self.assertEqual([3, 4], sorted(bot.stat.collections['numbers']))
+
+    def test_periodic_checkpoint(self):
+        server = self.server
+
+        class TestSpider(self.SimpleSpider):
+            def task_generator(self):
+                yield Task('page', url=server.get_url(), num=1)
+                yield Task('page', url=server.get_url(), num=2, delay=1.5)
+
+            def checkpoint(self, path=None):
+                self.stat.inc('checkpoint-running',
+                              1 if self.running_services else 0)
+                super(TestSpider, self).checkpoint(path)
+
+        bot = build_spider(TestSpider, thread_number=1,
+                           checkpoint_path=self.path,
+                           checkpoint_interval=0.5)
+        bot.run()
+        self.assertEqual([1, 2], sorted(bot.stat.collections['numbers']))
+        self.assertTrue(bot.stat.counters['checkpoint-running'] > 0)
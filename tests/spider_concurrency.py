@@ -0,0 +1,125 @@
+from unittest import TestCase
+
+from grab.spider import Spider, Task
+from grab.spider.concurrency import AimdLimit, ConcurrencyController
+
+from tests.util import BaseGrabTestCase, build_spider
+
+
+class AimdLimitTestCase(TestCase):
+    def test_slow_start(self):
+        limit = AimdLimit(max_limit=10)
+        self.assertEqual(4, limit.get_limit())
+        for _ in range(3):
+            limit.process_success()
+        self.assertEqual(7, limit.get_limit())
+        for _ in range(10):
+            limit.process_success()
+        self.assertEqual(10, limit.get_limit())
+
+    def test_decrease(self):
+        limit = AimdLimit(max_limit=20)
+        for _ in range(4):
+            limit.process_success()
+        self.assertEqual(8, limit.get_limit())
+        limit.process_failure()
+        self.assertEqual(4, limit.get_limit())
+        # Requests started before the limit was cut do not cut it again
+        limit.process_failure()
+        self.assertEqual(4, limit.get_limit())
+        for _ in range(4):
+            limit.process_failure()
+        self.assertEqual(2, limit.get_limit())
+
+    def test_additive_increase(self):
+        limit = AimdLimit(max_limit=20)
+        for _ in range(3):
+            limit.process_failure()
+        self.assertEqual(2, limit.get_limit())
+        limit.process_success()
+        limit.process_success()
+        self.assertEqual(2, limit.get_limit())
+        limit.process_success()
+        self.assertEqual(3, limit.get_limit())
+
+    def test_min_limit(self):
+        limit = AimdLimit(max_limit=20)
+        for _ in range(100):
+            limit.process_failure()
+        self.assertEqual(1, limit.get_limit())
+
+    def test_latency(self):
+        limit = AimdLimit(max_limit=20)
+        limit.process_success(latency=0.2)
+        self.assertEqual(5, limit.get_limit())
+        for _ in range(20):
+            limit.process_success(latency=10)
+        self.assertEqual(5, limit.get_limit())
+
+
+class ConcurrencyControllerTestCase(TestCase):
+    def test_host_limit(self):
+        ctl = ConcurrencyController(max_limit=10, max_host_limit=2)
+        self.assertEqual(2, ctl.get_host_limit('a.com'))
+        self.assertTrue(ctl.process_result('a.com', True))
+        self.assertEqual(5, ctl.get_limit())
+        self.assertEqual(2, ctl.get_host_limit('a.com'))
+        ctl.process_result('a.com', False)
+        self.assertEqual(1, ctl.get_host_limit('a.com'))
+        self.assertEqual(2, ctl.get_host_limit('b.com'))
+
+    def test_max_hosts(self):
+        ctl = ConcurrencyController(max_limit=10, max_host_limit=8,
+                                    max_hosts=2)
+        ctl.process_result('a.com', False)
+        ctl.process_result('b.com', False)
+        # Recently used host is kept
+        ctl.process_result('a.com', False)
+        ctl.process_result('c.com', True)
+        self.assertEqual(['a.com', 'c.com'], list(ctl.host_limits))
+        self.assertEqual(2, ctl.get_host_limit('a.com'))
+        self.assertEqual(4, ctl.get_host_limit('b.com'))
+
+    def test_no_host_limit(self):
+        ctl = ConcurrencyController(max_limit=10)
+        self.assertEqual(None, ctl.get_host_limit('a.com'))
+
+
+class SpiderConcurrencyTestCase(BaseGrabTestCase):
+    def setUp(self):
+        self.server.reset()
+
+    def test_limit_decreased_on_server_error(self):
+        class TestSpider(Spider):
+            def task_generator(self):
+                for _ in range(10):
+                    yield Task('page', url=server.get_url())
+
+            def task_page(self, unused_grab, unused_task):
+                self.stat.inc('pages')
+
+        server = self.server
+        server.response['code'] = 503
+        bot = build_spider(TestSpider, thread_number=10,
+                           adaptive_concurrency=True, network_try_limit=2)
+        bot.setup_queue()
+        bot.run()
+        self.assertTrue('pages' not in bot.stat.counters)
+        self.assertTrue(bot.concurrency_controller.get_limit() < 4)
+
+    def test_limit_increased(self):
+        class TestSpider(Spider):
+            def task_generator(self):
+                for _ in range(10):
+                    yield Task('page', url=server.get_url())
+
+            def task_page(self, unused_grab, unused_task):
+                self.stat.inc('pages')
+
+        server = self.server
+        bot = build_spider(TestSpider, thread_number=10,
+                           adaptive_concurrency=True)
+        bot.setup_queue()
+        bot.run()
+        self.assertEqual(10, bot.stat.counters['pages'])
+        self.assertEqual(10, bot.concurrency_controller.get_limit())
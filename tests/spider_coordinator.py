@@ -0,0 +1,130 @@
+import socket
+
+from grab.spider import Spider, Task
+from grab.spider.coordinator import (
+    CoordinatorServer, CoordinatorClient, CoordinatorError, CoordinatorQueue,
+    PROTOCOL_VERSION, send_message, recv_message, build_digest,
+)
+from grab.spider.error import SpiderMisuseError
+from grab.spider.parser_process import get_process_context
+
+from tests.util import BaseGrabTestCase, build_spider
+
+AUTHKEY = b'secret'
+
+
+class SimpleSpider(Spider):
+    def task_generator(self):
+        # Each spider process generates the same tasks
+        for num in range(10):
+            yield Task('page', url=self.meta['url'] + '?num=%d' % num,
+                       num=num)
+
+    def task_page(self, unused_grab, task):
+        self.stat.collect('numbers', task.num)
+        if task.num < 10:
+            yield Task('page', url=self.meta['url'] + '?num=%d' % (
+                task.num + 10), num=task.num + 10)
+
+
+def run_spider(address, url, conn):
+    bot = build_spider(SimpleSpider, meta={'url': url}, thread_number=2)
+    bot.setup_queue(backend='coordinator', address=address,
+                    authkey=AUTHKEY)
+    bot.setup_dupe_filter(backend='coordinator', address=address,
+                          authkey=AUTHKEY)
+    bot.run()
+    conn.send(bot.stat.collections['numbers'])
+    conn.close()
+
+
+class SpiderCoordinatorTestCase(BaseGrabTestCase):
+    def setUp(self):
+        self.server.reset()
+        self.coordinator = CoordinatorServer(('127.0.0.1', 0),
+                                             authkey=AUTHKEY)
+        self.coordinator.start()
+
+    def tearDown(self):
+        self.coordinator.stop()
+
+    def test_multiple_processes(self):
+        context = get_process_context()
+        procs = []
+        conns = []
+        for _ in range(3):
+            conn, child_conn = context.Pipe()
+            proc = context.Process(target=run_spider, args=(
+                self.coordinator.server_address, self.server.get_url(),
+                child_conn,
+            ))
+            proc.start()
+            procs.append(proc)
+            conns.append(conn)
+        numbers = []
+        for proc, conn in zip(procs, conns):
+            numbers.extend(conn.recv())
+            proc.join()
+        # Each task is processed exactly once
+        self.assertEqual(list(range(20)), sorted(numbers))
+
+    def test_protocol_version(self):
+        sock = socket.create_connection(self.coordinator.server_address)
+        try:
+            msg = recv_message(sock)
+            self.assertEqual(('hello', PROTOCOL_VERSION), msg[:2])
+            send_message(sock, ('hello', PROTOCOL_VERSION + 1,
+                                build_digest(AUTHKEY, msg[2])))
+            self.assertEqual('error', recv_message(sock)[0])
+        finally:
+            sock.close()
+
+    def test_authentication(self):
+        client = CoordinatorClient(self.coordinator.server_address,
+                                   authkey=b'wrong')
+        self.assertRaises(CoordinatorError, client.request, 'size', 'queue')
+        client.close()
+        # Connection is refused before the request is processed
+        sock = socket.create_connection(self.coordinator.server_address)
+        try:
+            recv_message(sock)
+            send_message(sock, ('hello', PROTOCOL_VERSION, b''))
+            self.assertEqual('error', recv_message(sock)[0])
+            self.assertRaises(EOFError, recv_message, sock)
+        finally:
+            sock.close()
+        self.assertRaises(SpiderMisuseError, CoordinatorClient,
+                          self.coordinator.server_address)
+
+    def test_message_types(self):
+        client = CoordinatorClient(self.coordinator.server_address,
+                                   authkey=AUTHKEY)
+        try:
+            client.request('put', 'queue', [(b'\x00\xff', 1, None, 'host')])
+            items = client.request('get', 'queue', 1, 10, [], [])
+            self.assertEqual([b'\x00\xff'], [x[1] for x in items])
+            self.assertRaises(CoordinatorError, client.request, 'foo', 'bar')
+        finally:
+            client.close()
+
+    def test_queue_host_limits(self):
+        queue = CoordinatorQueue(max_connections_per_host=1,
+                                 host_request_delay=10)
+        queue.put([(b'a1', 1, None, 'a'), (b'a2', 2, None, 'a'),
+                   (b'b3', 3, None, 'b'), (b'c4', 4, None, 'c')], 0)
+        items = queue.get(10, 100, 0)
+        self.assertEqual([b'a1', b'b3', b'c4'], [x[1] for x in items])
+        # Host is waiting for the release of its connection
+        self.assertEqual([], queue.get(10, 100, 20))
+        queue.ack([items[0][0]], 20)
+        self.assertEqual([b'a2'], [x[1] for x in queue.get(10, 100, 20)])
+        # Host is waiting for the end of the request delay
+        queue.put([(b'b5', 5, None, 'b')], 20)
+        queue.ack([items[1][0]], 20)
+        items = queue.get(10, 100, 20)
+        self.assertEqual([b'b5'], [x[1] for x in items])
+        queue.put([(b'b6', 6, None, 'b')], 25)
+        queue.ack([items[0][0]], 25)
+        self.assertEqual([], queue.get(10, 100, 25))
+        self.assertEqual(30, queue.delayed_hosts[0][0])
+        self.assertEqual([b'b6'], [x[1] for x in queue.get(10, 100, 30)])
@@ -0,0 +1,191 @@
+import os
+import shutil
+from tempfile import mkdtemp
+
+from tests.util import BaseGrabTestCase, build_spider
+from grab import Grab
+from grab.spider import Spider, Task
+from grab.spider.dupe_filter.base import build_task_fingerprint
+from grab.spider.coordinator import CoordinatorServer
+
+
+class SpiderDupeFilterMixin(object):
+    class SimpleSpider(Spider):
+        def task_page(self, unused_grab, task):
+            self.stat.collect('numbers', task.num)
+
+    def test_add(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_dupe_filter(bot)
+        fingerprints = [build_task_fingerprint(
+            Task('page', url='http://example.com/%d' % x)
+        ) for x in range(100)]
+        self.assertTrue(all(bot.dupe_filter.add(x) for x in fingerprints))
+        self.assertFalse(any(bot.dupe_filter.add(x) for x in fingerprints))
+        self.assertEqual(100, bot.dupe_filter.size())
+        bot.dupe_filter.clear()
+        self.assertEqual(0, bot.dupe_filter.size())
+        self.assertTrue(bot.dupe_filter.add(fingerprints[0]))
+        bot.dupe_filter.close()
+
+    def test_spider(self):
+        server = self.server
+        server.response['get.data'] = 'foo'
+
+        class TestSpider(self.SimpleSpider):
+            def task_generator(self):
+                yield Task('page', url=server.get_url(), num=1)
+                yield Task('page', url=server.get_url(), num=2)
+                yield Task('page', url=server.get_url() + '#foo', num=3)
+                yield Task('page', url=server.get_url(), num=4,
+                           dont_filter=True)
+                yield Task('page', url=server.get_url(), num=5,
+                           refresh_cache=True)
+                yield Task('page', url=server.get_url() + '?x=1', num=6)
+
+        bot = build_spider(TestSpider, thread_number=1)
+        bot.setup_queue()
+        self.setup_dupe_filter(bot)
+        bot.run()
+        self.assertEqual([1, 4, 5, 6], sorted(bot.stat.collections['numbers']))
+        self.assertEqual(2, bot.stat.counters['spider:task-duplicate'])
+        self.assertEqual(2, bot.stat.counters['spider:task-page-duplicate'])
+
+
+class SpiderMemoryDupeFilterTestCase(SpiderDupeFilterMixin, BaseGrabTestCase):
+    def setup_dupe_filter(self, bot, **kwargs):
+        bot.setup_dupe_filter(backend='memory', **kwargs)
+
+    def test_no_dupe_filter(self):
+        bot = build_spider(self.SimpleSpider)
+        bot.setup_queue()
+        for _ in range(2):
+            self.assertTrue(bot.add_task(Task('page', url='http://ya.ru/')))
+        self.assertEqual(2, bot.task_queue.size())
+
+    def test_fingerprint(self):
+        grab = Grab()
+        grab.setup(url='http://example.com/', post={'foo': 'bar'})
+        task = Task('page', grab=grab)
+        self.assertNotEqual(
+            build_task_fingerprint(task),
+            build_task_fingerprint(Task('page', url='http://example.com/')),
+        )
+        grab.setup(post={'foo': 'bar'})
+        self.assertEqual(build_task_fingerprint(task),
+                         build_task_fingerprint(Task('page', grab=grab)))
+
+    def test_retry_is_not_duplicate(self):
+        bot = build_spider(self.SimpleSpider)
+        bot.setup_queue()
+        self.setup_dupe_filter(bot)
+        task = Task('page', url='http://example.com/')
+        self.assertTrue(bot.add_task(task))
+        self.assertFalse(bot.add_task(Task('page', url='http://example.com/')))
+        self.assertTrue(bot.add_task(task.clone()))
+        task.network_try_count = 1
+        self.assertTrue(bot.add_task(task))
+
+
+class SpiderBloomDupeFilterTestCase(SpiderDupeFilterMixin, BaseGrabTestCase):
+    def setUp(self):
+        super(SpiderBloomDupeFilterTestCase, self).setUp()
+        self.tmp_dir = mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'filter.bloom')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(SpiderBloomDupeFilterTestCase, self).tearDown()
+
+    def setup_dupe_filter(self, bot, **kwargs):
+        kwargs.setdefault('error_rate', 0.000001)
+        bot.setup_dupe_filter(backend='bloom', capacity=10, **kwargs)
+
+    def test_scaling(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_dupe_filter(bot, error_rate=0.01)
+        fingerprints = [build_task_fingerprint(
+            Task('page', url='http://example.com/%d' % x)
+        ) for x in range(1000)]
+        self.assertTrue(sum(bot.dupe_filter.add(x) for x in fingerprints)
+                        > 980)
+        self.assertTrue(len(bot.dupe_filter.filters) > 1)
+        self.assertFalse(any(bot.dupe_filter.add(x) for x in fingerprints))
+
+    def test_persistence(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_dupe_filter(bot, path=self.path)
+        fingerprint = build_task_fingerprint(
+            Task('page', url='http://example.com/')
+        )
+        self.assertTrue(bot.dupe_filter.add(fingerprint))
+        bot.dupe_filter.close()
+
+        bot = build_spider(self.SimpleSpider)
+        self.setup_dupe_filter(bot, path=self.path)
+        self.assertFalse(bot.dupe_filter.add(fingerprint))
+
+
+class SpiderSqliteDupeFilterTestCase(SpiderDupeFilterMixin, BaseGrabTestCase):
+    def setUp(self):
+        super(SpiderSqliteDupeFilterTestCase, self).setUp()
+        self.tmp_dir = mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'queue.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(SpiderSqliteDupeFilterTestCase, self).tearDown()
+
+    def setup_dupe_filter(self, bot, **kwargs):
+        bot.setup_dupe_filter(backend='sqlite', path=self.db_path, **kwargs)
+
+    def test_persistence(self):
+        bot = build_spider(self.SimpleSpider)
+        bot.setup_queue(backend='sqlite', path=self.db_path)
+        self.setup_dupe_filter(bot, batch_size=2)
+        for num in range(3):
+            bot.add_task(Task('page', url='http://example.com/%d' % num))
+        bot.task_queue.close()
+        bot.dupe_filter.close()
+
+        bot = build_spider(self.SimpleSpider)
+        bot.setup_queue(backend='sqlite', path=self.db_path)
+        self.setup_dupe_filter(bot)
+        self.assertEqual(3, bot.dupe_filter.size())
+        self.assertEqual(3, bot.task_queue.size())
+        self.assertFalse(bot.add_task(Task('page',
+                                           url='http://example.com/1')))
+        self.assertTrue(bot.add_task(Task('page',
+                                          url='http://example.com/3')))
+        bot.task_queue.close()
+        bot.dupe_filter.close()
+
+
+class SpiderCoordinatorDupeFilterTestCase(SpiderDupeFilterMixin,
+                                          BaseGrabTestCase):
+    def setUp(self):
+        super(SpiderCoordinatorDupeFilterTestCase, self).setUp()
+        self.coordinator = CoordinatorServer(('127.0.0.1', 0),
+                                             authkey=b'secret')
+        self.coordinator.start()
+
+    def tearDown(self):
+        self.coordinator.stop()
+        super(SpiderCoordinatorDupeFilterTestCase, self).tearDown()
+
+    def setup_dupe_filter(self, bot, **kwargs):
+        bot.setup_dupe_filter(backend='coordinator',
+                              address=self.coordinator.server_address,
+                              authkey=b'secret', **kwargs)
+
+    def test_shared_filter(self):
+        bots = [build_spider(self.SimpleSpider) for _ in range(2)]
+        for bot in bots:
+            bot.setup_queue()
+            self.setup_dupe_filter(bot)
+        self.assertTrue(bots[0].add_task(Task('page',
+                                              url='http://example.com/')))
+        self.assertFalse(bots[1].add_task(Task('page',
+                                               url='http://example.com/')))
+        for bot in bots:
+            bot.dupe_filter.close()
@@ -119,9 +119,10 @@ class SpiderErrorTestCase(BaseGrabTestCase):
         bot.run()
         self.assertTrue(isinstance(bot.meta['exc'], GrabTimeoutError))
 
-    @run_test_if(lambda: (GLOBAL['network_service'] == 'multicurl'
-                          and GLOBAL['grab_transport'] == 'pycurl'),
-                 'multicurl & pycurl')
+    @run_test_if(
+        lambda: (GLOBAL['network_service'] in ('multicurl', 'asyncio')
+                 and GLOBAL['grab_transport'] == 'pycurl'),
+        'multicurl|asyncio & pycurl')
     def test_stat_error_name_multi_pycurl(self):
 
         server = self.server
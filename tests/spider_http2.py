@@ -0,0 +1,91 @@
+# pylint: disable=no-name-in-module,import-error
+from distutils.spawn import find_executable
+# pylint: enable=no-name-in-module,import-error
+import os
+import shutil
+import socket
+import subprocess
+from tempfile import mkdtemp
+import time
+
+from grab.spider import Spider, Task
+from tests.util import (BaseGrabTestCase, build_spider, run_test_if,
+                        skip_test_if, GLOBAL)
+
+NGHTTPD = find_executable('nghttpd')
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_port(port, timeout=5):
+    start = time.time()
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+        except socket.error:
+            if time.time() - start > timeout:
+                raise
+            time.sleep(0.05)
+        else:
+            break
+
+
+class SimpleSpider(Spider):
+    def create_grab_instance(self, **kwargs):
+        grab = super(SimpleSpider, self).create_grab_instance(**kwargs)
+        # Test server does not use TLS
+        grab.setup(http_version='2-prior-knowledge')
+        return grab
+
+    def task_generator(self):
+        for num in range(20):
+            yield Task('page', url=self.meta['url'], num=num)
+
+    def task_page(self, grab, task):
+        self.stat.collect('numbers', task.num)
+        self.stat.collect('body', grab.doc.body)
+
+
+class SpiderHttp2TestCase(BaseGrabTestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        with open(os.path.join(self.tmp_dir, 'index.html'), 'wb') as out:
+            out.write(b'foo')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @skip_test_if(lambda: NGHTTPD is None, 'nghttpd is not installed')
+    @run_test_if(
+        lambda: (GLOBAL['network_service'] in ('multicurl', 'asyncio')
+                 and GLOBAL['grab_transport'] == 'pycurl'),
+        'multicurl|asyncio & pycurl')
+    def test_multiplex(self):
+        port = get_free_port()
+        proc = subprocess.Popen([NGHTTPD, '--no-tls', '-d', self.tmp_dir,
+                                 str(port)])
+        try:
+            wait_port(port)
+            bot = build_spider(
+                SimpleSpider, thread_number=10, http2_multiplex=True,
+                curl_max_host_connections=1,
+                meta={'url': 'http://127.0.0.1:%d/index.html' % port},
+            )
+            bot.run()
+        finally:
+            proc.terminate()
+            proc.wait()
+        self.assertEqual(list(range(20)),
+                         sorted(bot.stat.collections['numbers']))
+        self.assertEqual([b'foo'] * 20, bot.stat.collections['body'])
+        # All requests are streams of one connection
+        self.assertEqual(1, bot.stat.counters['spider:http2-connection'])
+        self.assertEqual(20, bot.stat.counters['spider:http2-stream'])
+        self.assertEqual([20], list(
+            bot.network_service.connection_stream_count.values()))
@@ -1,5 +1,9 @@
+import mock
+import pycurl
+
 from grab.spider import Spider, Task
-from tests.util import BaseGrabTestCase, build_spider
+from tests.util import (BaseGrabTestCase, build_grab, build_spider,
+                        run_test_if, GLOBAL)
 
 
 class MiscTest(BaseGrabTestCase):
@@ -27,3 +31,78 @@ class MiscTest(BaseGrabTestCase):
         bot = build_spider(SimpleSpider, thread_number=1)
         bot.run()
         self.assertEqual(2, bot.stat.counters['page_count'])
+
+    @run_test_if(
+        lambda: (GLOBAL['network_service'] in ('multicurl', 'asyncio')
+                 and GLOBAL['grab_transport'] == 'pycurl'),
+        'multicurl|asyncio & pycurl')
+    def test_curl_handle_recycling(self):
+        server = self.server
+
+        class SimpleSpider(Spider):
+            def task_generator(self):
+                yield Task('page', url=server.get_url(), num=0)
+
+            def task_page(self, unused_grab, task):
+                self.stat.collect('numbers', task.num)
+                if task.num < 3:
+                    yield Task('page', url=server.get_url(),
+                               num=task.num + 1)
+
+        bot = build_spider(SimpleSpider, thread_number=1,
+                           curl_max_connects=5, curl_max_host_connections=2)
+        # Each request is sent with new curl handle which
+        # uses the share of the network service
+        bot.network_service.handle_use_limit = 0
+        bot.run()
+        self.assertEqual([0, 1, 2, 3], bot.stat.collections['numbers'])
+
+    @run_test_if(lambda: GLOBAL['network_service'] == 'threaded',
+                 'threaded')
+    def test_threaded_worker_transport_pooling(self):
+        server = self.server
+
+        class SimpleSpider(Spider):
+            def task_generator(self):
+                for _ in range(3):
+                    yield Task('page', url=server.get_url())
+
+            def task_page(self, grab, unused_task):
+                if GLOBAL['grab_transport'] == 'urllib3':
+                    self.stat.collect('pools', id(grab.transport.pool))
+                else:
+                    self.stat.collect('handles', grab.transport.curl)
+
+        bot = build_spider(SimpleSpider, thread_number=1)
+        with mock.patch('pycurl.Curl', wraps=pycurl.Curl) as curl_cls:
+            bot.run()
+        # Requests of one worker use the same connections
+        if GLOBAL['grab_transport'] == 'urllib3':
+            self.assertEqual(3, len(bot.stat.collections['pools']))
+            self.assertEqual(1, len(set(bot.stat.collections['pools'])))
+        else:
+            # Handle of the worker is detached from the grab passed to
+            # the handler, the handler gets new one
+            handles = bot.stat.collections['handles']
+            self.assertEqual(3, len(set(id(x) for x in handles)))
+            self.assertEqual(1 + 3, curl_cls.call_count)
+
+    def test_curl_transport_pool_proxy_handles(self):
+        from grab.spider.network_service.threaded import CurlTransportPool
+
+        pool = CurlTransportPool(size=2)
+        handles = []
+        for proxy in ('h1:1', 'h2:2', 'h1:1', None):
+            grab = build_grab(proxy=proxy)
+            grab.setup_transport(pool.create_transport)
+            pool.borrow(grab)
+            handles.append(grab.transport.curl)
+            pool.release(grab)
+            self.assertFalse(any(x is grab.transport.curl for x in handles))
+        # Handle of the proxy is reused, least recently used handle
+        # is taken for new proxy when the limit is reached
+        self.assertIs(handles[0], handles[2])
+        self.assertIsNot(handles[0], handles[1])
+        self.assertIs(handles[1], handles[3])
+        pool.close()
+        self.assertEqual(0, len(pool.handles))
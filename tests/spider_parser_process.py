@@ -0,0 +1,86 @@
+import os
+
+from grab.spider import Spider, Task
+from grab.spider.error import SpiderMisuseError
+
+from tests.util import BaseGrabTestCase, build_spider
+
+
+class SimpleSpider(Spider):
+    def task_page(self, grab, task):
+        self.stat.collect('pid', os.getpid())
+        self.stat.collect('ppid', os.getppid())
+        self.stat.collect('body', grab.doc.body)
+        self.stat.collect('code', grab.doc.code)
+        self.stat.inc('foo')
+        if not task.get('last'):
+            yield task.clone(last=True)
+
+    def task_fail(self, unused_grab, unused_task):
+        raise Exception('Shit happens!')
+
+    def task_die(self, unused_grab, unused_task):
+        os._exit(1) # pylint: disable=protected-access
+
+
+class ParserProcessTestCase(BaseGrabTestCase):
+    def setUp(self):
+        self.server.reset()
+
+    def test_invalid_backend(self):
+        self.assertRaises(SpiderMisuseError, build_spider, SimpleSpider,
+                          parser_backend='foo')
+
+    def test_handler_result(self):
+        self.server.response['get.data'] = b'Hello spider!'
+        bot = build_spider(SimpleSpider, parser_backend='process')
+        bot.setup_queue()
+        bot.add_task(Task('page', url=self.server.get_url()))
+        bot.run()
+        self.assertEqual([b'Hello spider!'] * 2,
+                         bot.stat.collections['body'])
+        self.assertEqual([200, 200], bot.stat.collections['code'])
+        self.assertEqual(2, bot.stat.counters['foo'])
+        self.assertEqual(2, bot.stat.counters['parser:handler-processed'])
+        self.assertFalse(os.getpid() in bot.stat.collections['pid'])
+
+    def test_handler_error(self):
+        bot = build_spider(SimpleSpider, parser_backend='process')
+        bot.setup_queue()
+        bot.add_task(Task('fail', url=self.server.get_url()))
+        bot.run()
+        self.assertEqual(1, len(bot.stat.collections['fatal']))
+        self.assertTrue('Shit happens!' in bot.stat.collections['fatal'][0])
+
+    def test_large_body(self):
+        # Body that does not fit into shared buffer is sent through pipe
+        self.server.response['get.data'] = b'x' * 100
+        bot = build_spider(SimpleSpider, parser_backend='process')
+        bot.parser_service.shared_buffer_size = 10
+        bot.setup_queue()
+        bot.add_task(Task('page', url=self.server.get_url(), last=True))
+        bot.run()
+        self.assertEqual([b'x' * 100], bot.stat.collections['body'])
+
+    def test_requests_per_process(self):
+        bot = build_spider(SimpleSpider, parser_backend='process',
+                           parser_requests_per_process=1)
+        bot.setup_queue()
+        bot.add_task(Task('page', url=self.server.get_url()))
+        bot.run()
+        self.assertEqual(2, len(set(bot.stat.collections['pid'])))
+        # Replacement process is not forked from multi-threaded
+        # spider process
+        self.assertFalse(os.getpid() in bot.stat.collections['ppid'])
+
+    def test_process_died(self):
+        bot = build_spider(SimpleSpider, parser_backend='process',
+                           thread_number=1)
+        bot.setup_queue()
+        bot.add_task(Task('die', url=self.server.get_url(), priority=1))
+        bot.add_task(Task('page', url=self.server.get_url(), priority=2,
+                          last=True))
+        bot.run()
+        self.assertEqual(1, bot.stat.counters['parser:process-died'])
+        self.assertEqual(1, bot.stat.counters['parser:worker-restarted'])
+        self.assertEqual([200], bot.stat.collections['code'])
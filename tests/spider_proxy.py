@@ -1,13 +1,15 @@
+import socket
+
 from test_server import TestServer
 import six
 
 from tests.util import (
     BaseGrabTestCase, TEST_SERVER_PORT,
-    build_spider, ADDRESS, temp_file
+    build_spider, ADDRESS, temp_file, run_test_if, GLOBAL
 )
 from grab import Grab
 from grab.spider import Spider, Task
-from grab.proxylist import BaseProxySource, Proxy
+from grab.proxylist import BaseProxySource, ListProxySource, Proxy
 
 
 class SimpleSpider(Spider):
@@ -151,3 +153,167 @@ class TestSpiderProxyCase(BaseGrabTestCase):
         self.assertEqual(self.server.request['headers']['host'], 'yandex.ru')
         self.assertEqual(set(bot.stat.collections['ports']),
                          set([TEST_SERVER_PORT]))
+
+    def test_request_uses_own_proxy(self):
+        class TestSpider(Spider):
+            def task_page(self, grab, unused_task):
+                self.stat.collect('pairs', (
+                    grab.config['proxy'],
+                    '%s:%s' % (ADDRESS, grab.doc.headers['Listen-Port']),
+                ))
+
+        bot = build_spider(TestSpider, thread_number=3)
+        bot.setup_queue()
+        bot.load_proxylist(ListProxySource(
+            [x['proxy'] for x in self.extra_servers.values()]))
+        for _ in six.moves.range(30):
+            bot.add_task(Task('page', url='http://yandex.ru/'))
+        bot.run()
+        pairs = bot.stat.collections['pairs']
+        self.assertEqual(30, len(pairs))
+        # Connection to previous proxy of curl handle is never used
+        for proxy, server in pairs:
+            self.assertEqual(proxy, server)
+
+    @run_test_if(
+        lambda: (GLOBAL['network_service'] in ('multicurl', 'asyncio')
+                 and GLOBAL['grab_transport'] == 'pycurl'),
+        'multicurl|asyncio & pycurl')
+    def test_proxy_connection_reuse(self):
+        ports = []
+        for _ in range(2):
+            sock = socket.socket()
+            sock.bind((ADDRESS, 0))
+            ports.append(sock.getsockname()[1])
+            sock.close()
+        server = TestServer(address=ADDRESS, port=ports[0],
+                            extra_ports=ports[1:])
+        server.start(keep_alive=True)
+        proxies = ['%s:%d' % (ADDRESS, x) for x in ports]
+
+        class TestSpider(Spider):
+            def task_generator(self):
+                yield self.build_task(0)
+
+            def build_task(self, num):
+                grab = Grab()
+                grab.setup(url='http://yandex.ru/%d' % num,
+                           proxy=proxies[num % 2], proxy_type='http')
+                return Task('page', grab=grab, num=num)
+
+            def task_page(self, grab, task):
+                self.stat.collect('connect_time', grab.doc.connect_time)
+                if task.num < 5:
+                    yield self.build_task(task.num + 1)
+
+        try:
+            # Requests switch between proxies, curl handle is used
+            # for all requests or new handle is used for each request
+            for handle_use_limit in (100, 0):
+                bot = build_spider(TestSpider, thread_number=1)
+                bot.network_service.handle_use_limit = handle_use_limit
+                bot.run()
+                # Only first request through each proxy opens
+                # the connection
+                times = bot.stat.collections['connect_time']
+                self.assertEqual(6, len(times))
+                self.assertEqual([0] * 4, times[2:])
+        finally:
+            server.stop()
+
+    def test_proxy_health(self):
+        sock = socket.socket()
+        sock.bind((ADDRESS, 0))
+        dead_proxy = '%s:%d' % (ADDRESS, sock.getsockname()[1])
+        sock.close()
+        live_proxy = '%s:%d' % (ADDRESS, self.server.port)
+
+        bot = build_spider(SimpleSpider, thread_number=2,
+                           network_try_limit=10)
+        bot.setup_queue()
+        bot.load_proxylist(ListProxySource([dead_proxy, live_proxy]))
+        for _ in six.moves.range(20):
+            bot.add_task(Task('baz', url='http://yandex.ru/'))
+        bot.run()
+        self.assertEqual(20, len(bot.stat.collections['ports']))
+        stats = bot.proxylist.get_stats()
+        self.assertEqual(0, stats[live_proxy]['failures'])
+        self.assertEqual(20, stats[live_proxy]['requests'])
+        self.assertEqual(stats[dead_proxy]['failures'],
+                         stats[dead_proxy]['requests'])
+        self.assertTrue('Proxies:' in bot.render_stats())
+
+    def test_target_timeout_is_not_proxy_failure(self):
+        proxy = '%s:%d' % (ADDRESS, self.server.port)
+        self.server.response['sleep'] = 2
+
+        bot = build_spider(SimpleSpider, network_try_limit=1)
+        bot.setup_queue()
+        bot.load_proxylist(ListProxySource([proxy]))
+        for _ in six.moves.range(3):
+            bot.add_task(Task('baz', grab=Grab(url='http://yandex.ru/',
+                                               timeout=1)))
+        bot.run()
+        self.assertFalse('ports' in bot.stat.collections)
+        stats = bot.proxylist.get_stats()[proxy]
+        self.assertEqual(0, stats['failures'])
+        self.assertFalse(stats['quarantined'])
+        self.assertEqual(0, bot.stat.counters['spider:proxy-quarantined'])
+
+    def test_proxy_limits(self):
+        class TestSpider(Spider):
+            def task_page(self, unused_grab, unused_task):
+                self.stat.inc('done')
+
+            def process_grab_proxy(self, task, grab):
+                super(TestSpider, self).process_grab_proxy(task, grab)
+                self.stat.collect('active', sum(
+                    x['active'] for x in self.proxylist.get_stats().values()))
+
+        self.server.response['sleep'] = 0.2
+        proxy = '%s:%d' % (ADDRESS, self.server.port)
+        bot = build_spider(TestSpider, thread_number=4,
+                           max_connections_per_proxy=1)
+        bot.setup_queue()
+        bot.load_proxylist(ListProxySource([proxy]))
+        for _ in six.moves.range(4):
+            bot.add_task(Task('page', url='http://yandex.ru/'))
+        bot.run()
+        self.assertEqual(4, bot.stat.counters['done'])
+        self.assertEqual(1, max(bot.stat.collections['active']))
+        self.assertTrue(bot.stat.counters['spider:proxy-wait'] > 0)
+        self.assertTrue(bot.stat.counters['spider:proxy-wait-time'] > 0.4)
+        self.assertEqual(0, bot.proxylist.get_stats()[proxy]['active'])
+        # Acquired proxies are not stored in the attribute shared
+        # between network threads
+        self.assertTrue(bot.proxy is None)
+
+    def test_proxylist_refresh(self):
+        sock = socket.socket()
+        sock.bind((ADDRESS, 0))
+        dead_proxy = '%s:%d' % (ADDRESS, sock.getsockname()[1])
+        sock.close()
+        live_proxy = '%s:%d' % (ADDRESS, self.server.port)
+
+        class TestSpider(Spider):
+            def task_page(self, unused_grab, task):
+                self.stat.inc('done')
+                if task.get('first'):
+                    with open(path, 'w') as out:
+                        out.write(live_proxy)
+                    yield Task('page', url='http://yandex.ru/', delay=0.5)
+
+        with temp_file() as path:
+            with open(path, 'w') as out:
+                out.write('%s\n%s' % (dead_proxy, live_proxy))
+            bot = build_spider(TestSpider, network_try_limit=10)
+            bot.setup_queue()
+            bot.load_proxylist(path, 'text_file', refresh_interval=0.1)
+            bot.add_task(Task('page', url='http://yandex.ru/', first=True))
+            bot.run()
+        self.assertEqual(2, bot.stat.counters['done'])
+        self.assertTrue(bot.stat.counters['spider:proxylist-refresh'] > 0)
+        self.assertEqual([live_proxy],
+                         [x.get_address() for x in bot.proxylist])
+        # Health details of remaining proxy are kept
+        self.assertEqual(2, bot.proxylist.get_stats()[live_proxy]['requests'])
@@ -1,11 +1,19 @@
 from unittest import TestCase
+from datetime import datetime, timedelta
+import os
+import pickle
+import shutil
+import time
+from tempfile import mkdtemp
 import six
+from six.moves.queue import Empty
 
 from tests.util import BaseGrabTestCase, build_spider
 from test_settings import MONGODB_CONNECTION, REDIS_CONNECTION
 from grab.spider.queue_backend.base import QueueInterface
+from grab.spider.coordinator import CoordinatorServer
 from grab.spider import Spider, Task
-from grab.spider.error import SpiderMisuseError
+from grab.spider.error import SpiderError, SpiderMisuseError
 
 
 class SpiderQueueMixin(object):
@@ -55,6 +63,47 @@ class SpiderQueueMixin(object):
         bot.task_queue.clear()
         self.assertEqual(0, bot.task_queue.size())
 
+    def test_put_hook(self):
+        calls = []
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot)
+        bot.task_queue.clear()
+        bot.task_queue.add_put_hook(lambda: calls.append(1))
+        for _ in six.moves.range(3):
+            bot.add_task(Task('page', url=self.server.get_url()))
+        self.assertEqual(3, len(calls))
+        bot.task_queue.clear()
+
+    def test_put_many_get_many(self):
+        calls = []
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot)
+        bot.task_queue.clear()
+        bot.task_queue.add_put_hook(lambda: calls.append(1))
+        bot.task_queue.put_many([
+            (Task('page', url=self.server.get_url(), num=num), num, None)
+            for num in (3, 1, 2)
+        ])
+        self.assertEqual(1, len(calls))
+        self.assertEqual(3, bot.task_queue.size())
+        self.assertEqual([1, 2], [x.num for x in bot.task_queue.get_many(2)])
+        self.assertEqual([3], [x.num for x in bot.task_queue.get_many(2)])
+        self.assertEqual([], bot.task_queue.get_many(2))
+        bot.task_queue.clear()
+
+    def test_add_tasks(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot)
+        bot.task_queue.clear()
+        self.assertEqual(2, bot.add_tasks([
+            Task('page', url=self.server.get_url()),
+            Task('page', url='zzz'),
+            Task('page', url=self.server.get_url()),
+        ]))
+        self.assertEqual(2, bot.task_queue.size())
+        bot.run()
+        self.assertEqual(2, len(bot.stat.collections['url_history']))
+
 
 class SpiderMemoryQueueTestCase(BaseGrabTestCase, SpiderQueueMixin):
     def setup_queue(self, bot):
@@ -95,12 +144,210 @@ class SpiderMemoryQueueTestCase(BaseGrabTestCase, SpiderQueueMixin):
         bot.task_queue.clear()
         self.assertEqual(0, len(bot.task_queue.schedule_list))
 
+    def test_next_schedule_time(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot)
+        self.assertEqual(None, bot.task_queue.get_next_schedule_time())
+        now = datetime.utcnow()
+        for delay in (30, 10, 20):
+            bot.task_queue.put(Task('page', url=self.server.get_url(),
+                                    num=delay),
+                               priority=1,
+                               schedule_time=now + timedelta(seconds=delay))
+        self.assertEqual(now + timedelta(seconds=10),
+                         bot.task_queue.get_next_schedule_time())
+        self.assertRaises(Empty, bot.task_queue.get)
+        # The timeout is limited by the max. time of idle wait
+        self.assertEqual(1, bot.get_delayed_task_timeout())
+
+
+class SpiderSqliteQueueTestCase(SpiderQueueMixin, BaseGrabTestCase):
+    def setUp(self):
+        super(SpiderSqliteQueueTestCase, self).setUp()
+        self.tmp_dir = mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'queue.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(SpiderSqliteQueueTestCase, self).tearDown()
+
+    def setup_queue(self, bot, **kwargs):
+        bot.setup_queue(backend='sqlite', path=self.db_path, **kwargs)
+
+    def test_schedule(self):
+        server = self.server
+
+        class TestSpider(Spider):
+            def task_generator(self):
+                yield Task('page', url=server.get_url(), delay=1.5, num=3)
+                yield Task('page', url=server.get_url(), delay=3, num=2)
+                yield Task('page', url=server.get_url(), delay=2, num=4)
+                yield Task('page', url=server.get_url(), num=1)
+
+            def task_page(self, unused_grab, task):
+                self.stat.collect('numbers', task.num)
+
+        bot = build_spider(TestSpider, thread_number=1)
+        self.setup_queue(bot)
+        bot.run()
+        self.assertEqual(bot.stat.collections['numbers'], [1, 3, 4, 2])
+
+    def test_persistence(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot, batch_size=2)
+        for num in six.moves.range(5):
+            bot.add_task(Task('page', url=self.server.get_url(), num=num,
+                              priority=num + 1),
+                         raise_error=True)
+        self.assertEqual(0, bot.task_queue.get().num)
+        bot.task_queue.close()
+
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot)
+        self.assertEqual(4, bot.task_queue.size())
+        self.assertEqual(set([1, 2, 3, 4]),
+                         set(bot.task_queue.get().num for _ in range(4)))
+        self.assertRaises(Empty, bot.task_queue.get)
+        bot.task_queue.close()
+
+    def test_priority_read_ahead(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot, read_ahead=10)
+        for priority in (5, 6, 7, 1):
+            bot.task_queue.put(Task('page', url=self.server.get_url(),
+                                    priority=priority),
+                               priority=priority)
+            if priority == 5:
+                self.assertEqual(5, bot.task_queue.get().priority)
+        self.assertEqual([1, 6, 7],
+                         [bot.task_queue.get().priority for _ in range(3)])
+        bot.task_queue.close()
+
+    def test_delayed_task_read_ahead(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot, read_ahead=10)
+        for num in range(3):
+            bot.task_queue.put(Task('page', url=self.server.get_url(),
+                                    num=num), priority=5)
+        self.assertEqual(0, bot.task_queue.get().num)
+        # Delayed task becomes available before the read buffer is empty
+        # and goes first in spite of its priority like in memory queue
+        schedule_time = datetime.utcnow() - timedelta(seconds=1)
+        bot.task_queue.put(Task('page', url=self.server.get_url(), num=10),
+                           priority=10, schedule_time=schedule_time)
+        self.assertEqual([10, 1, 2],
+                         [bot.task_queue.get().num for _ in range(3)])
+        bot.task_queue.close()
+
+
+class SpiderCoordinatorQueueTestCase(SpiderQueueMixin, BaseGrabTestCase):
+    def setUp(self):
+        super(SpiderCoordinatorQueueTestCase, self).setUp()
+        self.coordinator = CoordinatorServer(('127.0.0.1', 0),
+                                             authkey=b'secret')
+        self.coordinator.start()
+
+    def tearDown(self):
+        self.coordinator.stop()
+        super(SpiderCoordinatorQueueTestCase, self).tearDown()
+
+    def setup_queue(self, bot, **kwargs):
+        bot.setup_queue(backend='coordinator',
+                        address=self.coordinator.server_address,
+                        authkey=b'secret', **kwargs)
+
+    def test_pickled_task_refused(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot)
+        task = Task('page', url=self.server.get_url(), foo=set([1]))
+        self.assertRaises(SpiderMisuseError, bot.task_queue.put, task, 1)
+        # Pickled data could not be put to the queue by other clients
+        bot.task_queue.client.request(
+            'put', bot.task_queue.queue_name,
+            [(pickle.dumps(task), 1, None, 'localhost')])
+        self.assertRaises(SpiderError, bot.task_queue.get)
+        bot.task_queue.close()
+
+    def test_schedule(self):
+        server = self.server
+
+        class TestSpider(Spider):
+            def task_generator(self):
+                yield Task('page', url=server.get_url(), delay=1.5, num=3)
+                yield Task('page', url=server.get_url(), delay=3, num=2)
+                yield Task('page', url=server.get_url(), delay=2, num=4)
+                yield Task('page', url=server.get_url(), num=1)
+
+            def task_page(self, unused_grab, task):
+                self.stat.collect('numbers', task.num)
+
+        bot = build_spider(TestSpider, thread_number=1)
+        self.setup_queue(bot)
+        bot.run()
+        self.assertEqual(bot.stat.collections['numbers'], [1, 3, 4, 2])
+
+    def test_lease(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot, lease_timeout=0.5)
+        for num in six.moves.range(2):
+            bot.task_queue.put(Task('page', url=self.server.get_url(),
+                                    num=num), priority=num)
+        task = bot.task_queue.get()
+        self.assertEqual(0, task.num)
+        bot.task_queue.complete_task(task)
+        self.assertEqual(1, bot.task_queue.get().num)
+        # Leased task is not available until its lease expires
+        self.assertEqual(1, bot.task_queue.size())
+        self.assertRaises(Empty, bot.task_queue.get)
+        self.assertTrue(bot.task_queue.get_next_schedule_time()
+                        <= datetime.utcnow() + timedelta(seconds=0.5))
+        time.sleep(0.6)
+        self.assertEqual(1, bot.task_queue.get().num)
+        bot.task_queue.close()
+
+    def test_lease_renewal(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot, lease_timeout=1)
+        bot.add_task(Task('page', url=self.server.get_url(), num=1))
+        self.assertEqual(1, bot.task_queue.get().num)
+        time.sleep(0.6)
+        # Lease of the task which is not completed is renewed
+        bot.task_queue.size()
+        time.sleep(0.6)
+        self.assertEqual(1, bot.task_queue.size())
+        self.assertRaises(Empty, bot.task_queue.get)
+        # Lease is renewed with the request of new tasks
+        time.sleep(0.6)
+        self.assertRaises(Empty, bot.task_queue.get)
+        time.sleep(0.6)
+        self.assertRaises(Empty, bot.task_queue.get)
+        bot.task_queue.close()
+
+    def test_host_limits(self):
+        self.coordinator.state.max_connections_per_host = 1
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot)
+        urls = [
+            self.server.get_url(),
+            self.server.get_url().replace('localhost', '127.0.0.1'),
+        ]
+        for num in six.moves.range(4):
+            bot.task_queue.put(Task('page', url=urls[num % 2], num=num),
+                               priority=num)
+        tasks = bot.task_queue.get_many(4)
+        self.assertEqual([0, 1], [x.num for x in tasks])
+        for task in tasks:
+            bot.task_queue.complete_task(task)
+        self.assertEqual([2, 3], [x.num for x in bot.task_queue.get_many(4)])
+        bot.task_queue.close()
+
 
 class BasicSpiderTestCase(SpiderQueueMixin, BaseGrabTestCase):
     _backend = 'mongodb'
 
-    def setup_queue(self, bot):
-        bot.setup_queue(backend='mongodb', **MONGODB_CONNECTION)
+    def setup_queue(self, bot, **kwargs):
+        kwargs.update(MONGODB_CONNECTION)
+        bot.setup_queue(backend='mongodb', **kwargs)
 
     def test_schedule(self):
         """
@@ -130,6 +377,44 @@ class BasicSpiderTestCase(SpiderQueueMixin, BaseGrabTestCase):
         self.setup_queue(bot)
         bot.task_queue.clear()
 
+    def test_lease(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot)
+        bot.task_queue.clear()
+        for _ in six.moves.range(2):
+            bot.add_task(Task('page', url=self.server.get_url()))
+        tasks = bot.task_queue.get_many(2)
+        self.assertEqual(2, len(tasks))
+        # Claimed tasks stay in the queue until they are completed
+        self.assertEqual(2, bot.task_queue.size())
+        self.assertRaises(Empty, bot.task_queue.get)
+        bot.task_queue.complete_task(tasks[0])
+        self.assertEqual(1, bot.task_queue.size())
+        bot.task_queue.clear()
+
+    def test_lease_expired(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot, lease_timeout=0)
+        bot.task_queue.clear()
+        bot.add_task(Task('page', url=self.server.get_url(), num=1))
+        self.assertEqual(1, bot.task_queue.get().num)
+        # Task is available again because its lease has expired
+        self.assertEqual(1, bot.task_queue.get().num)
+        bot.task_queue.clear()
+
+    def test_lease_renewal(self):
+        bot = build_spider(self.SimpleSpider)
+        self.setup_queue(bot, lease_timeout=1)
+        bot.task_queue.clear()
+        bot.add_task(Task('page', url=self.server.get_url(), num=1))
+        self.assertEqual(1, bot.task_queue.get().num)
+        time.sleep(0.6)
+        # Lease of the task which is not completed is renewed
+        bot.task_queue.size()
+        time.sleep(0.6)
+        self.assertRaises(Empty, bot.task_queue.get)
+        bot.task_queue.clear()
+
 
 class SpiderRedisQueueTestCase(SpiderQueueMixin, BaseGrabTestCase):
     _backend = 'redis'
@@ -137,13 +422,34 @@ class SpiderRedisQueueTestCase(SpiderQueueMixin, BaseGrabTestCase):
     def setup_queue(self, bot):
         bot.setup_queue(backend='redis', **REDIS_CONNECTION)
 
-    def test_delay_error(self):
+    def test_schedule(self):
+        server = self.server
+
+        class TestSpider(Spider):
+            def task_generator(self):
+                yield Task('page', url=server.get_url(), delay=1.5, num=3)
+                yield Task('page', url=server.get_url(), delay=3, num=2)
+                yield Task('page', url=server.get_url(), delay=2, num=4)
+                yield Task('page', url=server.get_url(), num=1)
+
+            def task_page(self, unused_grab, task):
+                self.stat.collect('numbers', task.num)
+
+        bot = build_spider(TestSpider, thread_number=1)
+        self.setup_queue(bot)
+        bot.task_queue.clear()
+        bot.run()
+        self.assertEqual(bot.stat.collections['numbers'], [1, 3, 4, 2])
+
+    def test_equal_tasks(self):
         bot = build_spider(self.SimpleSpider)
         self.setup_queue(bot)
         bot.task_queue.clear()
-        self.assertRaises(SpiderMisuseError,
-                          bot.add_task,
-                          Task('page', url=self.server.get_url(), delay=1))
+        for _ in six.moves.range(2):
+            bot.task_queue.put(Task('page', url=self.server.get_url()),
+                               priority=1)
+        self.assertEqual(2, bot.task_queue.size())
+        bot.task_queue.clear()
 
 
 class QueueInterfaceTestCase(TestCase):
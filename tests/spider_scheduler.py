@@ -0,0 +1,110 @@
+import time
+from unittest import TestCase
+
+from six.moves.queue import Empty
+
+from grab.spider import Spider, Task
+from grab.spider.queue_backend.memory import QueueBackend
+from grab.spider.scheduler import HostScheduler
+
+from tests.util import BaseGrabTestCase, build_spider
+
+
+def build_queue(*tasks):
+    task_queue = QueueBackend(spider_name='test')
+    for task in tasks:
+        task_queue.put(task, priority=task.priority)
+    return task_queue
+
+
+class HostSchedulerTestCase(TestCase):
+    def test_priority(self):
+        task_queue = build_queue(
+            Task('page', url='http://a.com/1', priority=3),
+            Task('page', url='http://b.com/1', priority=1),
+            Task('page', url='http://a.com/2', priority=2),
+        )
+        scheduler = HostScheduler(task_queue)
+        self.assertEqual([1, 2, 3], [scheduler.get().priority
+                                     for _ in range(3)])
+        self.assertRaises(Empty, scheduler.get)
+
+    def test_max_connections_per_host(self):
+        task_queue = build_queue(
+            Task('page', url='http://a.com/1', priority=1),
+            Task('page', url='http://a.com/2', priority=2),
+            Task('page', url='http://b.com/1', priority=3),
+        )
+        scheduler = HostScheduler(task_queue, max_connections_per_host=1)
+        task = scheduler.get()
+        self.assertEqual('http://a.com/1', task.url)
+        self.assertEqual('http://b.com/1', scheduler.get().url)
+        self.assertRaises(Empty, scheduler.get)
+        self.assertEqual(1, scheduler.size())
+        scheduler.release(task)
+        # Second release of the same task is ignored
+        scheduler.release(task)
+        self.assertEqual('http://a.com/2', scheduler.get().url)
+        self.assertEqual(0, scheduler.size())
+
+    def test_host_request_delay(self):
+        task_queue = build_queue(
+            Task('page', url='http://a.com/1', priority=1),
+            Task('page', url='http://a.com/2', priority=2),
+        )
+        scheduler = HostScheduler(task_queue, host_request_delay=0.2)
+        scheduler.release(scheduler.get())
+        self.assertRaises(Empty, scheduler.get)
+        time.sleep(0.2)
+        self.assertEqual('http://a.com/2', scheduler.get().url)
+
+    def test_busy_host_does_not_block_other_hosts(self):
+        def build_tasks():
+            return (
+                [Task('page', url='http://a.com/%d' % x, priority=1)
+                 for x in range(500)] +
+                [Task('page', url='http://b%d.com/' % x, priority=2)
+                 for x in range(10)]
+            )
+
+        scheduler = HostScheduler(build_queue(*build_tasks()),
+                                  max_connections_per_host=2,
+                                  buffer_size=100)
+        tasks = scheduler.get_many(50)
+        self.assertEqual(12, len(tasks))
+        self.assertEqual(2, len([x for x in tasks if 'a.com' in x.url]))
+        self.assertEqual(498, scheduler.size())
+        # Size of the buffer is limited
+        scheduler = HostScheduler(build_queue(*build_tasks()),
+                                  max_connections_per_host=2,
+                                  buffer_size=100, max_buffer_size=200)
+        self.assertEqual(2, len(scheduler.get_many(50)))
+        self.assertEqual(200, scheduler.size())
+
+
+class SpiderHostSchedulerTestCase(BaseGrabTestCase):
+    def setUp(self):
+        self.server.reset()
+
+    def test_max_connections_per_host(self):
+        class TestSpider(Spider):
+            def task_generator(self):
+                for _ in range(4):
+                    yield Task('page', url=server.get_url())
+
+            def task_page(self, unused_grab, unused_task):
+                self.stat.inc('pages')
+
+            def check_task_limits(self, task):
+                self.stat.collect('connections', sum(
+                    self.task_scheduler.host_connections.values()))
+                return super(TestSpider, self).check_task_limits(task)
+
+        server = self.server
+        server.response['sleep'] = 0.1
+        bot = build_spider(TestSpider, thread_number=4,
+                           max_connections_per_host=1)
+        bot.setup_queue()
+        bot.run()
+        self.assertEqual(4, bot.stat.counters['pages'])
+        self.assertEqual([1, 1, 1, 1], bot.stat.collections['connections'])
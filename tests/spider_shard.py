@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+
+from tests.util import BaseGrabTestCase, build_spider
+from grab.spider import Spider, Task
+from grab.spider.shard import (
+    ShardRouter, ShardSupervisor, get_host_shard, get_task_shard,
+    get_shard_checkpoint_path,
+)
+from grab.spider.task_codec import decode_task
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.messages = []
+
+    def send(self, msg):
+        self.messages.append(msg)
+
+
+class SimpleSpider(Spider):
+    def task_generator(self):
+        for num in range(4):
+            yield Task('page', url=self.meta['urls'][num % 2], num=num)
+
+    def task_page(self, unused_grab, task):
+        self.stat.collect('numbers', task.num)
+        if task.num < 4:
+            # Task of the other host
+            yield Task('page', url=self.meta['urls'][(task.num + 1) % 2],
+                       num=task.num + 10)
+
+
+class SpiderShardTestCase(BaseGrabTestCase):
+    def setUp(self):
+        self.server.reset()
+        self.server.response['get.data'] = 'foo'
+        # Hosts of different shards
+        self.urls = [
+            self.server.get_url(),
+            self.server.get_url().replace('localhost', '127.0.0.1'),
+        ]
+
+    def test_get_host_shard(self):
+        self.assertEqual(1, get_host_shard('localhost', 2))
+        self.assertEqual(0, get_host_shard('127.0.0.1', 2))
+        self.assertEqual(0, get_task_shard(Task('page', url=self.urls[1]),
+                                           2))
+
+    def test_add_task_routing(self):
+        bot = build_spider(SimpleSpider)
+        bot.setup_queue()
+        conn = FakeConnection()
+        bot.shard_router = ShardRouter(bot, 1, 2, conn)
+        self.assertTrue(bot.add_task(Task('page', url=self.urls[0], num=1)))
+        self.assertTrue(bot.add_task(Task('page', url=self.urls[1], num=2)))
+        self.assertEqual(1, bot.add_tasks([
+            Task('page', url=self.urls[0], num=3),
+            Task('page', url=self.urls[1], num=4),
+        ]))
+        self.assertEqual(2, bot.task_queue.size())
+        self.assertEqual([('task', 0), ('task', 0)],
+                         [x[:2] for x in conn.messages])
+        self.assertEqual([2, 4], [decode_task(x[2]).num
+                                  for x in conn.messages])
+        self.assertEqual(2, bot.stat.counters['spider:task-routed'])
+
+    def test_supervisor(self):
+        bot = build_spider(SimpleSpider, meta={'urls': self.urls})
+        supervisor = ShardSupervisor(bot, 2)
+        supervisor.run()
+        self.assertEqual([0, 1, 2, 3, 10, 11, 12, 13],
+                         sorted(bot.stat.collections['numbers']))
+        self.assertEqual(8, bot.stat.counters['spider:task-page'])
+        self.assertEqual(6, bot.stat.counters['spider:task-routed'])
+
+    def test_shard_checkpoint_path(self):
+        self.assertEqual('/tmp/crawl_shard1.state',
+                         get_shard_checkpoint_path('/tmp/crawl.state', 1))
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'crawl.state')
+            bot = build_spider(SimpleSpider, meta={'urls': self.urls},
+                               checkpoint_path=path)
+            ShardSupervisor(bot, 2).run()
+            self.assertEqual(['crawl_shard0.state', 'crawl_shard1.state'],
+                             sorted(os.listdir(tmp_dir)))
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -1,3 +1,5 @@
+import pickle
+
 from weblib.error import ResponseNotValid
 
 from tests.util import BaseGrabTestCase, build_grab, build_spider
@@ -87,6 +89,42 @@ class TestSpiderTestCase(BaseGrabTestCase):
         self.assertEqual(task2.name, 'baz')
         self.assertEqual(task2.url, 'http://example.com/new')
 
+    def test_task_clone_copies_grab_config(self):
+        grab = Grab()
+        grab.setup(url='http://example.com/path')
+        task = Task('baz', grab=grab, foo='bar')
+        task2 = task.clone()
+        # Config is shared until it is accessed
+        self.assertTrue(task2.peek_grab_config() is task.peek_grab_config())
+        task2.grab_config['headers']['X-Foo'] = 'bar'
+        task2.grab_config['url'] = 'http://example.com/other'
+        self.assertFalse('X-Foo' in task.grab_config['headers'])
+        self.assertEqual(task.grab_config['url'], 'http://example.com/path')
+        self.assertFalse(task2.grab_config is task.grab_config)
+        self.assertEqual(task2.foo, 'bar')
+
+        task3 = task.clone(url='http://example.com/new')
+        self.assertFalse(task3.grab_config is task.grab_config)
+        self.assertEqual(task3.grab_config['url'], 'http://example.com/new')
+        self.assertEqual(task.grab_config['url'], 'http://example.com/path')
+
+        task4 = pickle.loads(pickle.dumps(task.clone()))
+        self.assertEqual(task4.grab_config['url'], 'http://example.com/path')
+
+    def test_task_extra_attributes(self):
+        task = Task('baz', url='http://example.com/path', foo='bar')
+        self.assertEqual(task.foo, 'bar')
+        task.spam = 1
+        self.assertEqual(task.extras, {'foo': 'bar', 'spam': 1})
+        self.assertEqual(task.get('spam'), 1)
+        self.assertEqual(task.get('eggs', 2), 2)
+        self.assertRaises(AttributeError, getattr, task, 'eggs')
+
+        task2 = pickle.loads(pickle.dumps(task))
+        self.assertEqual(task2.url, 'http://example.com/path')
+        self.assertEqual(task2.spam, 1)
+        self.assertEqual(task2.foo, 'bar')
+
     def test_task_useragent(self):
         bot = build_spider(SimpleSpider, )
         bot.setup_queue()
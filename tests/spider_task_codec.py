@@ -0,0 +1,108 @@
+from unittest import TestCase
+import pickle
+
+from grab import Grab
+from grab.spider import Task
+from grab.spider.task_codec import (
+    pack_task, unpack_task, encode_task, decode_task,
+    JSON_PREFIX, PICKLE_PREFIX,
+)
+from grab.spider.error import SpiderError
+
+
+class CustomValue(object):
+    def __init__(self, value):
+        self.value = value
+
+
+def build_grab():
+    grab = Grab()
+    grab.setup(url='http://example.com/', post={'foo': 'bar'},
+               headers={'X-Foo': 'bar'})
+    grab.cookies.set('session', 'abc', 'example.com')
+    return grab
+
+
+class TaskCodecTestCase(TestCase):
+    def assert_same_task(self, task, task2):
+        self.assertEqual(task.name, task2.name)
+        self.assertEqual(task.url, task2.url)
+        self.assertEqual(task.priority, task2.priority)
+        self.assertEqual(task.grab_config['post'], task2.grab_config['post'])
+        self.assertEqual(task.grab_config['headers'],
+                         task2.grab_config['headers'])
+        self.assertEqual(task.grab_config['timeout'],
+                         task2.grab_config['timeout'])
+        grab = Grab()
+        grab.load_config(task2.grab_config)
+        self.assertEqual('abc', grab.cookies['session'])
+
+    def test_pack_task(self):
+        task = Task('page', grab=build_grab(), priority=5, num=1)
+        data = pack_task(task)
+        self.assertEqual(
+            set(['url', 'post', 'headers', 'state']),
+            set(data['grab_config'].keys()),
+        )
+        task2 = unpack_task(data)
+        self.assert_same_task(task, task2)
+        self.assertEqual(1, task2.num)
+
+    def test_shared_cookie_list(self):
+        grab = build_grab()
+        data = pack_task(Task('page', grab=grab))
+        data2 = pack_task(Task('page', grab=grab))
+        self.assertTrue(data['grab_config']['state']['cookiejar_cookies'] is
+                        data2['grab_config']['state']['cookiejar_cookies'])
+
+    def test_encode_task(self):
+        task = Task('page', grab=build_grab(), priority=5, delay=10)
+        data = encode_task(task)
+        self.assertEqual(JSON_PREFIX, data[:2])
+        task2 = decode_task(data)
+        self.assert_same_task(task, task2)
+        self.assertEqual(task.schedule_time.replace(microsecond=0),
+                         task2.schedule_time.replace(microsecond=0))
+
+    def test_encode_custom_object(self):
+        task = Task('page', url='http://example.com/',
+                    obj=CustomValue(1))
+        data = encode_task(task)
+        self.assertEqual(PICKLE_PREFIX, data[:2])
+        self.assertEqual(1, decode_task(data).obj.value)
+
+    def test_encode_json_types(self):
+        task = Task('page', url='http://example.com/', valid_status=(404,),
+                    raw_data=b'\xff\x00', pairs={(1, 2): [u'\u0444']},
+                    tagged={'__bytes__': 1})
+        task2 = decode_task(encode_task(task))
+        self.assertEqual((404,), task2.valid_status)
+        self.assertEqual(b'\xff\x00', task2.raw_data)
+        self.assertEqual({(1, 2): [u'\u0444']}, task2.pairs)
+        self.assertEqual({'__bytes__': 1}, task2.tagged)
+
+    def test_pickle_not_allowed(self):
+        task = Task('page', url='http://example.com/',
+                    obj=CustomValue(1))
+        self.assertRaises(TypeError, encode_task, task, allow_pickle=False)
+        data = encode_task(task)
+        self.assertRaises(SpiderError, decode_task, data, allow_pickle=False)
+        self.assertRaises(SpiderError, decode_task, pickle.dumps(task),
+                          allow_pickle=False)
+
+    def test_decode_pickled_task(self):
+        task = Task('page', url='http://example.com/', num=1)
+        task2 = decode_task(pickle.dumps(task))
+        self.assertEqual(1, task2.num)
+
+    def test_unpacked_configs_not_shared(self):
+        grab = Grab()
+        grab.setup(url='http://example.com/')
+        data = pack_task(Task('page', grab=grab))
+        config = unpack_task(data).grab_config
+        config2 = unpack_task(data).grab_config
+        for key in ('state', 'cookies', 'headers', 'common_headers'):
+            self.assertFalse(config[key] is config2[key])
+        config['state']['foo'] = 'bar'
+        self.assertEqual({}, config2['state'])
+        self.assertEqual({}, Grab().config['state'])